@@ -0,0 +1,97 @@
+"""保存期間を過ぎた予約枠・予約をアーカイブテーブルへ移動するジョブ
+
+使い方:
+    python -m api.archive --horizon-days 90 --batch-size 1000
+"""
+import argparse
+import os
+from datetime import date, timedelta
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+
+from . import models
+from .availability import bump_version_statement, slot_change_statements
+
+# 今日からこの日数より前の予約枠をアーカイブする
+ARCHIVE_HORIZON_DAYS = int(os.getenv("ARCHIVE_HORIZON_DAYS", "90"))
+# 1トランザクションで移動する予約枠の件数
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+
+SLOT_COLUMNS = (
+    "id", "date", "start_time", "end_time", "capacity", "available_spots", "is_active", "created_at", "version",
+)
+RESERVATION_COLUMNS = (
+    "id", "patient_id", "slot_id", "daily_number", "reservation_date", "qr_code_data", "is_confirmed", "created_at",
+)
+
+
+def _copy_rows(db: Session, source, target, columns, condition):
+    """条件に合う行を INSERT ... SELECT でアーカイブテーブルにコピー"""
+    db.execute(
+        insert(target).from_select(
+            list(columns),
+            select(*[getattr(source, column) for column in columns]).where(condition),
+        )
+    )
+
+
+def archive_before(db: Session, cutoff: date, batch_size: int = ARCHIVE_BATCH_SIZE):
+    """cutoff より前の予約枠と予約をバッチ単位でアーカイブし、移動件数を返す"""
+    archived = {"slots": 0, "reservations": 0}
+    while True:
+        slot_ids = db.execute(
+            select(models.TimeSlot.id)
+            .where(models.TimeSlot.date < cutoff)
+            .order_by(models.TimeSlot.id)
+            .limit(batch_size)
+        ).scalars().all()
+        if not slot_ids:
+            break
+
+        in_slots = models.TimeSlot.id.in_(slot_ids)
+        reservations_in_slots = models.Reservation.slot_id.in_(slot_ids)
+
+        # 予約枠 → 予約の順にコピーしてから、参照元の予約 → 予約枠の順に削除
+        _copy_rows(db, models.TimeSlot, models.ArchivedTimeSlot, SLOT_COLUMNS, in_slots)
+        _copy_rows(db, models.Reservation, models.ArchivedReservation, RESERVATION_COLUMNS, reservations_in_slots)
+        db.execute(delete(models.WaitlistEntry).where(models.WaitlistEntry.slot_id.in_(slot_ids)))
+        result = db.execute(delete(models.Reservation).where(reservations_in_slots))
+        db.execute(delete(models.TimeSlot).where(in_slots))
+        version = db.scalar(bump_version_statement().returning(models.AvailabilityVersion.version))
+        for statement, params in slot_change_statements(version, slot_ids):
+            db.execute(statement, params)
+        db.commit()
+
+        archived["slots"] += len(slot_ids)
+        archived["reservations"] += result.rowcount
+
+    # 過去の日はルールから作成されないため、削除・移動済みの記録も不要
+    db.execute(delete(models.SlotTombstone).where(models.SlotTombstone.date < cutoff))
+    db.commit()
+    return archived
+
+
+def main():
+    from .database import SessionLocal, engine
+    from .migrations import run_migrations
+
+    parser = argparse.ArgumentParser(description="保存期間を過ぎた予約枠・予約をアーカイブします")
+    parser.add_argument("--horizon-days", type=int, default=ARCHIVE_HORIZON_DAYS)
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+
+    cutoff = date.today() - timedelta(days=args.horizon_days)
+    db = SessionLocal()
+    try:
+        archived = archive_before(db, cutoff, args.batch_size)
+    finally:
+        db.close()
+    print(f"{cutoff} より前の予約枠 {archived['slots']} 件、予約 {archived['reservations']} 件をアーカイブしました")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+from typing import Iterable, Optional, Union
+
+from sqlalchemy import Select, delete, insert, literal, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+from .availability_index import AvailabilityIndex, SlotChange, minute_of_day
+from .cache import TTLCache
+
+# 日別の空き状況サマリーのキャッシュ（カレンダー表示用）
+SUMMARY_CACHE_MAX_ENTRIES = 256
+SUMMARY_CACHE_TTL_SECONDS = 30
+summary_cache = TTLCache(maxsize=SUMMARY_CACHE_MAX_ENTRIES, ttl_seconds=SUMMARY_CACHE_TTL_SECONDS)
+
+# 日 × 開始分の配列で空き状況を保持するプロセス内インデックス（カレンダー・範囲検索用）
+availability_index = AvailabilityIndex()
+
+# 空き状況のバージョンを保持する行のID
+AVAILABILITY_VERSION_ID = 1
+
+# 変更ログを削除する間隔（バージョン数）と、削除せずに残すバージョン数
+SLOT_CHANGES_COMPACT_EVERY = 500
+SLOT_CHANGES_RETAIN_VERSIONS = 10000
+
+
+def bump_version_statement():
+    """空き状況のバージョンを1加算するUPDATE文"""
+    version = models.AvailabilityVersion
+    return update(version).where(version.id == AVAILABILITY_VERSION_ID).values(version=version.version + 1)
+
+
+def slot_change_statements(version: int, changed: Union[Iterable[int], Select, None]):
+    """変更ログへの追記と、一定間隔での古いログの削除を行う (文, パラメータ) の一覧
+
+    changed は変更された予約枠IDの一覧、または予約枠IDを返すSELECT。
+    """
+    log = models.SlotChangeLog.__table__
+    statements = []
+    if isinstance(changed, Select):
+        slot_ids = changed.subquery()
+        statements.append((insert(log).from_select(["version", "slot_id"], select(literal(version), *slot_ids.c)), None))
+    elif changed:
+        statements.append((insert(log), [{"version": version, "slot_id": slot_id} for slot_id in sorted(set(changed))]))
+
+    if version % SLOT_CHANGES_COMPACT_EVERY == 0 and version > SLOT_CHANGES_RETAIN_VERSIONS:
+        compacted = version - SLOT_CHANGES_RETAIN_VERSIONS
+        statements.append((delete(log).where(log.c.version <= compacted), None))
+        statements.append((
+            update(models.AvailabilityVersion)
+            .where(models.AvailabilityVersion.id == AVAILABILITY_VERSION_ID)
+            .values(compacted_version=compacted),
+            None
+        ))
+    return statements
+
+
+async def bump_availability_version(db: AsyncSession, changed: Union[Iterable[int], Select, None] = None) -> int:
+    """空き状況のバージョンを加算し、加算後のバージョンを返す（変更と同じトランザクション内で呼び出す）
+
+    changed に変更された予約枠を渡すと、差分同期用の変更ログに記録する。
+    """
+    version = await db.scalar(bump_version_statement().returning(models.AvailabilityVersion.version))
+    for statement, params in slot_change_statements(version, changed):
+        await db.execute(statement, params)
+    return version
+
+
+async def get_availability_version(db: AsyncSession) -> int:
+    """現在の空き状況のバージョンを取得"""
+    version = models.AvailabilityVersion
+    return await db.scalar(select(version.version).where(version.id == AVAILABILITY_VERSION_ID)) or 0
+
+
+async def load_availability_index(db: AsyncSession):
+    """インデックスがDBの空き状況のバージョンと一致しない場合は読み直す"""
+    version = await get_availability_version(db)
+    if availability_index.version == version:
+        return availability_index
+
+    rows = (await db.execute(
+        select(models.TimeSlot.date, models.TimeSlot.start_time, models.TimeSlot.capacity, models.TimeSlot.available_spots)
+        .where(models.TimeSlot.is_active == True)
+    )).all()
+    # 読み込み中に他の変更がコミットされた場合は、バージョンを付けずに次の参照で読み直す
+    if await get_availability_version(db) != version:
+        version = None
+    availability_index.load(
+        [(slot_date, minute_of_day(start_time), 1, capacity, available) for slot_date, start_time, capacity, available in rows],
+        version
+    )
+    return availability_index
+
+
+def notify_availability_changed(version: Optional[int] = None, changes: Optional[Iterable[SlotChange]] = None):
+    """予約枠や予約の変更をコミットした後に呼び出し、キャッシュとインデックスに反映する
+
+    変更後のバージョンと差分が渡された場合はインデックスを差分で更新し、
+    渡されない場合は次の参照時にDBから読み直す。
+    """
+    summary_cache.clear()
+    if version is None or changes is None:
+        availability_index.invalidate()
+    else:
+        availability_index.apply(version, changes)
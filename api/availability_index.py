@@ -0,0 +1,133 @@
+import threading
+from datetime import date, time, timedelta
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+MINUTES_PER_DAY = 24 * 60
+
+# (日付, 開始分, 枠数の増減, 定員の増減, 残り枠の増減)
+SlotChange = Tuple[date, int, int, int, int]
+
+
+def minute_of_day(value: time):
+    """時刻を0時からの分数に変換"""
+    return value.hour * 60 + value.minute
+
+
+def slot_change(slot, sign: int = 1) -> SlotChange:
+    """予約枠1件分の追加（sign=1）または削除（sign=-1）を表す変更"""
+    return (slot.date, minute_of_day(slot.start_time), sign, sign * slot.capacity, sign * slot.available_spots)
+
+
+def available_change(slot, delta: int) -> SlotChange:
+    """予約・キャンセルによる残り枠の増減を表す変更"""
+    return (slot.date, minute_of_day(slot.start_time), 0, 0, delta)
+
+
+def inserted_rows_changes(rows) -> List[SlotChange]:
+    """一括INSERTした予約枠の行（辞書）から変更の一覧を作る"""
+    return [
+        (row["date"], minute_of_day(row["start_time"]), 1, row["capacity"], row["available_spots"])
+        for row in rows
+    ]
+
+
+class AvailabilityIndex:
+    """有効な予約枠の枠数・定員・残り枠を「日 × 開始分」の配列で保持するプロセス内インデックス
+
+    最初の参照時にDBから読み込み、以降は変更処理から差分を受け取って更新する。
+    空き状況のバージョンが連続しない場合（他プロセスの変更など）は次の参照時に読み直す。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version: Optional[int] = None
+        self.first_day: Optional[date] = None
+        self.slots = np.zeros((0, MINUTES_PER_DAY), dtype=np.int32)
+        self.capacity = np.zeros((0, MINUTES_PER_DAY), dtype=np.int32)
+        self.available = np.zeros((0, MINUTES_PER_DAY), dtype=np.int32)
+
+    def load(self, rows: Iterable[SlotChange], version: Optional[int]):
+        """予約枠の一覧から配列を作り直す"""
+        rows = list(rows)
+        with self._lock:
+            self.first_day = min((row[0] for row in rows), default=date.today())
+            days = max((row[0] for row in rows), default=self.first_day) - self.first_day
+            shape = (days.days + 1, MINUTES_PER_DAY)
+            self.slots = np.zeros(shape, dtype=np.int32)
+            self.capacity = np.zeros(shape, dtype=np.int32)
+            self.available = np.zeros(shape, dtype=np.int32)
+            self._apply(rows)
+            self.version = version
+
+    def apply(self, version: int, changes: Iterable[SlotChange]):
+        """変更処理のコミット後に差分を反映する（バージョンが連続しない場合は読み直し待ちにする）"""
+        with self._lock:
+            if self.version is None:
+                return
+            if version != self.version + 1:
+                self.version = None
+                return
+            self._apply(list(changes))
+            self.version = version
+
+    def invalidate(self):
+        """差分で更新できない変更の後に呼び出し、次の参照時に読み直す"""
+        with self._lock:
+            self.version = None
+
+    def _apply(self, changes):
+        if not changes:
+            return
+        self._ensure_days(min(change[0] for change in changes), max(change[0] for change in changes))
+        rows = np.array([(change[0] - self.first_day).days for change in changes])
+        minutes = np.array([change[1] for change in changes])
+        deltas = np.array([change[2:] for change in changes], dtype=np.int32)
+        # 同じ枠への複数の変更も合算されるよう np.add.at を使う
+        np.add.at(self.slots, (rows, minutes), deltas[:, 0])
+        np.add.at(self.capacity, (rows, minutes), deltas[:, 1])
+        np.add.at(self.available, (rows, minutes), deltas[:, 2])
+
+    def _ensure_days(self, start: date, end: date):
+        """配列の範囲外の日付が来た場合は前後に行を追加する"""
+        before = max((self.first_day - start).days, 0)
+        after = max((end - self.first_day).days + 1 - len(self.slots), 0)
+        if before or after:
+            padding = ((before, after), (0, 0))
+            self.slots = np.pad(self.slots, padding)
+            self.capacity = np.pad(self.capacity, padding)
+            self.available = np.pad(self.available, padding)
+            self.first_day -= timedelta(days=before)
+
+    def summarize(self, start: date, end: date, from_minute: int = 0, to_minute: int = MINUTES_PER_DAY - 1):
+        """期間内の日別の枠数・定員・残り枠・最初の空き時刻を開始時刻の範囲で集計する"""
+        with self._lock:
+            first = max((start - self.first_day).days, 0)
+            last = min((end - self.first_day).days, len(self.slots) - 1)
+            if first > last:
+                return []
+            window = (slice(first, last + 1), slice(from_minute, to_minute + 1))
+            slot_counts = self.slots[window].sum(axis=1)
+            capacity = self.capacity[window].sum(axis=1)
+            available = self.available[window]
+            remaining = available.sum(axis=1)
+            free = available > 0
+            has_free = free.any(axis=1)
+            first_free = free.argmax(axis=1) + from_minute
+            first_day = self.first_day
+
+        summary = []
+        for offset in np.flatnonzero(slot_counts):
+            first_available_time = None
+            if has_free[offset]:
+                minute = int(first_free[offset])
+                first_available_time = time(minute // 60, minute % 60)
+            summary.append({
+                "date": first_day + timedelta(days=first + int(offset)),
+                "slots": int(slot_counts[offset]),
+                "capacity": int(capacity[offset]),
+                "remaining": int(remaining[offset]),
+                "first_available_time": first_available_time
+            })
+        return summary
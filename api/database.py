@@ -1,21 +1,129 @@
-from sqlalchemy import create_engine
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+# 接続先（既定はSQLite。本番環境では DATABASE_URL で適切なDBに変更することをお勧めします）
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./clinic_reservation.db")
+
+# 接続プールの設定
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+# この秒数より古い接続は使い回さずに接続し直す（-1 で無効）
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+# tuned: 下記のPRAGMAと非同期エンジンの接続プールを使う / default: ドライバの既定値のまま
+DB_PROFILE = os.getenv("DB_PROFILE", "tuned")
+
+# SQLiteの接続ごとに設定するPRAGMA
+# WALでは読み取りが書き込みを待たず、synchronous=NORMAL でもアプリの異常終了ではコミット済みのデータは失われない
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "16384"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+
+def to_async_url(url: str) -> str:
+    """同期ドライバのURLを非同期ドライバのURLに変換する"""
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    if url.startswith("postgresql:"):
+        return url.replace("postgresql:", "postgresql+asyncpg:", 1)
+    return url
+
+
+def is_sqlite_file(url: str) -> bool:
+    parsed = make_url(url)
+    return parsed.get_backend_name() == "sqlite" and parsed.database not in (None, "", ":memory:")
+
+
+def sqlite_pragmas():
+    """接続ごとに実行するPRAGMA文"""
+    return [
+        f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}",
+        f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}",
+        f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+        f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}",
+        f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}",
+    ]
+
 
-# SQLiteを使用（本番環境では適切なDBに変更することをお勧めします）
-SQLALCHEMY_DATABASE_URL = "sqlite:///./clinic_reservation.db"
+def _apply_sqlite_pragmas(sync_engine):
+    @event.listens_for(sync_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for statement in sqlite_pragmas():
+            cursor.execute(statement)
+        cursor.close()
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+
+def _engine_options(url: str, profile: str, is_async: bool):
+    """ドライバとプロファイルに応じた create_engine の引数"""
+    options = {}
+    if make_url(url).get_backend_name() == "sqlite":
+        options["connect_args"] = {"check_same_thread": False}
+        if not is_sqlite_file(url):
+            return options
+        if is_async:
+            if profile != "tuned":
+                return options
+            # aiosqliteの既定（NullPool）は接続ごとにスレッドを作り直すため、接続プールを使う
+            # SQLiteの接続はサーバー側の上限がないため、書き込み待ちで読み取りが接続を待たされないよう上限を設けない
+            options.update(poolclass=AsyncAdaptedQueuePool, pool_size=DB_POOL_SIZE, max_overflow=-1, pool_recycle=DB_POOL_RECYCLE)
+            return options
+    options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_recycle=DB_POOL_RECYCLE)
+    return options
+
+
+def create_db_engine(url: str = SQLALCHEMY_DATABASE_URL, profile: str = DB_PROFILE):
+    """マイグレーションやCLIなど同期処理用のエンジンを作成する"""
+    db_engine = create_engine(url, **_engine_options(url, profile, is_async=False))
+    if profile == "tuned" and is_sqlite_file(url):
+        _apply_sqlite_pragmas(db_engine)
+    return db_engine
+
+
+def create_async_db_engine(url: str = SQLALCHEMY_DATABASE_URL, profile: str = DB_PROFILE):
+    """APIリクエスト処理用の非同期エンジンを作成する"""
+    db_engine = create_async_engine(to_async_url(url), **_engine_options(url, profile, is_async=True))
+    if profile == "tuned" and is_sqlite_file(url):
+        _apply_sqlite_pragmas(db_engine.sync_engine)
+    return db_engine
+
+
+# マイグレーションやCLIなど同期処理用のエンジン
+engine = create_db_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# APIリクエスト処理用の非同期エンジン
+async_engine = create_async_db_engine()
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+# SQLiteは同時に1つの接続しか書き込めないため、tunedではプロセス内の予約の書き込みを順番に行う
+# （多数の接続がbusy_timeoutの間ロックを取り合うと、待ちがタイムアウトしてエラーになる）
+_sqlite_write_lock = asyncio.Lock() if DB_PROFILE == "tuned" and is_sqlite_file(SQLALCHEMY_DATABASE_URL) else None
+
+
+@asynccontextmanager
+async def serialized_write():
+    """書き込みトランザクションを同じプロセス内の他の書き込みと重ならないように実行する"""
+    if _sqlite_write_lock is None:
+        yield
+        return
+    async with _sqlite_write_lock:
+        yield
+
+
 Base = declarative_base()
 
 # DBセッションの依存関係
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
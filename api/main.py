@@ -3,10 +3,12 @@ from fastapi.middleware.cors import CORSMiddleware
 
 from . import models
 from .database import engine
-from .routers import auth, slots, reservations
+from .migrations import run_migrations
+from .routers import auth, slots, reservations, waitlist, schedule
 
 # データベースのテーブルを作成
 models.Base.metadata.create_all(bind=engine)
+run_migrations(engine)
 
 app = FastAPI(title="クリニック予約システム API")
 
@@ -23,6 +25,8 @@ app.add_middleware(
 app.include_router(auth.router, tags=["Authentication"])
 app.include_router(slots.router, tags=["Time Slots"])
 app.include_router(reservations.router, tags=["Reservations"])
+app.include_router(waitlist.router, tags=["Waitlist"])
+app.include_router(schedule.router, tags=["Schedule"])
 
 
 @app.get("/")
@@ -0,0 +1,280 @@
+from sqlalchemy import Column, DateTime, MetaData, String, Table, inspect, text
+from sqlalchemy.schema import CreateTable
+from datetime import datetime
+
+# 適用済みマイグレーションを記録するテーブル
+metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    metadata,
+    Column("version", String, primary_key=True),
+    Column("applied_at", DateTime, default=datetime.now),
+)
+
+
+def _columns(conn, table):
+    """テーブルのカラム名の集合"""
+    return {column["name"] for column in inspect(conn).get_columns(table)}
+
+
+def _has_legacy_slot_columns(conn):
+    """予約枠の日付・時刻が旧形式（DateTime / Time）のカラムかどうか（新規作成のDBでは False）"""
+    return "date" in _columns(conn, "time_slots")
+
+
+def backfill_daily_counters(conn):
+    """既存の予約から日ごとの最大予約番号を採番テーブルに反映"""
+    if not _has_legacy_slot_columns(conn):
+        return
+    conn.execute(text(
+        """
+        INSERT INTO daily_counters (day, last_number)
+        SELECT date(time_slots.date), MAX(reservations.daily_number)
+        FROM reservations
+        JOIN time_slots ON time_slots.id = reservations.slot_id
+        WHERE date(time_slots.date) NOT IN (SELECT day FROM daily_counters)
+        GROUP BY date(time_slots.date)
+        """
+    ))
+
+
+def cancel_same_day_duplicates(conn):
+    """同じ患者の同じ日の予約が複数ある場合、最初の予約だけを残して他はキャンセルし、キャンセルした予約を返す
+
+    一意インデックスを作成する前に実行する（旧バージョンでは同じ日に複数の予約ができた）。
+    キャンセルした予約の枠は空きに戻す。
+    """
+    duplicates = conn.execute(text(
+        """
+        SELECT id, patient_id, reservation_date, slot_id
+        FROM reservations
+        WHERE reservation_date IS NOT NULL
+        AND id NOT IN (
+            SELECT MIN(id) FROM reservations
+            WHERE reservation_date IS NOT NULL
+            GROUP BY patient_id, reservation_date
+        )
+        ORDER BY reservation_date, patient_id, id
+        """
+    )).all()
+    for reservation_id, patient_id, reservation_date, slot_id in duplicates:
+        conn.execute(text("DELETE FROM reservations WHERE id = :id"), {"id": reservation_id})
+        conn.execute(
+            text("UPDATE time_slots SET available_spots = available_spots + 1 WHERE id = :slot_id"),
+            {"slot_id": slot_id}
+        )
+        # 患者への連絡が必要なため、キャンセルした予約を出力する
+        print(f"同じ日の重複予約をキャンセルしました: 予約 {reservation_id}（患者 {patient_id}、{reservation_date}）")
+    return duplicates
+
+
+def add_reservation_date(conn):
+    """予約に予約日カラムを追加し、既存の予約はスロットの日付で埋める"""
+    if "reservation_date" not in _columns(conn, "reservations"):
+        conn.execute(text("ALTER TABLE reservations ADD COLUMN reservation_date DATE"))
+    if not _has_legacy_slot_columns(conn):
+        return
+    conn.execute(text(
+        """
+        UPDATE reservations
+        SET reservation_date = (
+            SELECT date(time_slots.date) FROM time_slots WHERE time_slots.id = reservations.slot_id
+        )
+        WHERE reservation_date IS NULL
+        """
+    ))
+    cancel_same_day_duplicates(conn)
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_reservations_patient_date "
+        "ON reservations (patient_id, reservation_date)"
+    ))
+
+
+def seed_availability_version(conn):
+    """空き状況のバージョンを保持する行を作成"""
+    conn.execute(text(
+        """
+        INSERT INTO availability_version (id, version)
+        SELECT 1, 0
+        WHERE NOT EXISTS (SELECT 1 FROM availability_version WHERE id = 1)
+        """
+    ))
+
+
+def add_open_slots_index(conn):
+    """空きのある有効な枠の部分インデックスを作成（新形式のカラムでは 0006 で作成される）"""
+    if not _has_legacy_slot_columns(conn):
+        return
+    # PostgreSQLでは boolean と整数を比較できないため、条件をDBに合わせる
+    is_active = "is_active = 1" if conn.dialect.name == "sqlite" else "is_active"
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_time_slots_open_date_time "
+        f"ON time_slots (date, start_time) WHERE {is_active} AND available_spots > 0"
+    ))
+
+
+def add_time_slot_version(conn):
+    """予約枠（アーカイブを含む）に楽観的ロック用のバージョンカラムを追加"""
+    for table in ("time_slots", "archived_time_slots"):
+        if "version" not in _columns(conn, table):
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN version INTEGER NOT NULL DEFAULT 1"))
+
+
+
+def encode_slot_day_minutes(conn):
+    """予約枠（アーカイブを含む）の日付・時刻を整数の日数・分数のカラムに変換"""
+    for table in ("time_slots", "archived_time_slots"):
+        if "date" not in _columns(conn, table):
+            continue
+        for column in ("day", "start_minute", "end_minute"):
+            if column not in _columns(conn, table):
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} INTEGER"))
+        conn.execute(text(
+            f"""
+            UPDATE {table}
+            SET day = CAST(julianday(date(date)) - julianday('1970-01-01') AS INTEGER),
+                start_minute = CAST(substr(start_time, 1, 2) AS INTEGER) * 60 + CAST(substr(start_time, 4, 2) AS INTEGER),
+                end_minute = CAST(substr(end_time, 1, 2) AS INTEGER) * 60 + CAST(substr(end_time, 4, 2) AS INTEGER)
+            """
+        ))
+        # 旧カラムを参照するインデックスを削除してからカラムを削除する
+        for index in inspect(conn).get_indexes(table):
+            if {"date", "start_time", "end_time"} & set(index["column_names"]):
+                conn.execute(text(f"DROP INDEX {index['name']}"))
+        for column in ("date", "start_time", "end_time"):
+            conn.execute(text(f"ALTER TABLE {table} DROP COLUMN {column}"))
+
+    # 新形式のカラムのインデックスはモデルの定義から作成する（部分インデックスの条件はDBごとに異なる）
+    from . import models
+
+    for table in (models.TimeSlot.__table__, models.ArchivedTimeSlot.__table__):
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+
+def add_compacted_version(conn):
+    """変更ログの削除済みバージョンを記録するカラムを追加"""
+    if "compacted_version" not in _columns(conn, "availability_version"):
+        conn.execute(text("ALTER TABLE availability_version ADD COLUMN compacted_version INTEGER NOT NULL DEFAULT 0"))
+
+
+def _rebuild_with_autoincrement(conn, table):
+    """SQLiteのテーブルを AUTOINCREMENT 付きで作り直す（他テーブルからの参照名は変えない）"""
+    columns = [column.name for column in table.columns if column.name in _columns(conn, table.name)]
+    column_list = ", ".join(columns)
+    new_name = f"{table.name}_new"
+    # 途中で失敗した前回の作業用テーブルが残っていれば作り直す
+    conn.execute(text(f"DROP TABLE IF EXISTS {new_name}"))
+    create_sql = str(CreateTable(table).compile(dialect=conn.dialect))
+    conn.execute(text(create_sql.replace(f"CREATE TABLE {table.name} ", f"CREATE TABLE {new_name} ", 1)))
+    conn.execute(text(f"INSERT INTO {new_name} ({column_list}) SELECT {column_list} FROM {table.name}"))
+    conn.execute(text(f"DROP TABLE {table.name}"))
+    conn.execute(text(f"ALTER TABLE {new_name} RENAME TO {table.name}"))
+    for index in table.indexes:
+        index.create(conn)
+
+
+def _seed_sequence(conn, table, archive_table):
+    """次に採番するIDが現行・アーカイブのどちらのIDとも重ならないようにする"""
+    conn.execute(text(
+        f"""
+        INSERT INTO sqlite_sequence (name, seq)
+        SELECT '{table}', 0
+        WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = '{table}')
+        """
+    ))
+    conn.execute(text(
+        f"""
+        UPDATE sqlite_sequence
+        SET seq = MAX(
+            seq,
+            (SELECT COALESCE(MAX(id), 0) FROM {table}),
+            (SELECT COALESCE(MAX(id), 0) FROM {archive_table})
+        )
+        WHERE name = '{table}'
+        """
+    ))
+
+
+def _next_id(conn, table):
+    return conn.execute(text(
+        f"UPDATE sqlite_sequence SET seq = seq + 1 WHERE name = '{table}' RETURNING seq"
+    )).scalar_one()
+
+
+def autoincrement_slot_reservation_ids(conn):
+    """予約枠・予約のIDを再利用しないようにし、アーカイブ済みのIDと重なる既存の行は新しいIDに振り直す
+
+    SQLiteの INTEGER PRIMARY KEY は最大のIDの行が削除されるとそのIDを再利用するため、
+    アーカイブ済みの行とIDが重なり、次回のアーカイブが一意制約違反で失敗していた。
+    """
+    if conn.dialect.name != "sqlite":
+        return
+    from . import models
+
+    targets = (
+        (models.TimeSlot.__table__, "archived_time_slots"),
+        (models.Reservation.__table__, "archived_reservations"),
+    )
+    for table, archive_table in targets:
+        sql = conn.execute(
+            text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": table.name}
+        ).scalar_one()
+        if "AUTOINCREMENT" not in sql.upper():
+            _rebuild_with_autoincrement(conn, table)
+        _seed_sequence(conn, table.name, archive_table)
+
+    # すでにアーカイブ済みのIDと重なっている行を振り直す
+    moved_slot_ids = []
+    for (slot_id,) in conn.execute(text(
+        "SELECT id FROM time_slots WHERE id IN (SELECT id FROM archived_time_slots)"
+    )).all():
+        new_id = _next_id(conn, "time_slots")
+        params = {"old_id": slot_id, "new_id": new_id}
+        conn.execute(text("UPDATE time_slots SET id = :new_id WHERE id = :old_id"), params)
+        conn.execute(text("UPDATE reservations SET slot_id = :new_id WHERE slot_id = :old_id"), params)
+        conn.execute(text("UPDATE waitlist_entries SET slot_id = :new_id WHERE slot_id = :old_id"), params)
+        moved_slot_ids += [slot_id, new_id]
+    for (reservation_id,) in conn.execute(text(
+        "SELECT id FROM reservations WHERE id IN (SELECT id FROM archived_reservations)"
+    )).all():
+        conn.execute(
+            text("UPDATE reservations SET id = :new_id WHERE id = :old_id"),
+            {"old_id": reservation_id, "new_id": _next_id(conn, "reservations")}
+        )
+
+    # 差分同期中のクライアントが旧IDの枠を削除し、新IDの枠を取得し直すよう変更ログに記録する
+    if moved_slot_ids:
+        version = conn.execute(text(
+            "UPDATE availability_version SET version = version + 1 WHERE id = 1 RETURNING version"
+        )).scalar_one()
+        conn.execute(
+            text("INSERT INTO slot_changes (version, slot_id) VALUES (:version, :slot_id)"),
+            [{"version": version, "slot_id": slot_id} for slot_id in moved_slot_ids]
+        )
+
+
+# (バージョン, 処理) の順に適用される
+MIGRATIONS = [
+    ("0001_backfill_daily_counters", backfill_daily_counters),
+    ("0002_add_reservation_date", add_reservation_date),
+    ("0003_seed_availability_version", seed_availability_version),
+    ("0004_add_open_slots_index", add_open_slots_index),
+    ("0005_add_time_slot_version", add_time_slot_version),
+    ("0006_encode_slot_day_minutes", encode_slot_day_minutes),
+    ("0007_add_compacted_version", add_compacted_version),
+    ("0008_autoincrement_slot_reservation_ids", autoincrement_slot_reservation_ids),
+]
+
+
+def run_migrations(engine):
+    """未適用のマイグレーションを順番に適用する"""
+    metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        applied = {row[0] for row in conn.execute(schema_migrations.select())}
+        for version, migrate in MIGRATIONS:
+            if version in applied:
+                continue
+            migrate(conn)
+            conn.execute(schema_migrations.insert().values(version=version, applied_at=datetime.now()))
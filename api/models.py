@@ -1,9 +1,48 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, DateTime, Time
+from sqlalchemy import Boolean, Column, ForeignKey, Index, Integer, String, Date, DateTime, Time, text
 from sqlalchemy.orm import relationship
-from datetime import datetime
+from sqlalchemy.types import TypeDecorator
+from datetime import date, datetime, time, timedelta
 
 from .database import Base
 
+# 日付を整数で保存する際の基準日
+EPOCH = date(1970, 1, 1)
+
+
+class EpochDay(TypeDecorator):
+    """日付を基準日（1970-01-01）からの日数の整数で保存する型"""
+    impl = Integer
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, int):
+            return value
+        if isinstance(value, datetime):
+            value = value.date()
+        return (value - EPOCH).days
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return EPOCH + timedelta(days=value)
+
+
+class MinuteOfDay(TypeDecorator):
+    """時刻を0時からの分数の整数で保存する型（秒以下は切り捨て）"""
+    impl = Integer
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, int):
+            return value
+        return value.hour * 60 + value.minute
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return time(value // 60, value % 60)
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -19,25 +58,57 @@ class User(Base):
     reservations = relationship("Reservation", back_populates="patient")
 
 
+class RefreshToken(Base):
+    __tablename__ = "refresh_tokens"
+
+    # リフレッシュトークン（値はSHA-256のハッシュのみ保存）。使用ごとに失効させて新しいトークンを発行する
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    token_hash = Column(String, nullable=False, unique=True)
+    # 同じログインから発行されたトークンの系列（失効済みトークンの再利用時は系列ごと失効させる）
+    family = Column(String, nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.now)
+    expires_at = Column(DateTime, nullable=False)
+    revoked_at = Column(DateTime)
+
+
 class TimeSlot(Base):
     __tablename__ = "time_slots"
 
     id = Column(Integer, primary_key=True, index=True)
-    date = Column(DateTime, index=True)
-    start_time = Column(Time, index=True)
-    end_time = Column(Time)
+    # 日付は整数の日数、時刻は整数の分数で保存する（属性は date / time で扱う）
+    date = Column("day", EpochDay, key="date")
+    start_time = Column("start_minute", MinuteOfDay, key="start_time")
+    end_time = Column("end_minute", MinuteOfDay, key="end_time")
     capacity = Column(Integer, default=2)  # デフォルトは各枠2名まで
     available_spots = Column(Integer)
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.now)
+    # 楽観的ロック用のバージョン（更新のたびに加算し、UPDATE/DELETE の条件で照合する）
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     # このスロットに紐づく予約のリレーション
     reservations = relationship("Reservation", back_populates="time_slot")
 
+    __mapper_args__ = {"version_id_col": version}
+
     def __init__(self, date, start_time, end_time, capacity=2, **kwargs):
         super().__init__(date=date, start_time=start_time, end_time=end_time, 
                         capacity=capacity, available_spots=capacity, **kwargs)
 
+    __table_args__ = (
+        # 日付・開始時刻の範囲検索用の複合インデックス
+        Index("ix_time_slots_day_start", "date", "start_time"),
+        # 空きのある有効な枠だけを日時順に並べた部分インデックス（最短の空き枠検索用）
+        Index(
+            "ix_time_slots_open_date_time", "date", "start_time",
+            sqlite_where=text("is_active = 1 AND available_spots > 0"),
+            postgresql_where=text("is_active AND available_spots > 0"),
+        ),
+        # アーカイブへIDを引き継ぐため、SQLiteでも削除済みのIDを再利用しない
+        {"sqlite_autoincrement": True},
+    )
+
 
 class Reservation(Base):
     __tablename__ = "reservations"
@@ -46,10 +117,143 @@ class Reservation(Base):
     patient_id = Column(Integer, ForeignKey("users.id"))
     slot_id = Column(Integer, ForeignKey("time_slots.id"))
     daily_number = Column(Integer, index=True)  # 日ごとの通し番号
+    reservation_date = Column(Date)  # 予約日（スロットの日付を非正規化して保持）
     qr_code_data = Column(String, unique=True, index=True)
     is_confirmed = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.now)
     
     # リレーション
     patient = relationship("User", back_populates="reservations")
-    time_slot = relationship("TimeSlot", back_populates="reservations")
\ No newline at end of file
+    time_slot = relationship("TimeSlot", back_populates="reservations")
+
+    # 1人1日1件の予約をDB側でも保証する
+    __table_args__ = (
+        Index("ix_reservations_patient_date", "patient_id", "reservation_date", unique=True),
+        # アーカイブへIDを引き継ぐため、SQLiteでも削除済みのIDを再利用しない
+        {"sqlite_autoincrement": True},
+    )
+
+
+class WaitlistEntry(Base):
+    __tablename__ = "waitlist_entries"
+
+    id = Column(Integer, primary_key=True, index=True)
+    patient_id = Column(Integer, ForeignKey("users.id"))
+    slot_id = Column(Integer, ForeignKey("time_slots.id"))
+    created_at = Column(DateTime, default=datetime.now)
+
+    # リレーション
+    patient = relationship("User")
+    time_slot = relationship("TimeSlot")
+
+    __table_args__ = (
+        # 同じ枠への重複登録を防ぐ
+        Index("ix_waitlist_patient_slot", "patient_id", "slot_id", unique=True),
+        # 枠ごとの登録順での取り出し用
+        Index("ix_waitlist_slot_created", "slot_id", "created_at", "id"),
+    )
+
+
+class DailyCounter(Base):
+    __tablename__ = "daily_counters"
+
+    # 日ごとの予約番号の採番テーブル（1日1行）
+    day = Column(Date, primary_key=True)
+    last_number = Column(Integer, nullable=False, default=0)
+
+
+class AvailabilityVersion(Base):
+    __tablename__ = "availability_version"
+
+    # 予約枠・予約の変更ごとに加算される空き状況のバージョン（1行のみ、ETagに使用）
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    # 変更ログをこのバージョンまで削除済み（これより前からの差分は取得できない）
+    compacted_version = Column(Integer, nullable=False, default=0, server_default="0")
+
+
+class SlotChangeLog(Base):
+    __tablename__ = "slot_changes"
+
+    # 予約枠の変更ログ（追記のみ）。version は空き状況のバージョンで、差分同期の通し番号に使う
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, index=True)
+    slot_id = Column(Integer, nullable=False)
+
+
+class ScheduleRule(Base):
+    __tablename__ = "schedule_rules"
+
+    # 繰り返しの診療スケジュール（RRULE形式）。予約枠は日付が参照されたときに作成する
+    id = Column(Integer, primary_key=True, index=True)
+    rrule = Column(String, nullable=False)
+    start_date = Column(Date, nullable=False)
+    end_date = Column(Date)
+    start_time = Column(Time, nullable=False)
+    end_time = Column(Time, nullable=False)
+    slot_duration_minutes = Column(Integer, nullable=False, default=30)
+    capacity = Column(Integer, nullable=False, default=2)
+    created_at = Column(DateTime, default=datetime.now)
+
+
+class ScheduleClosure(Base):
+    __tablename__ = "schedule_closures"
+
+    # スケジュールルールから予約枠を作成しない休診日
+    day = Column(Date, primary_key=True)
+    note = Column(String)
+
+
+class SlotTombstone(Base):
+    __tablename__ = "slot_tombstones"
+
+    # 管理者が削除・移動した予約枠の日時。ルールから予約枠を作成する際は、この日時の枠を作り直さない
+    date = Column("day", EpochDay, key="date", primary_key=True)
+    start_time = Column("start_minute", MinuteOfDay, key="start_time", primary_key=True)
+
+
+class MaterializedDay(Base):
+    __tablename__ = "materialized_days"
+
+    # スケジュールルールから予約枠を作成済みの日（1日1行）
+    day = Column(Date, primary_key=True)
+
+
+class ArchivedTimeSlot(Base):
+    __tablename__ = "archived_time_slots"
+
+    # 保存期間を過ぎた予約枠（time_slots と同じ構成でIDを引き継ぐ）
+    id = Column(Integer, primary_key=True)
+    date = Column("day", EpochDay, key="date", index=True)
+    start_time = Column("start_minute", MinuteOfDay, key="start_time")
+    end_time = Column("end_minute", MinuteOfDay, key="end_time")
+    capacity = Column(Integer)
+    available_spots = Column(Integer)
+    is_active = Column(Boolean)
+    created_at = Column(DateTime)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+
+    reservations = relationship("ArchivedReservation", back_populates="time_slot")
+
+
+class ArchivedReservation(Base):
+    __tablename__ = "archived_reservations"
+
+    # 保存期間を過ぎた予約（reservations と同じ構成でIDを引き継ぐ）
+    id = Column(Integer, primary_key=True)
+    patient_id = Column(Integer, ForeignKey("users.id"))
+    slot_id = Column(Integer, ForeignKey("archived_time_slots.id"))
+    daily_number = Column(Integer)
+    reservation_date = Column(Date)
+    qr_code_data = Column(String)
+    is_confirmed = Column(Boolean)
+    created_at = Column(DateTime)
+
+    # リレーション
+    patient = relationship("User")
+    time_slot = relationship("ArchivedTimeSlot", back_populates="reservations")
+
+    __table_args__ = (
+        Index("ix_archived_reservations_patient_date", "patient_id", "reservation_date"),
+        Index("ix_archived_reservations_date", "reservation_date"),
+    )
\ No newline at end of file
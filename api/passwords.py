@@ -0,0 +1,72 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+# bcryptのコスト（変更すると、次回ログイン時に新しいコストで再ハッシュする）
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# ハッシュ計算に使うスレッド数（bcryptはGILを解放するため、コア数まで並列に計算できる）
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# 実行待ちにできる件数の上限（超えた場合は待たせずに503を返す）
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "32"))
+# 混雑時に再試行までの目安として返す秒数
+PASSWORD_HASH_RETRY_AFTER = 1
+
+# 設定と異なるコストのハッシュは needs_update となるよう、最小・最大も同じ値にする
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS
+)
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+# 実行中と実行待ちの件数（イベントループのスレッドからのみ更新する）
+_pending = 0
+
+
+def check_capacity():
+    """実行待ちが上限に達している場合は503を返す
+
+    DBに接続する前にも呼び、混雑時は接続プールの接続を使わずに断る。
+    """
+    if _pending >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_QUEUE:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Authentication service is busy, please retry",
+            headers={"Retry-After": str(PASSWORD_HASH_RETRY_AFTER)},
+        )
+
+
+async def _run(func, *args):
+    """専用スレッドプールで実行する（上限を超える場合は503）"""
+    global _pending
+    check_capacity()
+    _pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+    finally:
+        _pending -= 1
+
+
+def pending_count():
+    """実行中と実行待ちのハッシュ計算の件数"""
+    return _pending
+
+
+def hash_password_sync(password: str) -> str:
+    """イベントループの外（一括登録のプロセスプール、CLI、ベンチマークの準備など）で使う同期版"""
+    return pwd_context.hash(password)
+
+
+async def hash_password(password: str) -> str:
+    return await _run(hash_password_sync, password)
+
+
+async def verify_and_update_password(password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """パスワードを検証し、コストが変わっていた場合は新しいハッシュも返す"""
+    return await _run(pwd_context.verify_and_update, password, hashed_password)
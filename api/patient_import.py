@@ -0,0 +1,213 @@
+"""既存の患者一覧（CSV または JSON Lines）をまとめてユーザー登録する
+
+CSVはヘッダー行に email, password, full_name, phone_number を含めます。
+JSON Linesは1行に1人分のオブジェクトを同じキーで記述します。
+
+使い方:
+    python -m api.patient_import patients.csv --batch-size 1000
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models, schemas
+from .passwords import hash_password_sync
+
+# 1トランザクションで登録する件数（重複確認のクエリもこの単位で1回）
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+# パスワードのハッシュ計算に使うプロセス数（既定は全コア）
+IMPORT_HASH_PROCESSES = int(os.getenv("IMPORT_HASH_PROCESSES", str(os.cpu_count() or 1)))
+# APIで一度に受け付ける行数の上限（これを超える場合はCLIを使う）
+# bcrypt（コスト12）は1件0.3〜0.4秒かかるため、1リクエストが数秒で終わるようプロセスあたり10件までとする
+IMPORT_API_MAX_ROWS = int(os.getenv("IMPORT_API_MAX_ROWS", str(10 * IMPORT_HASH_PROCESSES)))
+
+FIELDS = ("email", "password", "full_name", "phone_number")
+FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl"}
+
+_hash_pool: Optional[ProcessPoolExecutor] = None
+
+
+def file_format(filename: str):
+    """拡張子からファイル形式を判定する（不明な場合は ValueError）"""
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension not in FORMATS:
+        raise ValueError("Unsupported file type, use .csv or .jsonl")
+    return FORMATS[extension]
+
+
+def _error(line: int, message: str, email: Optional[str] = None):
+    return schemas.PatientImportError(line=line, email=email, error=message)
+
+
+def _entries(content: str, fmt: str):
+    """(行番号, 辞書またはエラーメッセージ) を順に返す"""
+    if fmt == "csv":
+        reader = csv.DictReader(io.StringIO(content))
+        missing = set(FIELDS) - set(reader.fieldnames or ())
+        if missing:
+            raise ValueError(f"Missing CSV columns: {', '.join(sorted(missing))}")
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line, text in enumerate(content.splitlines(), 1):
+        if not text.strip():
+            continue
+        try:
+            row = json.loads(text)
+        except json.JSONDecodeError:
+            yield line, "Invalid JSON"
+            continue
+        yield line, row if isinstance(row, dict) else "Each line must be a JSON object"
+
+
+def parse_patients(content: str, fmt: str) -> Tuple[List[Tuple[int, schemas.UserCreate]], List[schemas.PatientImportError]]:
+    """ファイルの内容を検証し、(行番号, 登録内容) の一覧と行ごとのエラーを返す（ファイル自体が不正な場合は ValueError）"""
+    patients, errors = [], []
+    try:
+        for line, row in _entries(content, fmt):
+            if isinstance(row, str):
+                errors.append(_error(line, row))
+                continue
+            try:
+                # 一括登録は患者のみ（is_admin は受け付けない）
+                patients.append((line, schemas.UserCreate(**{field: row.get(field) for field in FIELDS})))
+            except ValidationError as e:
+                detail = e.errors()[0]
+                location = ".".join(str(part) for part in detail["loc"])
+                errors.append(_error(line, f"{location}: {detail['msg']}", row.get("email")))
+    except csv.Error as e:
+        raise ValueError(f"Invalid CSV: {e}")
+    return patients, errors
+
+
+def _hash_passwords(passwords: List[str]):
+    return [hash_password_sync(password) for password in passwords]
+
+
+def _get_hash_pool():
+    global _hash_pool
+    if _hash_pool is None:
+        # マルチスレッドのサーバー内で fork するとロックを持ったまま複製されることがあるため spawn を使う
+        _hash_pool = ProcessPoolExecutor(max_workers=IMPORT_HASH_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+    return _hash_pool
+
+
+async def hash_passwords(passwords: List[str]):
+    """bcryptをプロセスプールで全コアに分散して計算する（順序は入力と同じ）"""
+    if not passwords:
+        return []
+    size = math.ceil(len(passwords) / IMPORT_HASH_PROCESSES)
+    loop = asyncio.get_running_loop()
+    chunks = await asyncio.gather(*(
+        loop.run_in_executor(_get_hash_pool(), _hash_passwords, passwords[start:start + size])
+        for start in range(0, len(passwords), size)
+    ))
+    return [hashed for chunk in chunks for hashed in chunk]
+
+
+async def _registered_emails(db: AsyncSession, emails):
+    return set((await db.scalars(select(models.User.email).where(models.User.email.in_(emails)))).all())
+
+
+async def import_patients(db: AsyncSession, patients, errors: List[schemas.PatientImportError], batch_size: int = IMPORT_BATCH_SIZE):
+    """検証済みの患者をバッチ単位で登録し、登録件数を返す（登録できない行は errors に追加）"""
+    unique, seen = [], set()
+    for line, patient in patients:
+        if patient.email in seen:
+            errors.append(_error(line, "Duplicate email in file", patient.email))
+            continue
+        seen.add(patient.email)
+        unique.append((line, patient))
+
+    imported = 0
+    for start in range(0, len(unique), batch_size):
+        batch = unique[start:start + batch_size]
+        registered = await _registered_emails(db, [patient.email for _, patient in batch])
+        hashes = await hash_passwords([patient.password for _, patient in batch if patient.email not in registered])
+        hashed = iter(hashes)
+        rows = {
+            patient.email: (line, {
+                "email": patient.email,
+                "hashed_password": next(hashed),
+                "full_name": patient.full_name,
+                "phone_number": patient.phone_number,
+                "is_admin": False,
+                "is_active": True
+            })
+            for line, patient in batch if patient.email not in registered
+        }
+        # 重複確認の後に同じメールアドレスが個別に登録された場合は、確認し直して1回だけ再試行する
+        for attempt in range(2):
+            try:
+                if rows:
+                    await db.execute(insert(models.User.__table__), [row for _, row in rows.values()])
+                await db.commit()
+                break
+            except IntegrityError:
+                await db.rollback()
+                if attempt:
+                    raise
+                registered |= await _registered_emails(db, list(rows))
+                rows = {email: entry for email, entry in rows.items() if email not in registered}
+
+        for line, patient in batch:
+            if patient.email in registered:
+                errors.append(_error(line, "Email already registered", patient.email))
+        imported += len(rows)
+
+    errors.sort(key=lambda error: error.line)
+    return imported
+
+
+async def import_file(db: AsyncSession, content: str, fmt: str, batch_size: int = IMPORT_BATCH_SIZE):
+    """ファイルの内容を解析して登録し、結果を返す"""
+    patients, errors = parse_patients(content, fmt)
+    imported = await import_patients(db, patients, errors, batch_size)
+    return schemas.PatientImportResult(imported=imported, errors=errors)
+
+
+async def _run(path: str, batch_size: int):
+    from .database import AsyncSessionLocal
+
+    with open(path, encoding="utf-8-sig") as f:
+        content = f.read()
+    async with AsyncSessionLocal() as db:
+        return await import_file(db, content, file_format(path), batch_size)
+
+
+def main():
+    from .database import engine
+    from .migrations import run_migrations
+
+    parser = argparse.ArgumentParser(description="患者一覧（CSV / JSON Lines）をまとめて登録します")
+    parser.add_argument("path")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+
+    started = datetime.now()
+    result = asyncio.run(_run(args.path, args.batch_size))
+    for error in result.errors:
+        print(f"{error.line}行目 {error.email or ''}: {error.error}")
+    elapsed = (datetime.now() - started).total_seconds()
+    print(f"{result.imported} 件を登録しました（エラー {len(result.errors)} 件、{elapsed:.1f}秒）")
+
+
+if __name__ == "__main__":
+    main()
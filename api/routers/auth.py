@@ -1,21 +1,31 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, File, HTTPException, UploadFile, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from typing import Optional
+import hashlib
+import secrets
+import uuid
 
-from .. import models, schemas
+from .. import models, patient_import, schemas
+from ..cache import TTLCache
 from ..database import get_db
+from ..passwords import check_capacity, hash_password, verify_and_update_password
 
 # JWT関連の設定
 SECRET_KEY = "u879269j"  # 実際の運用では安全な値に変更してください
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# リフレッシュトークンの有効期限（使用するたびに新しいトークンに置き換わる）
+REFRESH_TOKEN_EXPIRE_DAYS = 14
 
-# パスワードハッシュのコンテキスト
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# 認証済みユーザーのキャッシュ（トークンのuser_idをキーとし、変更時は破棄する）
+# 他のプロセスでの変更はTTLが切れるまで反映されないため短くしておく
+USER_CACHE_MAX_ENTRIES = 10000
+USER_CACHE_TTL_SECONDS = 30
+user_cache = TTLCache(maxsize=USER_CACHE_MAX_ENTRIES, ttl_seconds=USER_CACHE_TTL_SECONDS)
 
 # OAuth2スキーム
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
@@ -23,24 +33,25 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 router = APIRouter()
 
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def get_user(db: AsyncSession, email: str):
+    return await db.scalar(select(models.User).where(models.User.email == email).limit(1))
 
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
-
-
-def get_user(db: Session, email: str):
-    return db.query(models.User).filter(models.User.email == email).first()
-
-
-def authenticate_user(db: Session, email: str, password: str):
-    user = get_user(db, email)
+async def authenticate_user(db: AsyncSession, email: str, password: str):
+    check_capacity()
+    user = await get_user(db, email)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    # 検証を待つ間に接続プールの接続を占有しないよう、読み取りのトランザクションを終えて接続を返す
+    await db.commit()
+    # bcryptはCPU負荷が高いためイベントループを塞がないよう専用のスレッドプールで実行する
+    verified, new_hash = await verify_and_update_password(password, user.hashed_password)
+    if not verified:
         return False
+    if new_hash:
+        # コストの設定が変わっていた場合は新しいハッシュに置き換える
+        user.hashed_password = new_hash
+        await db.commit()
     return user
 
 
@@ -55,7 +66,42 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def hash_refresh_token(refresh_token: str):
+    """リフレッシュトークンは十分な長さの乱数のため、bcryptではなくSHA-256で保存する"""
+    return hashlib.sha256(refresh_token.encode()).hexdigest()
+
+
+def issue_tokens(db: AsyncSession, user: models.User, family: Optional[str] = None):
+    """アクセストークンと新しいリフレッシュトークンを発行する（コミットは呼び出し側）"""
+    refresh_token = secrets.token_urlsafe(32)
+    db.add(models.RefreshToken(
+        user_id=user.id,
+        token_hash=hash_refresh_token(refresh_token),
+        family=family or uuid.uuid4().hex,
+        expires_at=datetime.now() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    ))
+    access_token = create_access_token(
+        data={"sub": user.email, "user_id": user.id, "is_admin": user.is_admin},
+        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
+    return {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        "refresh_token": refresh_token
+    }
+
+
+def revoke_refresh_tokens(*conditions):
+    """条件に一致する有効なリフレッシュトークンを失効させる文"""
+    return (
+        update(models.RefreshToken)
+        .where(models.RefreshToken.revoked_at == None, *conditions)
+        .values(revoked_at=datetime.now())
+    )
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -66,13 +112,24 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         email: str = payload.get("sub")
         if email is None:
             raise credentials_exception
-        token_data = schemas.TokenData(email=email)
+        token_data = schemas.TokenData(email=email, user_id=payload.get("user_id"))
     except JWTError:
         raise credentials_exception
-    user = get_user(db, email=token_data.email)
-    if user is None:
+    
+    # 通常はキャッシュから返し、DBを参照しない
+    if token_data.user_id is not None:
+        cached = user_cache.get(token_data.user_id)
+        if cached is not None and cached.email == token_data.email:
+            return cached
+        user = await db.get(models.User, token_data.user_id)
+    else:
+        # user_id を含まない古いトークン
+        user = await get_user(db, email=token_data.email)
+    if user is None or user.email != token_data.email:
         raise credentials_exception
-    return user
+    current_user = schemas.User.model_validate(user, from_attributes=True)
+    user_cache.set(user.id, current_user)
+    return current_user
 
 
 async def get_current_active_user(current_user: schemas.User = Depends(get_current_user)):
@@ -88,13 +145,16 @@ async def get_admin_user(current_user: schemas.User = Depends(get_current_active
 
 
 @router.post("/register", response_model=schemas.User)
-def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def register_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
     """ユーザーを登録するエンドポイント"""
-    db_user = get_user(db, email=user.email)
+    check_capacity()
+    db_user = await get_user(db, email=user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    hashed_password = get_password_hash(user.password)
+    # ハッシュ計算を待つ間に接続プールの接続を占有しないよう、接続を返しておく
+    await db.commit()
+    hashed_password = await hash_password(user.password)
     
     # UserCreateスキーマにis_adminフィールドがない場合の対処
     is_admin = False
@@ -112,28 +172,145 @@ def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     )
     
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 
 @router.post("/token", response_model=schemas.Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.email, "user_id": user.id, "is_admin": user.is_admin},
-        expires_delta=access_token_expires
+    # 期限切れのリフレッシュトークンはログイン時に削除する
+    await db.execute(
+        delete(models.RefreshToken)
+        .where(models.RefreshToken.user_id == user.id, models.RefreshToken.expires_at < datetime.now())
     )
-    return {"access_token": access_token, "token_type": "bearer"}
+    tokens = issue_tokens(db, user)
+    await db.commit()
+    return tokens
+
+
+@router.post("/token/refresh", response_model=schemas.Token)
+async def refresh_access_token(body: schemas.TokenRefresh, db: AsyncSession = Depends(get_db)):
+    """リフレッシュトークンを新しいトークンと交換するエンドポイント（パスワードの検証は行わない）"""
+    invalid_token_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid refresh token",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    token_hash = hash_refresh_token(body.refresh_token)
+    now = datetime.now()
+    
+    # 条件付きの更新で失効させ、同じトークンが同時に使われても交換は1回だけにする
+    used = (await db.execute(
+        update(models.RefreshToken)
+        .where(
+            models.RefreshToken.token_hash == token_hash,
+            models.RefreshToken.revoked_at == None,
+            models.RefreshToken.expires_at > now
+        )
+        .values(revoked_at=now)
+        .returning(models.RefreshToken.user_id, models.RefreshToken.family)
+    )).first()
+    if used is None:
+        # 失効済みのトークンが再び使われた場合は漏洩とみなし、系列ごと失効させる
+        family = await db.scalar(
+            select(models.RefreshToken.family)
+            .where(models.RefreshToken.token_hash == token_hash, models.RefreshToken.revoked_at != None)
+        )
+        if family:
+            await db.execute(revoke_refresh_tokens(models.RefreshToken.family == family))
+            await db.commit()
+        raise invalid_token_exception
+    
+    user = await db.get(models.User, used.user_id)
+    if user is None or not user.is_active:
+        await db.commit()
+        raise invalid_token_exception
+    tokens = issue_tokens(db, user, used.family)
+    await db.commit()
+    return tokens
+
+
+@router.post("/token/revoke", status_code=status.HTTP_204_NO_CONTENT)
+async def revoke_refresh_token(body: schemas.TokenRefresh, db: AsyncSession = Depends(get_db)):
+    """ログアウト時にリフレッシュトークンを系列ごと失効させるエンドポイント"""
+    family = await db.scalar(
+        select(models.RefreshToken.family)
+        .where(models.RefreshToken.token_hash == hash_refresh_token(body.refresh_token))
+    )
+    if family:
+        await db.execute(revoke_refresh_tokens(models.RefreshToken.family == family))
+        await db.commit()
+
 
 @router.get("/users/me", response_model=schemas.User)
 async def get_users_me(current_user: schemas.User = Depends(get_current_active_user)):
     """現在ログインしているユーザーの情報を取得するエンドポイント"""
-    return current_user
\ No newline at end of file
+    return current_user
+
+
+@router.post("/users/import", response_model=schemas.PatientImportResult)
+async def import_patients(
+    file: UploadFile = File(...),
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_admin_user)
+):
+    """患者一覧（CSV / JSON Lines）をまとめて登録するエンドポイント（管理者のみ、登録できない行は行番号付きで返す）"""
+    try:
+        fmt = patient_import.file_format(file.filename)
+        content = (await file.read()).decode("utf-8-sig")
+        patients, errors = patient_import.parse_patients(content, fmt)
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="File must be UTF-8 encoded")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if len(patients) + len(errors) > patient_import.IMPORT_API_MAX_ROWS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many rows (max {patient_import.IMPORT_API_MAX_ROWS}), split the file or use the import CLI"
+        )
+    
+    imported = await patient_import.import_patients(db, patients, errors)
+    return schemas.PatientImportResult(imported=imported, errors=errors)
+
+
+async def set_user_active(db: AsyncSession, user_id: int, is_active: bool):
+    """ユーザーの有効・無効を切り替え、キャッシュを破棄する（無効化時はリフレッシュトークンも失効させる）"""
+    user = await db.get(models.User, user_id)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    user.is_active = is_active
+    if not is_active:
+        await db.execute(revoke_refresh_tokens(models.RefreshToken.user_id == user_id))
+    await db.commit()
+    user_cache.invalidate(user_id)
+    return user
+
+
+@router.post("/users/{user_id}/deactivate", response_model=schemas.User)
+async def deactivate_user(
+    user_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_admin_user)
+):
+    """ユーザーを無効化するエンドポイント（管理者のみ、以降のリクエストは拒否される）"""
+    if user_id == current_user.id:
+        raise HTTPException(status_code=400, detail="Cannot deactivate yourself")
+    return await set_user_active(db, user_id, False)
+
+
+@router.post("/users/{user_id}/activate", response_model=schemas.User)
+async def activate_user(
+    user_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_admin_user)
+):
+    """無効化したユーザーを再び有効にするエンドポイント（管理者のみ）"""
+    return await set_user_active(db, user_id, True)
@@ -1,45 +1,201 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import contains_eager, joinedload
+from sqlalchemy import bindparam, delete, select, tuple_, update
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from typing import List, Optional
+import asyncio
 import uuid
 from datetime import datetime, date
+from datetime import time as dtime
 
 from .. import models, schemas
-from ..database import get_db
+from ..availability import bump_availability_version, notify_availability_changed
+from ..availability_index import available_change
+from ..cache import TTLCache
+from ..database import get_db, serialized_write
+from ..pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, encode_cursor
 from .auth import get_current_active_user, get_admin_user
 
 router = APIRouter()
 
+# 予約時のロック競合に対する再試行設定
+BOOKING_MAX_RETRIES = 3
+BOOKING_RETRY_BACKOFF_SECONDS = 0.05
+# 再試行の対象とするPostgreSQLのSQLSTATE（serialization_failure / deadlock_detected）
+RETRYABLE_SQLSTATES = {"40001", "40P01"}
+
+# QRコード照会結果のキャッシュ（受付での再スキャン対策）
+QR_CACHE_MAX_ENTRIES = 1024
+QR_CACHE_TTL_SECONDS = 60
+qr_cache = TTLCache(maxsize=QR_CACHE_MAX_ENTRIES, ttl_seconds=QR_CACHE_TTL_SECONDS)
+
+# 一括受付で一度に確認できるQRコードの上限
+BATCH_CONFIRM_MAX_CODES = 500
+
 
 def generate_qr_code_data():
     """ユニークなQRコードデータを生成"""
     return str(uuid.uuid4())
 
 
-def get_daily_number(db: Session, reservation_date: date):
-    """その日の予約番号を取得（連番）"""
-    # その日の最大の番号を取得
-    max_number = db.query(func.max(models.Reservation.daily_number))\
-        .join(models.TimeSlot)\
-        .filter(models.TimeSlot.date == reservation_date)\
-        .scalar()
+async def get_daily_number(db: AsyncSession, reservation_date: date, count: int = 1):
+    """その日の予約番号を count 個採番し、最後の番号を返す（連番）
+    
+    日ごとの採番テーブルを予約と同じトランザクション内で加算するため、
+    予約件数に関わらず一定コストで、同時予約でも番号が重複しない。
+    """
+    counter = models.DailyCounter
+    increment = (
+        update(counter)
+        .where(counter.day == reservation_date)
+        .values(last_number=counter.last_number + count)
+        .returning(counter.last_number)
+    )
+    last_number = await db.scalar(increment)
     
-    if max_number is None:
-        return 1
-    else:
-        return max_number + 1
+    # その日の最初の予約の場合は行を作成
+    if last_number is None:
+        try:
+            async with db.begin_nested():
+                db.add(counter(day=reservation_date, last_number=count))
+            return count
+        except IntegrityError:
+            # 他のトランザクションが先に行を作成した場合は加算し直す
+            last_number = await db.scalar(increment)
+    
+    return last_number
+
+
+async def renumber_reservations(db: AsyncSession, reservation_ids_by_date):
+    """別の日に移動した予約に、移動先の日の予約番号を採番し直す（{移動先の日: 予約IDの一覧（番号順）}）"""
+    rows = []
+    for reservation_date, reservation_ids in reservation_ids_by_date.items():
+        last_number = await get_daily_number(db, reservation_date, len(reservation_ids))
+        first_number = last_number - len(reservation_ids) + 1
+        rows.extend(
+            {"reservation_id": reservation_id, "new_date": reservation_date, "new_number": first_number + i}
+            for i, reservation_id in enumerate(reservation_ids)
+        )
+    if rows:
+        reservations = models.Reservation.__table__
+        await db.execute(
+            update(reservations)
+            .where(reservations.c.id == bindparam("reservation_id"))
+            .values(reservation_date=bindparam("new_date"), daily_number=bindparam("new_number")),
+            rows
+        )
+
+
+def is_lock_error(error: DBAPIError):
+    """ロック競合（再試行すれば成功しうる）によるエラーかどうかを判定"""
+    # PostgreSQLはSQLSTATEで判定する（psycopg2は pgcode、asyncpgは sqlstate に入る）
+    sqlstate = getattr(error.orig, "sqlstate", None) or getattr(error.orig, "pgcode", None)
+    if sqlstate in RETRYABLE_SQLSTATES:
+        return True
+    # SQLiteはエラーメッセージで判定する
+    message = str(error.orig).lower()
+    return "database is locked" in message or "database table is locked" in message
+
+
+async def book_slot(db: AsyncSession, slot: models.TimeSlot, patient_id: int):
+    """空き枠の確保と予約の作成を同一トランザクション内で行う（コミットは呼び出し側）"""
+    # 空き枠がある場合のみ減算する条件付きUPDATE（チェックと減算を1文で行う）
+    result = await db.execute(
+        update(models.TimeSlot)
+        .where(
+            models.TimeSlot.id == slot.id,
+            models.TimeSlot.is_active == True,
+            models.TimeSlot.available_spots > 0
+        )
+        .values(available_spots=models.TimeSlot.available_spots - 1, version=models.TimeSlot.version + 1)
+    )
+    if result.rowcount == 0:
+        raise HTTPException(status_code=400, detail="No available spots in this time slot")
+    
+    # 同じ日に既に予約を持っているか確認（(patient_id, reservation_date) のインデックスで検索）
+    reservation_date = slot.date
+    existing_reservation = await db.scalar(
+        select(models.Reservation.id)
+        .where(
+            models.Reservation.patient_id == patient_id,
+            models.Reservation.reservation_date == reservation_date
+        )
+        .limit(1)
+    )
+    
+    if existing_reservation:
+        raise HTTPException(status_code=400, detail="You already have a reservation for this day")
+    
+    # 予約を作成
+    db_reservation = models.Reservation(
+        patient_id=patient_id,
+        slot_id=slot.id,
+        reservation_date=reservation_date,
+        daily_number=await get_daily_number(db, reservation_date),
+        qr_code_data=generate_qr_code_data()
+    )
+    db.add(db_reservation)
+    
+    # 同時予約で同日の予約が先に作成された場合はユニークインデックスで弾かれる
+    try:
+        await db.flush()
+    except IntegrityError:
+        raise HTTPException(status_code=400, detail="You already have a reservation for this day")
+    
+    # 同じ日の待機リストへの登録は不要になるため削除
+    same_day_slot_ids = select(models.TimeSlot.id).where(models.TimeSlot.date == slot.date)
+    await db.execute(
+        delete(models.WaitlistEntry)
+        .where(
+            models.WaitlistEntry.patient_id == patient_id,
+            models.WaitlistEntry.slot_id.in_(same_day_slot_ids)
+        )
+        .execution_options(synchronize_session=False)
+    )
+    
+    return db_reservation
+
+
+async def promote_from_waitlist(db: AsyncSession, slot: models.TimeSlot):
+    """空いた枠を待機リストの登録順に割り当てる（コミットは呼び出し側）"""
+    promoted = []
+    entries = (await db.scalars(
+        select(models.WaitlistEntry)
+        .options(joinedload(models.WaitlistEntry.patient))
+        .where(models.WaitlistEntry.slot_id == slot.id)
+        .order_by(models.WaitlistEntry.created_at, models.WaitlistEntry.id)
+    )).all()
+    
+    for entry in entries:
+        # 無効なユーザーは対象外
+        if not entry.patient.is_active:
+            await db.delete(entry)
+            continue
+        
+        try:
+            async with db.begin_nested():
+                promoted.append(await book_slot(db, slot, entry.patient_id))
+        except HTTPException:
+            # 取り消した割り当ての分を読み直し、空き枠がなくなっていれば終了する
+            await db.refresh(slot)
+            if not slot.is_active or slot.available_spots <= 0:
+                break
+            # 同じ日に既に予約を持つ患者などは待機リストから外し、次の患者へ進む
+            await db.delete(entry)
+    
+    return promoted
 
 
 @router.post("/reservations/", response_model=schemas.Reservation)
-def create_reservation(
+async def create_reservation(
     reservation: schemas.ReservationCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: schemas.User = Depends(get_current_active_user)
 ):
     """患者が予約を作成するエンドポイント"""
     # スロットが存在するか確認
-    slot = db.query(models.TimeSlot).filter(models.TimeSlot.id == reservation.slot_id).first()
+    slot = await db.get(models.TimeSlot, reservation.slot_id)
     if not slot:
         raise HTTPException(status_code=404, detail="Time slot not found")
     
@@ -47,115 +203,183 @@ def create_reservation(
     if not slot.is_active:
         raise HTTPException(status_code=400, detail="This time slot is not available")
     
-    # 空き枠があるか確認
-    if slot.available_spots <= 0:
-        raise HTTPException(status_code=400, detail="No available spots in this time slot")
-    
-    # 同じ日に既に予約を持っているか確認
-    existing_reservation = db.query(models.Reservation)\
-        .join(models.TimeSlot)\
-        .filter(
-            models.TimeSlot.date == slot.date,
-            models.Reservation.patient_id == current_user.id
-        ).first()
-    
-    if existing_reservation:
-        raise HTTPException(status_code=400, detail="You already have a reservation for this day")
-    
-    # QRコードデータを生成
-    qr_code_data = generate_qr_code_data()
-    
-    # 日ごとの番号を取得
-    daily_number = get_daily_number(db, slot.date)
-    
-    # 予約を作成
-    db_reservation = models.Reservation(
-        patient_id=current_user.id,
-        slot_id=reservation.slot_id,
-        daily_number=daily_number,
-        qr_code_data=qr_code_data
-    )
+    # ロック競合時は上限回数まで再試行する
+    for attempt in range(BOOKING_MAX_RETRIES + 1):
+        try:
+            async with serialized_write():
+                db_reservation = await book_slot(db, slot, current_user.id)
+                version = await bump_availability_version(db, [slot.id])
+                await db.commit()
+            notify_availability_changed(version, [available_change(slot, -1)])
+            break
+        except DBAPIError as e:
+            # PostgreSQL（asyncpg）の直列化失敗やデッドロックは OperationalError 以外で送出される
+            await db.rollback()
+            if not is_lock_error(e):
+                # スキーマやディスクの異常などは再試行しても解決しないため、そのまま送出する
+                raise
+            if attempt == BOOKING_MAX_RETRIES:
+                raise HTTPException(status_code=503, detail="Reservation service is busy, please retry")
+            await asyncio.sleep(BOOKING_RETRY_BACKOFF_SECONDS * (2 ** attempt))
+            # ロールバックで失効した属性を読み直す（非同期セッションでは遅延ロードできない）
+            await db.refresh(slot)
+        except HTTPException:
+            await db.rollback()
+            raise
     
-    # スロットの空き枠を更新
-    slot.available_spots -= 1
-    
-    db.add(db_reservation)
-    db.commit()
-    db.refresh(db_reservation)
+    await db.refresh(db_reservation)
     
     return db_reservation
 
 
+def select_with_details(reservation_model, slot_model):
+    """予約と予約枠を結合し、患者・予約枠を一括で読み込むクエリ（アーカイブテーブルにも対応）"""
+    return select(reservation_model)\
+        .join(slot_model, reservation_model.slot_id == slot_model.id)\
+        .options(contains_eager(reservation_model.time_slot), joinedload(reservation_model.patient))
+
+
 @router.get("/reservations/", response_model=List[schemas.ReservationWithDetails])
-def get_my_reservations(
+async def get_my_reservations(
     include_past: bool = False,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: schemas.User = Depends(get_current_active_user)
 ):
     """患者が自分の予約一覧を取得するエンドポイント"""
-    query = db.query(models.Reservation)\
-        .filter(models.Reservation.patient_id == current_user.id)\
-        .join(models.TimeSlot)
+    # 患者・予約枠は結合済みの結果から読み込み、シリアライズ時の遅延ロードを防ぐ
+    query = select_with_details(models.Reservation, models.TimeSlot)\
+        .where(models.Reservation.patient_id == current_user.id)
     
     # 過去の予約を含めるかどうか
     if not include_past:
         today = datetime.now().date()
-        query = query.filter(models.TimeSlot.date >= today)
+        query = query.where(models.Reservation.reservation_date >= today)
     
     # 日付順にソート
     query = query.order_by(models.TimeSlot.date, models.TimeSlot.start_time)
+    reservations = (await db.scalars(query)).unique().all()
+    
+    # 過去の予約を含める場合のみアーカイブを参照（アーカイブは全て現行の予約より前の日付）
+    if include_past:
+        archived = (await db.scalars(
+            select_with_details(models.ArchivedReservation, models.ArchivedTimeSlot)
+            .where(models.ArchivedReservation.patient_id == current_user.id)
+            .order_by(models.ArchivedTimeSlot.date, models.ArchivedTimeSlot.start_time)
+        )).unique().all()
+        reservations = list(archived) + list(reservations)
     
-    return query.all()
+    return reservations
+
+
+def admin_sort_key(reservation_model, slot_model):
+    """管理者向け一覧の並び順 (日付, 開始時間, 予約番号, ID)"""
+    return (slot_model.date, slot_model.start_time, reservation_model.daily_number, reservation_model.id)
 
 
-@router.get("/reservations/admin", response_model=List[schemas.ReservationWithDetails])
-def get_all_reservations(
+@router.get("/reservations/admin", response_model=schemas.ReservationPage)
+async def get_all_reservations(
     date: date = None,
-    db: Session = Depends(get_db),
+    include_archived: bool = False,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_db),
     current_user: schemas.User = Depends(get_admin_user)
 ):
-    """管理者が全予約を取得するエンドポイント"""
-    query = db.query(models.Reservation).join(models.TimeSlot)
+    """管理者が全予約を取得するエンドポイント（(日付, 開始時間, 予約番号, ID) 順のキーセットページネーション）"""
+    last_key = None
+    if cursor:
+        # 引数の date が型名を隠すため、日付は datetime 経由で解析する
+        last_key = decode_cursor(cursor, (lambda value: datetime.fromisoformat(value).date(), dtime.fromisoformat, int, int))
     
-    # 特定の日付でフィルタリング
-    if date:
-        query = query.filter(models.TimeSlot.date == date)
+    # アーカイブを含める場合は、両方のテーブルから1ページ分ずつ取得して並び順でマージする
+    sources = [(models.Reservation, models.TimeSlot)]
+    if include_archived:
+        sources.insert(0, (models.ArchivedReservation, models.ArchivedTimeSlot))
     
-    # 日付順にソート
-    query = query.order_by(models.TimeSlot.date, models.TimeSlot.start_time, models.Reservation.daily_number)
+    reservations = []
+    for reservation_model, slot_model in sources:
+        query = select_with_details(reservation_model, slot_model)
+        
+        # 特定の日付でフィルタリング
+        if date:
+            query = query.where(reservation_model.reservation_date == date)
+        
+        # 前のページの最後の行より後ろから取得
+        sort_key = admin_sort_key(reservation_model, slot_model)
+        if last_key:
+            # 値は並び順のカラムの型で渡す（日付・時刻は整数に変換される）
+            query = query.where(tuple_(*sort_key) > tuple_(*last_key, types=[key.type for key in sort_key]))
+        
+        # 日付順にソート（次ページの有無を判定するため1件多く取得）
+        query = query.order_by(*sort_key).limit(limit + 1)
+        reservations.extend((await db.scalars(query)).unique().all())
+    
+    def row_key(reservation):
+        return (
+            reservation.time_slot.date,
+            reservation.time_slot.start_time,
+            reservation.daily_number,
+            reservation.id,
+        )
+    
+    if len(sources) > 1:
+        reservations.sort(key=row_key)
+    
+    next_cursor = None
+    if len(reservations) > limit:
+        reservations = reservations[:limit]
+        next_cursor = encode_cursor(row_key(reservations[-1]))
     
-    return query.all()
+    return {"items": reservations, "next_cursor": next_cursor}
 
 
 @router.get("/reservations/{qr_code}", response_model=schemas.ReservationWithDetails)
-def verify_reservation(
+async def verify_reservation(
     qr_code: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: schemas.User = Depends(get_current_active_user)
 ):
     """QRコードで予約を確認するエンドポイント"""
+    # キャッシュ済みの照会結果があればDBを参照しない
+    cached = qr_cache.get(qr_code)
+    if cached is not None:
+        return cached
+    
+    # 読み込み中に受付などで破棄された場合は、古い結果をキャッシュしない
+    generation = qr_cache.generation
+    
     # QRコードで予約を検索
-    reservation = db.query(models.Reservation)\
-        .filter(models.Reservation.qr_code_data == qr_code)\
-        .first()
+    reservation = await db.scalar(
+        select(models.Reservation)
+        .options(joinedload(models.Reservation.patient), joinedload(models.Reservation.time_slot))
+        .where(models.Reservation.qr_code_data == qr_code)
+    )
     
     if not reservation:
         raise HTTPException(status_code=404, detail="Reservation not found")
     
-    return reservation
+    result = schemas.ReservationWithDetails.model_validate(reservation, from_attributes=True)
+    qr_cache.set(qr_code, result, generation)
+    return result
+
+
+@router.get("/reservations/cache/stats", response_model=schemas.CacheStats)
+async def get_qr_cache_stats(current_user: schemas.User = Depends(get_admin_user)):
+    """QRコード照会キャッシュのヒット数・ミス数を取得するエンドポイント"""
+    return qr_cache.stats()
 
 
 @router.put("/reservations/{qr_code}/confirm", response_model=schemas.Reservation)
-def confirm_reservation(
+async def confirm_reservation(
     qr_code: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: schemas.User = Depends(get_admin_user)
 ):
     """管理者が予約を確認済みにするエンドポイント"""
     # QRコードで予約を検索
-    reservation = db.query(models.Reservation)\
-        .filter(models.Reservation.qr_code_data == qr_code)\
-        .first()
+    reservation = await db.scalar(
+        select(models.Reservation).where(models.Reservation.qr_code_data == qr_code)
+    )
     
     if not reservation:
         raise HTTPException(status_code=404, detail="Reservation not found")
@@ -166,23 +390,74 @@ def confirm_reservation(
     
     # 確認済みにする
     reservation.is_confirmed = True
-    db.commit()
-    db.refresh(reservation)
+    await db.commit()
+    qr_cache.invalidate(qr_code)
+    await db.refresh(reservation)
     
     return reservation
 
 
+@router.put("/reservations/confirm", response_model=List[schemas.BatchConfirmResult])
+async def confirm_reservations_batch(
+    request: schemas.BatchConfirmRequest,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_admin_user)
+):
+    """管理者が複数の予約を1トランザクションでまとめて確認済みにするエンドポイント"""
+    # 重複を除きつつ送信順を保持
+    qr_codes = list(dict.fromkeys(request.qr_codes))
+    if len(qr_codes) > BATCH_CONFIRM_MAX_CODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {BATCH_CONFIRM_MAX_CODES} QR codes can be confirmed at once"
+        )
+    
+    # 未確認の予約のみを1文で確認済みにする
+    confirmed = set((await db.execute(
+        update(models.Reservation)
+        .where(
+            models.Reservation.qr_code_data.in_(qr_codes),
+            models.Reservation.is_confirmed == False
+        )
+        .values(is_confirmed=True)
+        .returning(models.Reservation.qr_code_data)
+    )).scalars())
+    
+    # 更新されなかったもののうち、存在するものは確認済み
+    remaining = [qr_code for qr_code in qr_codes if qr_code not in confirmed]
+    already_confirmed = set()
+    if remaining:
+        already_confirmed = set((await db.scalars(
+            select(models.Reservation.qr_code_data)
+            .where(models.Reservation.qr_code_data.in_(remaining))
+        )).all())
+    
+    await db.commit()
+    for qr_code in confirmed:
+        qr_cache.invalidate(qr_code)
+    
+    results = []
+    for qr_code in qr_codes:
+        if qr_code in confirmed:
+            status_value = "confirmed"
+        elif qr_code in already_confirmed:
+            status_value = "already_confirmed"
+        else:
+            status_value = "not_found"
+        results.append({"qr_code": qr_code, "status": status_value})
+    
+    return results
+
+
 @router.delete("/reservations/{reservation_id}", status_code=status.HTTP_204_NO_CONTENT)
-def cancel_reservation(
+async def cancel_reservation(
     reservation_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: schemas.User = Depends(get_current_active_user)
 ):
     """予約をキャンセルするエンドポイント"""
     # 予約を検索
-    reservation = db.query(models.Reservation)\
-        .filter(models.Reservation.id == reservation_id)\
-        .first()
+    reservation = await db.get(models.Reservation, reservation_id)
     
     if not reservation:
         raise HTTPException(status_code=404, detail="Reservation not found")
@@ -195,13 +470,27 @@ def cancel_reservation(
     if reservation.is_confirmed:
         raise HTTPException(status_code=400, detail="Cannot cancel a confirmed reservation")
     
-    # 予約枠の利用可能数を更新
-    slot = db.query(models.TimeSlot).filter(models.TimeSlot.id == reservation.slot_id).first()
-    if slot:
-        slot.available_spots += 1
+    # 予約を削除し、予約枠の利用可能数を加算
+    qr_code = reservation.qr_code_data
+    slot_id = reservation.slot_id
+    await db.delete(reservation)
+    await db.execute(
+        update(models.TimeSlot)
+        .where(models.TimeSlot.id == slot_id)
+        .values(available_spots=models.TimeSlot.available_spots + 1, version=models.TimeSlot.version + 1)
+    )
+    await db.flush()
+    
+    # 同じトランザクション内で待機リストの先頭の患者を予約する
+    slot = await db.get(models.TimeSlot, slot_id, populate_existing=True)
+    changes = []
+    if slot and slot.is_active:
+        promoted = await promote_from_waitlist(db, slot)
+        changes.append(available_change(slot, 1 - len(promoted)))
     
-    # 予約を削除
-    db.delete(reservation)
-    db.commit()
+    version = await bump_availability_version(db, [slot_id])
+    await db.commit()
+    notify_availability_changed(version, changes)
+    qr_cache.invalidate(qr_code)
     
-    return None
\ No newline at end of file
+    return None
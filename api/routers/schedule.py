@@ -0,0 +1,143 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List
+from datetime import date
+
+from .. import models, schemas
+from ..availability import bump_availability_version, notify_availability_changed
+from ..database import get_db
+from ..schedule import materialize_rule, parse_rrule
+from .auth import get_admin_user
+
+router = APIRouter()
+
+
+def day_condition(day: date):
+    """指定した日の予約枠を選択する条件"""
+    return (models.TimeSlot.date == day,)
+
+
+@router.post("/schedule/rules", response_model=schemas.ScheduleRule)
+async def create_schedule_rule(
+    rule: schemas.ScheduleRuleCreate,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_admin_user)
+):
+    """管理者が繰り返しの診療スケジュールを登録するエンドポイント"""
+    try:
+        parse_rrule(rule.rrule, rule.start_date)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid rrule")
+    if rule.end_date and rule.end_date < rule.start_date:
+        raise HTTPException(status_code=400, detail="End date must be after start date")
+    if rule.start_time >= rule.end_time:
+        raise HTTPException(status_code=400, detail="End time must be after start time")
+    if rule.slot_duration_minutes <= 0:
+        raise HTTPException(status_code=400, detail="Slot duration must be positive")
+    
+    db_rule = models.ScheduleRule(**dict(rule))
+    db.add(db_rule)
+    
+    # 作成済みの日には、このルールの予約枠だけを追加する（他の枠や管理者が削除した日時はそのまま）
+    changed = await materialize_rule(db, db_rule)
+    await db.commit()
+    if changed:
+        notify_availability_changed(*changed)
+    await db.refresh(db_rule)
+    return db_rule
+
+
+@router.get("/schedule/rules", response_model=List[schemas.ScheduleRule])
+async def get_schedule_rules(
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_admin_user)
+):
+    """管理者が診療スケジュールの一覧を取得するエンドポイント"""
+    return (await db.scalars(select(models.ScheduleRule).order_by(models.ScheduleRule.id))).all()
+
+
+@router.delete("/schedule/rules/{rule_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_schedule_rule(
+    rule_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_admin_user)
+):
+    """管理者が診療スケジュールを削除するエンドポイント（作成済みの予約枠は残る）"""
+    db_rule = await db.get(models.ScheduleRule, rule_id)
+    if not db_rule:
+        raise HTTPException(status_code=404, detail="Schedule rule not found")
+    
+    await db.delete(db_rule)
+    await db.commit()
+    return None
+
+
+@router.get("/schedule/closures", response_model=List[schemas.ScheduleClosure])
+async def get_schedule_closures(
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_admin_user)
+):
+    """管理者が休診日の一覧を取得するエンドポイント"""
+    return (await db.scalars(
+        select(models.ScheduleClosure)
+        .where(models.ScheduleClosure.day >= date.today())
+        .order_by(models.ScheduleClosure.day)
+    )).all()
+
+
+@router.put("/schedule/closures/{day}", response_model=schemas.ScheduleClosure)
+async def close_day(
+    day: date,
+    closure: schemas.ScheduleClosureCreate,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_admin_user)
+):
+    """管理者が休診日を登録するエンドポイント
+    
+    その日の予約枠はルールから作成されなくなり、作成済みで予約のない枠は無効化される。
+    """
+    db_closure = await db.get(models.ScheduleClosure, day)
+    if not db_closure:
+        db_closure = models.ScheduleClosure(day=day)
+        db.add(db_closure)
+    db_closure.note = closure.note
+    
+    await db.execute(
+        update(models.TimeSlot)
+        .where(
+            *day_condition(day),
+            models.TimeSlot.available_spots == models.TimeSlot.capacity
+        )
+        .values(is_active=False, version=models.TimeSlot.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    await bump_availability_version(db, select(models.TimeSlot.id).where(*day_condition(day)))
+    await db.commit()
+    notify_availability_changed()
+    return db_closure
+
+
+@router.delete("/schedule/closures/{day}", status_code=status.HTTP_204_NO_CONTENT)
+async def reopen_day(
+    day: date,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_admin_user)
+):
+    """管理者が休診日を取り消すエンドポイント（無効化した予約枠を有効に戻し、不足分はルールから作成する）"""
+    db_closure = await db.get(models.ScheduleClosure, day)
+    if not db_closure:
+        raise HTTPException(status_code=404, detail="Closure not found")
+    
+    await db.delete(db_closure)
+    await db.execute(
+        update(models.TimeSlot)
+        .where(*day_condition(day), models.TimeSlot.is_active == False)
+        .values(is_active=True, version=models.TimeSlot.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    await db.execute(delete(models.MaterializedDay).where(models.MaterializedDay.day == day))
+    await bump_availability_version(db, select(models.TimeSlot.id).where(*day_condition(day)))
+    await db.commit()
+    notify_availability_changed()
+    return None
@@ -1,16 +1,45 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, status
+from sqlalchemy import Integer, bindparam, delete, insert, literal_column, select, tuple_, type_coerce, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
-from datetime import datetime, time, timedelta
-import calendar
+from datetime import date, datetime, time, timedelta
 from pydantic import BaseModel
 
 from .. import models, schemas
+from ..availability import (
+    AVAILABILITY_VERSION_ID, bump_availability_version, get_availability_version, load_availability_index,
+    notify_availability_changed, summary_cache
+)
+from ..availability_index import MINUTES_PER_DAY, inserted_rows_changes, minute_of_day, slot_change
 from ..database import get_db
+from ..pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, encode_cursor
+from ..schedule import (
+    MATERIALIZE_DEFAULT_DAYS, MATERIALIZE_MAX_DAYS, MATERIALIZE_REQUEST_MAX_DAYS, materialize_days,
+    matching_rule_days, slot_times, tombstone_statement
+)
 from .auth import get_admin_user, get_current_active_user
+from .reservations import promote_from_waitlist, qr_cache, renumber_reservations
 
 router = APIRouter()
 
+# 空き状況サマリーで一度に集計できる日数の上限
+SUMMARY_MAX_DAYS = 366
+
+# 最短の空き枠検索で一度に返す件数
+NEXT_AVAILABLE_DEFAULT_LIMIT = 5
+NEXT_AVAILABLE_MAX_LIMIT = 50
+
+# 差分同期で一度に返す予約枠の上限（超える場合は一覧の取得し直しを求める）
+SLOT_CHANGES_MAX_SLOTS = 1000
+
+# 期間の一括操作で一度に対象にできる日数の上限
+RANGE_MAX_DAYS = 366
+
+# 予約枠の更新が予約・キャンセルと競合した場合の再試行回数
+SLOT_UPDATE_MAX_RETRIES = 3
+
 # リクエストボディ用のモデルを定義
 class BulkCreateSlotsRequest(BaseModel):
     days_of_week: List[int]
@@ -20,9 +49,9 @@ class BulkCreateSlotsRequest(BaseModel):
     capacity: int = 2
 
 @router.post("/slots/", response_model=schemas.TimeSlot)
-def create_slot(
+async def create_slot(
     slot: schemas.TimeSlotCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: schemas.User = Depends(get_admin_user)
 ):
     """管理者が単一の予約枠を作成するエンドポイント"""
@@ -33,17 +62,20 @@ def create_slot(
         capacity=slot.capacity,
     )
     db.add(db_slot)
-    db.commit()
-    db.refresh(db_slot)
+    await db.flush()
+    version = await bump_availability_version(db, [db_slot.id])
+    await db.commit()
+    notify_availability_changed(version, [slot_change(db_slot)])
+    await db.refresh(db_slot)
     return db_slot
 
 
 @router.post("/slots/bulk", response_model=List[schemas.TimeSlot])
-def create_slots_bulk(
-    start_date: datetime,
-    end_date: datetime,
+async def create_slots_bulk(
+    start_date: date,
+    end_date: date,
     data: BulkCreateSlotsRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: schemas.User = Depends(get_admin_user)
 ):
     """管理者が複数の予約枠をまとめて作成するエンドポイント"""
@@ -57,123 +89,574 @@ def create_slots_bulk(
         if day < 0 or day > 6:
             raise HTTPException(status_code=400, detail="Days of week must be between 0 and 6")
     
-    created_slots = []
-    current_date = start_date.date()
-    end_date = end_date.date()
-    
-    while current_date <= end_date:
-        # 選択された曜日かどうかチェック
-        weekday = current_date.weekday()
-        if weekday in data.days_of_week:
-            # 指定された時間帯に指定間隔おきのスロットを作成
-            for hour in range(data.start_hour, data.end_hour):
-                for minute in [0, 30]:
-                    if hour == data.end_hour and minute > 0:
-                        continue
-                    
-                    start_time = time(hour, minute)
-                    
-                    # スロット時間（分）を計算
-                    end_minute = (minute + data.slot_duration_minutes) % 60
-                    end_hour = hour + (minute + data.slot_duration_minutes) // 60
-                    end_time = time(end_hour, end_minute)
-                    
-                    # スロットが既に存在するかチェック
-                    existing_slot = db.query(models.TimeSlot).filter(
-                        models.TimeSlot.date == current_date,
-                        models.TimeSlot.start_time == start_time
-                    ).first()
-                    
-                    if not existing_slot:
-                        # 新しいスロットを作成
-                        db_slot = models.TimeSlot(
-                            date=current_date,
-                            start_time=start_time,
-                            end_time=end_time,
-                            capacity=data.capacity
-                        )
-                        db.add(db_slot)
-                        created_slots.append(db_slot)
-        
-        # 翌日に進む
+    if data.slot_duration_minutes <= 0:
+        raise HTTPException(status_code=400, detail="Slot duration must be positive")
+    if not 0 <= data.start_hour < data.end_hour <= 24:
+        raise HTTPException(status_code=400, detail="Hours must satisfy 0 <= start_hour < end_hour <= 24")
+    
+    # 1日分の開始・終了時刻を計算（終了時刻が end_hour を超える枠は作らない）
+    daily_times = slot_times(data.start_hour * 60, data.end_hour * 60, data.slot_duration_minutes)
+    
+    # 期間内の既存スロットを1回のクエリでまとめて取得
+    first_day = start_date
+    last_day = end_date
+    existing = set((await db.execute(
+        select(models.TimeSlot.date, models.TimeSlot.start_time)
+        .where(models.TimeSlot.date >= first_day, models.TimeSlot.date <= last_day)
+    )).all())
+    
+    # 作成対象のスロットをメモリ上で組み立てる
+    rows = []
+    weekdays = set(data.days_of_week)
+    current_date = first_day
+    while current_date <= last_day:
+        if current_date.weekday() in weekdays:
+            for start_time, end_time in daily_times:
+                if (current_date, start_time) not in existing:
+                    rows.append({
+                        "date": current_date,
+                        "start_time": start_time,
+                        "end_time": end_time,
+                        "capacity": data.capacity,
+                        "available_spots": data.capacity,
+                        "is_active": True,
+                        "created_at": datetime.now()
+                    })
         current_date += timedelta(days=1)
     
-    db.commit()
+    if not rows:
+        return []
     
-    # 作成したスロットを返す前にリフレッシュ
-    for slot in created_slots:
-        db.refresh(slot)
+    # 1回の一括INSERT（executemany）で作成する
+    await db.execute(insert(models.TimeSlot.__table__), rows)
+    
+    # 作成したスロットを期間の範囲クエリ1回で読み直す（変更ログにIDを記録するためコミット前に読む）
+    slots_in_range = (await db.scalars(
+        select(models.TimeSlot)
+        .where(models.TimeSlot.date >= first_day, models.TimeSlot.date <= last_day)
+        .order_by(models.TimeSlot.date, models.TimeSlot.start_time, models.TimeSlot.id)
+    )).all()
+    created = [slot for slot in slots_in_range if (slot.date, slot.start_time) not in existing]
+    
+    version = await bump_availability_version(db, [slot.id for slot in created])
+    await db.commit()
+    notify_availability_changed(version, inserted_rows_changes(rows))
+    return created
+
+
+async def materialize_requested_range(db: AsyncSession, start: date, end: date):
+    """リクエストの期間の予約枠をルールから作成する（作成が必要な日数が上限を超える場合は 400）
     
-    return created_slots
+    ルールの予約枠が作成されうる未作成の日だけを数えるため、作成済みの期間やルールのない期間は長くてもよい。
+    読み取りのリクエストで大量の行を書き込まないよう、1回に作成する日数を制限する。
+    """
+    days = await matching_rule_days(db, start, end)
+    if len(days) > MATERIALIZE_REQUEST_MAX_DAYS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Date range must include at most {MATERIALIZE_REQUEST_MAX_DAYS} days not yet created from schedule rules"
+        )
+    await materialize_days(db, days)
+
+
+def etag_matches(header: Optional[str], etag: str):
+    """If-None-Match / If-Match ヘッダーが現在のETagと一致するかどうかを判定"""
+    if not header:
+        return False
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return "*" in candidates or any(candidate.removeprefix("W/") == etag for candidate in candidates)
 
 
-@router.get("/slots/", response_model=List[schemas.TimeSlot])
-def get_slots(
-    start_date: datetime = None,
-    end_date: datetime = None,
+@router.get("/slots/", response_model=schemas.TimeSlotPage)
+async def get_slots(
+    response: Response,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
     available_only: bool = False,
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db),
     current_user: schemas.User = Depends(get_current_active_user)
 ):
-    """予約枠を取得するエンドポイント"""
-    query = db.query(models.TimeSlot).filter(models.TimeSlot.is_active == True)
+    """予約枠を取得するエンドポイント（(日付, 開始時間, ID) 順のキーセットページネーション）
+    
+    空き状況のバージョンをETagとして返し、If-None-Match が一致する場合は
+    予約枠を読まずに304を返す。
+    """
+    # スケジュールルールから未作成の日の予約枠を作成してからバージョンを読む
+    materialize_start = start_date or date.today()
+    await materialize_requested_range(db, materialize_start, end_date or materialize_start + timedelta(days=MATERIALIZE_DEFAULT_DAYS))
+    
+    etag = f'"{await get_availability_version(db)}"'
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    
+    query = select(models.TimeSlot).where(models.TimeSlot.is_active == True)
     
-    # 開始日と終了日でフィルタリング
+    # 開始日と終了日でフィルタリング（終了日当日の枠も含める）
     if start_date:
-        query = query.filter(models.TimeSlot.date >= start_date.date())
+        query = query.where(models.TimeSlot.date >= start_date)
     if end_date:
-        query = query.filter(models.TimeSlot.date <= end_date.date())
+        query = query.where(models.TimeSlot.date <= end_date)
     
     # 空き枠のみ表示オプション
     if available_only:
-        query = query.filter(models.TimeSlot.available_spots > 0)
+        query = query.where(models.TimeSlot.available_spots > 0)
+    
+    # 前のページの最後の行より後ろから取得
+    sort_key = (models.TimeSlot.date, models.TimeSlot.start_time, models.TimeSlot.id)
+    if cursor:
+        last_key = decode_cursor(cursor, (date.fromisoformat, time.fromisoformat, int))
+        # 値は並び順のカラムの型で渡す（日付・時刻は整数に変換される）
+        query = query.where(tuple_(*sort_key) > tuple_(*last_key, types=[key.type for key in sort_key]))
+    
+    # 日付順に並べ替え（次ページの有無を判定するため1件多く取得）
+    slots = (await db.scalars(query.order_by(*sort_key).limit(limit + 1))).all()
+    
+    next_cursor = None
+    if len(slots) > limit:
+        slots = slots[:limit]
+        last = slots[-1]
+        next_cursor = encode_cursor((last.date, last.start_time, last.id))
+    
+    return {"items": slots, "next_cursor": next_cursor}
+
+
+@router.get("/slots/summary", response_model=List[schemas.DaySummary])
+async def get_slots_summary(
+    start_date: date,
+    end_date: date,
+    from_time: Optional[time] = None,
+    to_time: Optional[time] = None,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_active_user)
+):
+    """期間内の日別の枠数・定員・残り枠・最初の空き時間を取得するエンドポイント（カレンダー表示用）
+    
+    開始時刻の範囲（from_time〜to_time）を指定すると、その時間帯の予約枠だけを集計する。
+    """
+    if start_date > end_date:
+        raise HTTPException(status_code=400, detail="End date must be after start date")
+    if (end_date - start_date).days + 1 > SUMMARY_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Date range must be at most {SUMMARY_MAX_DAYS} days")
+    if from_time and to_time and from_time > to_time:
+        raise HTTPException(status_code=400, detail="End time must be after start time")
+    
+    await materialize_requested_range(db, start_date, end_date)
+    
+    cache_key = (start_date, end_date, from_time, to_time)
+    cached = summary_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    # 集計中に予約などでキャッシュが無効化された場合は、古い集計結果を保存しない
+    generation = summary_cache.generation
+    
+    # DBを集計せず、プロセス内の空き状況インデックスから配列演算で求める
+    index = await load_availability_index(db)
+    summary = index.summarize(
+        start_date,
+        end_date,
+        minute_of_day(from_time) if from_time else 0,
+        minute_of_day(to_time) if to_time else MINUTES_PER_DAY - 1
+    )
+    summary_cache.set(cache_key, summary, generation)
+    return summary
+
+
+@router.get("/slots/changes", response_model=schemas.SlotChanges)
+async def get_slot_changes(
+    since: int = Query(..., ge=0),
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_active_user)
+):
+    """指定した空き状況のバージョンより後に変更された予約枠を取得するエンドポイント（差分同期用）
+    
+    since には一覧取得時のETag、または前回の応答の version を指定する。
+    変更ログが削除済みの範囲や変更が多すぎる場合は reset を返すので、一覧を取得し直す。
+    """
+    row = (await db.execute(
+        select(models.AvailabilityVersion.version, models.AvailabilityVersion.compacted_version)
+        .where(models.AvailabilityVersion.id == AVAILABILITY_VERSION_ID)
+    )).one_or_none()
+    version, compacted_version = row or (0, 0)
+    if since > version or since < compacted_version:
+        return {"version": version, "reset": True}
+    
+    # 現在のバージョンまでに変更された予約枠のID（以降の変更は次回の取得に含まれる）
+    slot_ids = (await db.scalars(
+        select(models.SlotChangeLog.slot_id)
+        .where(models.SlotChangeLog.version > since, models.SlotChangeLog.version <= version)
+        .distinct()
+        .limit(SLOT_CHANGES_MAX_SLOTS + 1)
+    )).all()
+    if len(slot_ids) > SLOT_CHANGES_MAX_SLOTS:
+        return {"version": version, "reset": True}
+    
+    slots = []
+    if slot_ids:
+        slots = (await db.scalars(
+            select(models.TimeSlot)
+            .where(models.TimeSlot.id.in_(slot_ids))
+            .order_by(models.TimeSlot.date, models.TimeSlot.start_time, models.TimeSlot.id)
+        )).all()
+    deleted_ids = sorted(set(slot_ids) - {slot.id for slot in slots})
+    return {"version": version, "slots": slots, "deleted_ids": deleted_ids}
+
+
+@router.get("/slots/next-available", response_model=List[schemas.TimeSlot])
+async def get_next_available_slots(
+    after: Optional[datetime] = None,
+    limit: int = Query(NEXT_AVAILABLE_DEFAULT_LIMIT, ge=1, le=NEXT_AVAILABLE_MAX_LIMIT),
+    weekdays: Optional[List[int]] = Query(None),
+    from_time: Optional[time] = None,
+    to_time: Optional[time] = None,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_active_user)
+):
+    """指定日時より後で空きのある予約枠を早い順に limit 件取得するエンドポイント
+    
+    weekdays（0=月曜〜6=日曜）と開始時刻の範囲（from_time〜to_time）で絞り込める。
+    空き枠の部分インデックスを日時順にたどり、limit 件見つかった時点で打ち切る。
+    """
+    if weekdays and any(day < 0 or day > 6 for day in weekdays):
+        raise HTTPException(status_code=400, detail="Days of week must be between 0 and 6")
     
-    # 日付順に並べ替え
-    query = query.order_by(models.TimeSlot.date, models.TimeSlot.start_time)
+    after = after or datetime.now()
     
-    return query.all()
+    # 部分インデックスの条件と同じ形で書く（定数をバインド変数にするとインデックスが使われない）
+    query = select(models.TimeSlot).where(
+        models.TimeSlot.is_active == True,
+        models.TimeSlot.available_spots > literal_column("0"),
+        tuple_(models.TimeSlot.date, models.TimeSlot.start_time) > tuple_(
+            after.date(), after.time(), types=[models.TimeSlot.date.type, models.TimeSlot.start_time.type]
+        )
+    )
+    if weekdays:
+        # 基準日（1970-01-01）は木曜日のため、日数に3を足して7で割った余りが 0=月曜〜6=日曜になる
+        query = query.where(((type_coerce(models.TimeSlot.date, Integer) + 3) % 7).in_(weekdays))
+    if from_time:
+        query = query.where(models.TimeSlot.start_time >= from_time)
+    if to_time:
+        query = query.where(models.TimeSlot.start_time <= to_time)
+    query = query.order_by(models.TimeSlot.date, models.TimeSlot.start_time).limit(limit)
+    
+    # ルールから条件に合う予約枠が作成されうる未作成の日だけを、近い順に期間ごとに作成する
+    # （条件に合うルールがなければ書き込まない。1回のリクエストで作成する日数にも上限を設ける）
+    horizon = date.today() + timedelta(days=MATERIALIZE_MAX_DAYS)
+    days = await matching_rule_days(db, after.date(), horizon, weekdays, from_time, to_time)
+    days = days[:MATERIALIZE_REQUEST_MAX_DAYS]
+    slots = (await db.scalars(query)).all()
+    position = 0
+    # 見つかった枠より前に未作成の日が残っている間だけ作成する
+    while position < len(days) and (len(slots) < limit or days[position] <= slots[-1].date):
+        chunk = days[position:position + MATERIALIZE_DEFAULT_DAYS]
+        position += len(chunk)
+        if await materialize_days(db, chunk):
+            slots = (await db.scalars(query)).all()
+    return slots
+
+
+def slot_range_conditions(slot_range: schemas.SlotRange):
+    """期間と開始時刻の範囲に該当する予約枠を選択する条件（範囲が不正な場合は 400）"""
+    if slot_range.start_date > slot_range.end_date:
+        raise HTTPException(status_code=400, detail="End date must be after start date")
+    if (slot_range.end_date - slot_range.start_date).days + 1 > RANGE_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Date range must be at most {RANGE_MAX_DAYS} days")
+    if slot_range.from_time and slot_range.to_time and slot_range.from_time > slot_range.to_time:
+        raise HTTPException(status_code=400, detail="End time must be after start time")
+    
+    conditions = [models.TimeSlot.date >= slot_range.start_date, models.TimeSlot.date <= slot_range.end_date]
+    if slot_range.from_time:
+        conditions.append(models.TimeSlot.start_time >= slot_range.from_time)
+    if slot_range.to_time:
+        conditions.append(models.TimeSlot.start_time <= slot_range.to_time)
+    return conditions
+
+
+async def reserved_slots_in(db: AsyncSession, *conditions):
+    """条件に該当する予約枠のうち、予約が入っている枠を日時順に取得"""
+    return (await db.scalars(
+        select(models.TimeSlot)
+        .where(*conditions, models.TimeSlot.available_spots < models.TimeSlot.capacity)
+        .order_by(models.TimeSlot.date, models.TimeSlot.start_time)
+        .execution_options(populate_existing=True)
+    )).all()
+
+
+async def finish_range_operation(db: AsyncSession, changed):
+    """期間一括操作の変更をコミットし、空き状況と予約照会のキャッシュを無効化する"""
+    await bump_availability_version(db, changed)
+    await db.commit()
+    notify_availability_changed()
+    qr_cache.clear()
+
+
+@router.post("/slots/range/deactivate", response_model=schemas.SlotRangeResult)
+async def deactivate_slot_range(
+    slot_range: schemas.SlotRange,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_admin_user)
+):
+    """管理者が期間内の予約枠をまとめて無効化するエンドポイント（休診・医師の不在など）
+    
+    予約が入っている枠も新規予約を受け付けなくなる。既存の予約は残るため、連絡が必要な枠として返す。
+    """
+    conditions = slot_range_conditions(slot_range)
+    # ルールから未作成の日も、作成してから無効化する（後から有効な枠が作られないように）
+    await materialize_requested_range(db, slot_range.start_date, slot_range.end_date)
+    
+    # 変更ログに記録するため、更新した枠のIDを RETURNING で受け取る
+    changed = (await db.scalars(
+        update(models.TimeSlot)
+        .where(*conditions, models.TimeSlot.is_active == True)
+        .values(is_active=False, version=models.TimeSlot.version + 1)
+        .returning(models.TimeSlot.id)
+        .execution_options(synchronize_session=False)
+    )).all()
+    reserved = await reserved_slots_in(db, *conditions)
+    await finish_range_operation(db, changed)
+    return {"affected": len(changed), "reserved_slots": reserved}
+
+
+@router.post("/slots/range/reopen", response_model=schemas.SlotRangeResult)
+async def reopen_slot_range(
+    slot_range: schemas.SlotRange,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_admin_user)
+):
+    """管理者が期間内の無効化した予約枠をまとめて有効に戻すエンドポイント"""
+    conditions = slot_range_conditions(slot_range)
+    
+    changed = (await db.scalars(
+        update(models.TimeSlot)
+        .where(*conditions, models.TimeSlot.is_active == False)
+        .values(is_active=True, version=models.TimeSlot.version + 1)
+        .returning(models.TimeSlot.id)
+        .execution_options(synchronize_session=False)
+    )).all()
+    reserved = await reserved_slots_in(db, *conditions)
+    await finish_range_operation(db, changed)
+    return {"affected": len(changed), "reserved_slots": reserved}
+
+
+@router.post("/slots/range/delete", response_model=schemas.SlotRangeResult)
+async def delete_slot_range(
+    slot_range: schemas.SlotRange,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_admin_user)
+):
+    """管理者が期間内の予約のない予約枠をまとめて削除するエンドポイント（予約が入っている枠は削除せずに返す）"""
+    conditions = slot_range_conditions(slot_range)
+    await materialize_requested_range(db, slot_range.start_date, slot_range.end_date)
+    
+    # 予約の有無は削除と同じ文で判定する（確認後に入った予約の枠を消さないように）
+    unreserved = [*conditions, models.TimeSlot.available_spots == models.TimeSlot.capacity]
+    await db.execute(
+        delete(models.WaitlistEntry)
+        .where(models.WaitlistEntry.slot_id.in_(select(models.TimeSlot.id).where(*unreserved)))
+        .execution_options(synchronize_session=False)
+    )
+    # 削除した日時はスケジュールルールから作り直さない
+    await db.execute(tombstone_statement(*unreserved))
+    deleted = (await db.scalars(
+        delete(models.TimeSlot)
+        .where(*unreserved)
+        .returning(models.TimeSlot.id)
+        .execution_options(synchronize_session=False)
+    )).all()
+    reserved = await reserved_slots_in(db, *conditions)
+    await finish_range_operation(db, deleted)
+    return {"affected": len(deleted), "reserved_slots": reserved}
+
+
+@router.post("/slots/range/shift", response_model=schemas.SlotRangeResult)
+async def shift_slot_range(
+    slot_range: schemas.SlotRangeShift,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_admin_user)
+):
+    """管理者が期間内の予約枠を指定した日数・分数だけまとめて移動するエンドポイント
+    
+    予約が入っている枠も予約ごと移動し、患者への連絡が必要な枠として返す。
+    """
+    conditions = slot_range_conditions(slot_range)
+    if not slot_range.days and not slot_range.minutes:
+        raise HTTPException(status_code=400, detail="Shift must not be zero")
+    await materialize_requested_range(db, slot_range.start_date, slot_range.end_date)
+    
+    slots = (await db.execute(
+        select(models.TimeSlot.id, models.TimeSlot.version, models.TimeSlot.date,
+               models.TimeSlot.start_time, models.TimeSlot.end_time, models.TimeSlot.available_spots < models.TimeSlot.capacity)
+        .where(*conditions)
+    )).all()
+    if not slots:
+        return {"affected": 0, "reserved_slots": []}
+    
+    # 移動後の日時を計算（日をまたぐ移動は不可）
+    shift = timedelta(days=slot_range.days, minutes=slot_range.minutes)
+    slot_rows, reservation_dates = [], {}
+    for slot_id, version, slot_date, start_time, end_time, has_reservations in slots:
+        new_date = slot_date + timedelta(days=slot_range.days)
+        new_start = datetime.combine(slot_date, start_time) + shift
+        new_end = datetime.combine(slot_date, end_time) + shift
+        if new_start.date() != new_date or new_end.date() != new_date:
+            raise HTTPException(status_code=400, detail="Shifted slots must stay within the same day")
+        slot_rows.append({
+            "slot_id": slot_id,
+            "slot_version": version,
+            "new_date": new_date,
+            "new_start_time": new_start.time(),
+            "new_end_time": new_end.time()
+        })
+        if has_reservations and slot_range.days:
+            reservation_dates[slot_id] = new_date
+    
+    # 対象外の既存の枠と重ならないことを確認
+    shifted_ids = [row["slot_id"] for row in slot_rows]
+    new_dates = [row["new_date"] for row in slot_rows]
+    existing = set((await db.execute(
+        select(models.TimeSlot.date, models.TimeSlot.start_time)
+        .where(
+            models.TimeSlot.date >= min(new_dates),
+            models.TimeSlot.date <= max(new_dates),
+            models.TimeSlot.id.not_in(shifted_ids)
+        )
+    )).all())
+    if any((row["new_date"], row["new_start_time"]) in existing for row in slot_rows):
+        raise HTTPException(status_code=400, detail="Shifted slots overlap existing slots")
+    
+    # 移動元の日時はスケジュールルールから作り直さない
+    await db.execute(tombstone_statement(models.TimeSlot.id.in_(shifted_ids)))
+    
+    # 予約枠ごとに値が異なるため、1つのUPDATE文をまとめて実行する（version で同時更新を検出）
+    table = models.TimeSlot.__table__
+    result = await db.execute(
+        update(table)
+        .where(table.c.id == bindparam("slot_id"), table.c.version == bindparam("slot_version"))
+        .values(
+            date=bindparam("new_date"),
+            start_time=bindparam("new_start_time"),
+            end_time=bindparam("new_end_time"),
+            version=table.c.version + 1
+        ),
+        slot_rows
+    )
+    if result.rowcount != len(slot_rows):
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Slots were modified by another request, please retry")
+    
+    # 別の日に移動した予約は、移動先の日の予約番号を時刻順に採番し直す
+    if reservation_dates:
+        moved = (await db.execute(
+            select(models.Reservation.id, models.Reservation.slot_id)
+            .join(models.TimeSlot, models.TimeSlot.id == models.Reservation.slot_id)
+            .where(models.Reservation.slot_id.in_(list(reservation_dates)))
+            .order_by(models.TimeSlot.start_time, models.Reservation.daily_number)
+        )).all()
+        reservation_ids_by_date = {}
+        for reservation_id, slot_id in moved:
+            reservation_ids_by_date.setdefault(reservation_dates[slot_id], []).append(reservation_id)
+        try:
+            await renumber_reservations(db, reservation_ids_by_date)
+        except IntegrityError:
+            await db.rollback()
+            raise HTTPException(status_code=400, detail="A patient of these slots already has a reservation on the new date")
+    
+    reserved = await reserved_slots_in(db, models.TimeSlot.id.in_(shifted_ids))
+    await finish_range_operation(db, shifted_ids)
+    return {"affected": len(slot_rows), "reserved_slots": reserved}
 
 
 @router.put("/slots/{slot_id}", response_model=schemas.TimeSlot)
-def update_slot(
+async def update_slot(
     slot_id: int,
     slot: schemas.TimeSlotCreate,
-    db: Session = Depends(get_db),
+    if_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db),
     current_user: schemas.User = Depends(get_admin_user)
 ):
-    """管理者が予約枠を更新するエンドポイント"""
-    db_slot = db.query(models.TimeSlot).filter(models.TimeSlot.id == slot_id).first()
-    if not db_slot:
-        raise HTTPException(status_code=404, detail="Slot not found")
+    """管理者が予約枠を更新するエンドポイント
     
-    # 予約が既に入っている場合、容量の減少はできない
-    if slot.capacity < db_slot.capacity - db_slot.available_spots:
-        raise HTTPException(status_code=400, detail="Cannot reduce capacity below current reservations")
-    
-    # データ更新
-    db_slot.date = slot.date
-    db_slot.start_time = slot.start_time
-    db_slot.end_time = slot.end_time
+    If-Match に予約枠の version を指定した場合、既に更新されていれば 409 を返す。
+    指定しない場合は、同時に入った予約などと競合したときに読み直して再試行する。
+    """
+    for attempt in range(SLOT_UPDATE_MAX_RETRIES + 1):
+        db_slot = await db.get(models.TimeSlot, slot_id, populate_existing=True)
+        if not db_slot:
+            raise HTTPException(status_code=404, detail="Slot not found")
+        if if_match and not etag_matches(if_match, f'"{db_slot.version}"'):
+            raise HTTPException(status_code=409, detail="Slot was modified by another request")
+        
+        # 予約が既に入っている場合、容量の減少はできない
+        if slot.capacity < db_slot.capacity - db_slot.available_spots:
+            raise HTTPException(status_code=400, detail="Cannot reduce capacity below current reservations")
+        
+        # 日付が変更された場合、予約側の予約日を合わせ、移動先の日の予約番号を採番し直す
+        if db_slot.date != slot.date:
+            reservation_ids = (await db.scalars(
+                select(models.Reservation.id)
+                .where(models.Reservation.slot_id == slot_id)
+                .order_by(models.Reservation.daily_number)
+            )).all()
+            if reservation_ids:
+                try:
+                    await renumber_reservations(db, {slot.date: list(reservation_ids)})
+                except IntegrityError:
+                    await db.rollback()
+                    raise HTTPException(status_code=400, detail="A patient of this slot already has a reservation on the new date")
+        
+        # 移動元の日時はスケジュールルールから作り直さない
+        if (db_slot.date, db_slot.start_time) != (slot.date, slot.start_time):
+            await db.execute(tombstone_statement(models.TimeSlot.id == slot_id))
+        
+        # データ更新
+        db_slot.date = slot.date
+        db_slot.start_time = slot.start_time
+        db_slot.end_time = slot.end_time
+        
+        # 容量が変更された場合、利用可能な枠も更新
+        if slot.capacity != db_slot.capacity:
+            taken_spots = db_slot.capacity - db_slot.available_spots
+            db_slot.capacity = slot.capacity
+            db_slot.available_spots = slot.capacity - taken_spots
+        
+        # 読み込み後に予約・キャンセルが入っていれば version が一致せず StaleDataError になる
+        try:
+            await db.flush()
+            break
+        except StaleDataError:
+            await db.rollback()
+            if if_match or attempt == SLOT_UPDATE_MAX_RETRIES:
+                raise HTTPException(status_code=409, detail="Slot was modified by another request, please retry")
+        except IntegrityError:
+            await db.rollback()
+            raise HTTPException(status_code=400, detail="A patient of this slot already has a reservation on the new date")
     
-    # 容量が変更された場合、利用可能な枠も更新
-    if slot.capacity != db_slot.capacity:
-        taken_spots = db_slot.capacity - db_slot.available_spots
-        db_slot.capacity = slot.capacity
-        db_slot.available_spots = slot.capacity - taken_spots
+    # 枠が増えた場合は待機リストの患者を予約する
+    await db.refresh(db_slot)
+    if db_slot.is_active and db_slot.available_spots > 0:
+        await promote_from_waitlist(db, db_slot)
     
-    db.commit()
-    db.refresh(db_slot)
+    await bump_availability_version(db, [slot_id])
+    await db.commit()
+    notify_availability_changed()
+    # キャッシュ済みの予約照会結果に古い枠情報が残らないようにする
+    qr_cache.clear()
+    await db.refresh(db_slot)
     return db_slot
 
 
 @router.delete("/slots/{slot_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_slot(
+async def delete_slot(
     slot_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: schemas.User = Depends(get_admin_user)
 ):
     """管理者が予約枠を削除するエンドポイント"""
-    db_slot = db.query(models.TimeSlot).filter(models.TimeSlot.id == slot_id).first()
+    db_slot = await db.get(models.TimeSlot, slot_id)
     if not db_slot:
         raise HTTPException(status_code=404, detail="Slot not found")
     
@@ -181,6 +664,21 @@ def delete_slot(
     if db_slot.capacity > db_slot.available_spots:
         raise HTTPException(status_code=400, detail="Cannot delete slot with existing reservations")
     
-    db.delete(db_slot)
-    db.commit()
+    await db.execute(
+        delete(models.WaitlistEntry)
+        .where(models.WaitlistEntry.slot_id == slot_id)
+        .execution_options(synchronize_session=False)
+    )
+    removed = [slot_change(db_slot, -1)] if db_slot.is_active else []
+    # 削除した日時はスケジュールルールから作り直さない
+    await db.execute(tombstone_statement(models.TimeSlot.id == slot_id))
+    await db.delete(db_slot)
+    version = await bump_availability_version(db, [slot_id])
+    # 確認後に予約が入っていれば version が一致せず削除されない
+    try:
+        await db.commit()
+    except StaleDataError:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Slot was modified by another request, please retry")
+    notify_availability_changed(version, removed)
     return None
\ No newline at end of file
@@ -0,0 +1,92 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from typing import List
+
+from .. import models, schemas
+from ..database import get_db
+from .auth import get_current_active_user
+
+router = APIRouter()
+
+
+@router.post("/waitlist/", response_model=schemas.WaitlistEntry)
+async def join_waitlist(
+    entry: schemas.WaitlistEntryCreate,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_active_user)
+):
+    """患者が満席の予約枠の待機リストに登録するエンドポイント"""
+    slot = await db.get(models.TimeSlot, entry.slot_id)
+    if not slot:
+        raise HTTPException(status_code=404, detail="Time slot not found")
+    
+    if not slot.is_active:
+        raise HTTPException(status_code=400, detail="This time slot is not available")
+    
+    # 空きがある場合はそのまま予約してもらう
+    if slot.available_spots > 0:
+        raise HTTPException(status_code=400, detail="This time slot has available spots, please book it directly")
+    
+    # 同じ日に既に予約を持っている場合は登録不可
+    existing_reservation = await db.scalar(
+        select(models.Reservation.id)
+        .where(
+            models.Reservation.patient_id == current_user.id,
+            models.Reservation.reservation_date == slot.date
+        )
+        .limit(1)
+    )
+    if existing_reservation:
+        raise HTTPException(status_code=400, detail="You already have a reservation for this day")
+    
+    db_entry = models.WaitlistEntry(patient_id=current_user.id, slot_id=slot.id)
+    db.add(db_entry)
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="You are already on the waitlist for this time slot")
+    
+    # レスポンス用に予約枠も読み込む
+    return await db.scalar(
+        select(models.WaitlistEntry)
+        .options(joinedload(models.WaitlistEntry.time_slot))
+        .where(models.WaitlistEntry.id == db_entry.id)
+    )
+
+
+@router.get("/waitlist/", response_model=List[schemas.WaitlistEntry])
+async def get_my_waitlist(
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_active_user)
+):
+    """患者が自分の待機リスト登録を取得するエンドポイント"""
+    return (await db.scalars(
+        select(models.WaitlistEntry)
+        .options(joinedload(models.WaitlistEntry.time_slot))
+        .where(models.WaitlistEntry.patient_id == current_user.id)
+        .order_by(models.WaitlistEntry.created_at)
+    )).all()
+
+
+@router.delete("/waitlist/{entry_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def leave_waitlist(
+    entry_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_active_user)
+):
+    """待機リストの登録を取り消すエンドポイント"""
+    entry = await db.get(models.WaitlistEntry, entry_id)
+    if not entry:
+        raise HTTPException(status_code=404, detail="Waitlist entry not found")
+    
+    # 自分の登録かどうかチェック（管理者は全ての登録を取り消し可能）
+    if entry.patient_id != current_user.id and not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Not authorized to remove this waitlist entry")
+    
+    await db.delete(entry)
+    await db.commit()
+    return None
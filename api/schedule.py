@@ -0,0 +1,212 @@
+from datetime import date, datetime, time, timedelta
+from typing import List, Optional
+
+from dateutil.rrule import rrulestr
+from sqlalchemy import exists, insert, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+from .availability import bump_availability_version, notify_availability_changed
+from .availability_index import inserted_rows_changes, minute_of_day
+
+# 一度に予約枠を作成する日数の上限（今日から数えた日数）
+MATERIALIZE_MAX_DAYS = 366
+# 一覧取得で終了日が指定されない場合に作成する日数
+MATERIALIZE_DEFAULT_DAYS = 31
+# 1回のリクエストで予約枠を作成する日数の上限（読み取りのリクエストで大量に書き込まないため）
+MATERIALIZE_REQUEST_MAX_DAYS = 93
+
+
+def slot_times(start_minute: int, end_minute: int, duration_minutes: int):
+    """1日の中の予約枠の (開始時刻, 終了時刻) を分単位の範囲から計算する（終了時刻が範囲を超える枠は作らない）"""
+    end_minute = min(end_minute, 24 * 60 - 1)
+    return [
+        (time(minute // 60, minute % 60), time((minute + duration_minutes) // 60, (minute + duration_minutes) % 60))
+        for minute in range(start_minute, end_minute - duration_minutes + 1, duration_minutes)
+    ]
+
+
+def parse_rrule(rule: str, start_date: date):
+    """RRULE文字列を解析する（不正な場合は ValueError）"""
+    return rrulestr(rule, dtstart=datetime.combine(start_date, time()))
+
+
+def rule_dates(rule: models.ScheduleRule, start: date, end: date):
+    """ルールが期間内で該当する日付の一覧"""
+    if rule.end_date:
+        end = min(end, rule.end_date)
+    if start > end:
+        return []
+    occurrences = parse_rrule(rule.rrule, rule.start_date).between(
+        datetime.combine(start, time()), datetime.combine(end, time()), inc=True
+    )
+    return [occurrence.date() for occurrence in occurrences]
+
+
+def tombstone_statement(*conditions):
+    """条件に該当する予約枠の日時を、削除・移動済みとして記録する文（ルールから作り直さないため）"""
+    tombstone = models.SlotTombstone
+    return insert(tombstone.__table__).from_select(
+        [tombstone.__table__.c.date, tombstone.__table__.c.start_time],
+        select(models.TimeSlot.date, models.TimeSlot.start_time)
+        .where(
+            *conditions,
+            ~exists().where(tombstone.date == models.TimeSlot.date, tombstone.start_time == models.TimeSlot.start_time)
+        )
+        .distinct()
+    )
+
+
+async def _blocked_times(db: AsyncSession, start: date, end: date):
+    """期間内で、ルールから予約枠を作成しない (日付, 開始時刻) の集合（作成済みの枠と削除・移動済みの日時）"""
+    existing = set((await db.execute(
+        select(models.TimeSlot.date, models.TimeSlot.start_time)
+        .where(models.TimeSlot.date >= start, models.TimeSlot.date <= end)
+    )).all())
+    tombstones = (await db.execute(
+        select(models.SlotTombstone.date, models.SlotTombstone.start_time)
+        .where(models.SlotTombstone.date >= start, models.SlotTombstone.date <= end)
+    )).all()
+    return existing | set(tombstones)
+
+
+async def _closed_days(db: AsyncSession, start: date, end: date):
+    return set((await db.scalars(
+        select(models.ScheduleClosure.day)
+        .where(models.ScheduleClosure.day >= start, models.ScheduleClosure.day <= end)
+    )).all())
+
+
+def _rule_rows(rules, start: date, end: date, days, closed, blocked):
+    """ルールから、対象の日 days のうち休診日・作成しない日時を除いた予約枠の行を作る"""
+    rows = []
+    now = datetime.now()
+    for rule in rules:
+        times = slot_times(minute_of_day(rule.start_time), minute_of_day(rule.end_time), rule.slot_duration_minutes)
+        for day in rule_dates(rule, start, end):
+            if day not in days or day in closed:
+                continue
+            for start_time, end_time in times:
+                if (day, start_time) in blocked:
+                    continue
+                blocked.add((day, start_time))
+                rows.append({
+                    "date": day,
+                    "start_time": start_time,
+                    "end_time": end_time,
+                    "capacity": rule.capacity,
+                    "available_spots": rule.capacity,
+                    "is_active": True,
+                    "created_at": now
+                })
+    return rows
+
+
+async def _insert_rule_rows(db: AsyncSession, rows):
+    """ルールから作った予約枠を一括で追加し、空き状況のバージョンを返す"""
+    await db.execute(insert(models.TimeSlot.__table__), rows)
+    days = sorted({row["date"] for row in rows})
+    return await bump_availability_version(db, select(models.TimeSlot.id).where(models.TimeSlot.date.in_(days)))
+
+
+async def _rules_between(db: AsyncSession, start: date, end: date):
+    return (await db.scalars(
+        select(models.ScheduleRule)
+        .where(
+            models.ScheduleRule.start_date <= end,
+            or_(models.ScheduleRule.end_date == None, models.ScheduleRule.end_date >= start)
+        )
+    )).all()
+
+
+async def _materialized_days(db: AsyncSession, start: date, end: date):
+    return set((await db.scalars(
+        select(models.MaterializedDay.day)
+        .where(models.MaterializedDay.day >= start, models.MaterializedDay.day <= end)
+    )).all())
+
+
+async def materialize_days(db: AsyncSession, days):
+    """指定した日のうち未作成の日について、スケジュールルールから予約枠を作成し、作成件数を返す"""
+    if not days:
+        return 0
+    start, end = min(days), max(days)
+
+    # 作成済みの日を除外（確認後に別のリクエストが作成した日も含む）
+    missing = set(days) - await _materialized_days(db, start, end)
+    if not missing:
+        return 0
+
+    rules = await _rules_between(db, start, end)
+    if not rules:
+        return 0
+
+    # 個別に作成済みの予約枠と、管理者が削除・移動した日時には作成しない
+    rows = _rule_rows(rules, start, end, missing, await _closed_days(db, start, end), await _blocked_times(db, start, end))
+
+    # 作成済みの記録と予約枠を同じトランザクションで追加する
+    try:
+        async with db.begin_nested():
+            await db.execute(insert(models.MaterializedDay.__table__), [{"day": day} for day in sorted(missing)])
+            if rows:
+                version = await _insert_rule_rows(db, rows)
+    except IntegrityError:
+        # 同時に別のリクエストが同じ日を作成した
+        await db.commit()
+        return 0
+
+    await db.commit()
+    if rows:
+        notify_availability_changed(version, inserted_rows_changes(rows))
+    return len(rows)
+
+
+async def matching_rule_days(
+    db: AsyncSession,
+    start: date,
+    end: date,
+    weekdays: Optional[List[int]] = None,
+    from_time: Optional[time] = None,
+    to_time: Optional[time] = None
+):
+    """期間内の未作成の日のうち、曜日・開始時刻の条件に合う予約枠がルールから作成されうる日を日付順に返す
+
+    DBに書き込まずにルールの繰り返しをメモリ上で展開して判定する（休診日は除く）。
+    """
+    today = date.today()
+    start = max(start, today)
+    end = min(end, today + timedelta(days=MATERIALIZE_MAX_DAYS))
+    if start > end:
+        return []
+
+    days = set()
+    for rule in await _rules_between(db, start, end):
+        times = slot_times(minute_of_day(rule.start_time), minute_of_day(rule.end_time), rule.slot_duration_minutes)
+        if not any((not from_time or slot_start >= from_time) and (not to_time or slot_start <= to_time) for slot_start, _ in times):
+            continue
+        days.update(day for day in rule_dates(rule, start, end) if not weekdays or day.weekday() in weekdays)
+    if days:
+        days -= await _materialized_days(db, start, end)
+    if not days:
+        return []
+    return sorted(days - await _closed_days(db, start, end))
+
+
+async def materialize_rule(db: AsyncSession, rule: models.ScheduleRule):
+    """追加したルールの予約枠を、作成済みの日にだけ作成する（コミットは呼び出し側、コミット後に返り値で通知する）
+
+    未作成の日は参照されたときに全ルールから作成されるため、ここでは扱わない。
+    他のルールの枠や管理者が削除・移動した日時は作り直さない。
+    """
+    today = date.today()
+    materialized = set((await db.scalars(
+        select(models.MaterializedDay.day).where(models.MaterializedDay.day >= max(today, rule.start_date))
+    )).all())
+    if not materialized:
+        return None
+    start, end = min(materialized), max(materialized)
+    rows = _rule_rows([rule], start, end, materialized, await _closed_days(db, start, end), await _blocked_times(db, start, end))
+    if not rows:
+        return None
+    return await _insert_rule_rows(db, rows), inserted_rows_changes(rows)
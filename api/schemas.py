@@ -14,6 +14,17 @@ class UserCreate(UserBase):
     is_admin: bool = False  # デフォルトはFalseだが、明示的に指定可能にする
 
 
+class PatientImportError(BaseModel):
+    line: int
+    email: Optional[str] = None
+    error: str
+
+
+class PatientImportResult(BaseModel):
+    imported: int
+    errors: List[PatientImportError]
+
+
 class User(UserBase):
     id: int
     is_admin: bool
@@ -39,6 +50,7 @@ class TimeSlot(TimeSlotBase):
     available_spots: int
     is_active: bool
     created_at: datetime
+    version: int
 
     class Config:
         orm_mode = True
@@ -72,9 +84,117 @@ class ReservationWithDetails(Reservation):
         orm_mode = True
 
 
+class WaitlistEntryCreate(BaseModel):
+    slot_id: int
+
+
+class WaitlistEntry(WaitlistEntryCreate):
+    id: int
+    patient_id: int
+    created_at: datetime
+    time_slot: TimeSlot
+
+    class Config:
+        orm_mode = True
+
+
+class ScheduleRuleCreate(BaseModel):
+    rrule: str
+    start_date: date
+    end_date: Optional[date] = None
+    start_time: time
+    end_time: time
+    slot_duration_minutes: int = 30
+    capacity: int = 2
+
+
+class ScheduleRule(ScheduleRuleCreate):
+    id: int
+    created_at: datetime
+
+    class Config:
+        orm_mode = True
+
+
+class ScheduleClosureCreate(BaseModel):
+    note: Optional[str] = None
+
+
+class ScheduleClosure(ScheduleClosureCreate):
+    day: date
+
+    class Config:
+        orm_mode = True
+
+
+class TimeSlotPage(BaseModel):
+    items: List[TimeSlot]
+    next_cursor: Optional[str] = None
+
+
+class DaySummary(BaseModel):
+    date: date
+    slots: int
+    capacity: int
+    remaining: int
+    first_available_time: Optional[time] = None
+
+
+class SlotChanges(BaseModel):
+    version: int  # 次回の since に指定するバージョン
+    slots: List[TimeSlot] = []  # 変更・追加された予約枠（無効化された枠を含む）
+    deleted_ids: List[int] = []  # 削除（アーカイブ）された予約枠のID
+    reset: bool = False  # True の場合は差分を取得できないため、一覧を取得し直す
+
+
+class SlotRange(BaseModel):
+    start_date: date
+    end_date: date
+    from_time: Optional[time] = None  # 開始時刻がこの時刻以降の枠
+    to_time: Optional[time] = None  # 開始時刻がこの時刻以前の枠
+
+
+class SlotRangeShift(SlotRange):
+    days: int = 0
+    minutes: int = 0
+
+
+class SlotRangeResult(BaseModel):
+    affected: int
+    reserved_slots: List[TimeSlot] = []  # 対象のうち予約が入っている枠（削除の場合は削除されなかった枠）
+
+
+class ReservationPage(BaseModel):
+    items: List[ReservationWithDetails]
+    next_cursor: Optional[str] = None
+
+
+class BatchConfirmRequest(BaseModel):
+    qr_codes: List[str]
+
+
+class BatchConfirmResult(BaseModel):
+    qr_code: str
+    status: str  # "confirmed" / "already_confirmed" / "not_found"
+
+
+class CacheStats(BaseModel):
+    hits: int
+    misses: int
+    size: int
+    maxsize: int
+    ttl_seconds: float
+
+
 class Token(BaseModel):
     access_token: str
     token_type: str
+    expires_in: Optional[int] = None
+    refresh_token: Optional[str] = None
+
+
+class TokenRefresh(BaseModel):
+    refresh_token: str
 
 
 class TokenData(BaseModel):
@@ -0,0 +1,182 @@
+"""同期エンジンの旧リビジョンと現在のツリーのAPIサーバーをそれぞれ起動し、多数のクライアントから同時にリクエストを送ってスループットと遅延を比較する
+
+サーバーはどちらも別の一時ディレクトリ（空のDB）で uvicorn として起動する。
+旧リビジョンは git worktree として一時的に取り出す。
+
+使い方:
+    python benchmarks/async_throughput.py --clients 200 --requests 20
+    python benchmarks/async_throughput.py --baseline <リビジョン>
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import date, timedelta
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 非同期エンジンへ移行する直前（同期の get_db を使っていた最後）のリビジョン
+SYNC_BASELINE = "f7adf23^"
+
+
+def start_server(app_dir: str, port: int) -> subprocess.Popen:
+    """app_dir のAPIを空のDBで起動し、応答するまで待つ"""
+    env = dict(os.environ)
+    env.pop("DATABASE_URL", None)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api.main:app", "--app-dir", app_dir,
+         "--port", str(port), "--log-level", "warning"],
+        cwd=tempfile.mkdtemp(),
+        env=env,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server in {app_dir} exited with {process.returncode}")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/", timeout=1)
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.5)
+    stop_server(process)
+    raise RuntimeError(f"server in {app_dir} did not start")
+
+
+def stop_server(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+async def setup(client: httpx.AsyncClient):
+    """ベンチマーク用の管理者・患者・予約枠を作成し、患者のトークンを返す"""
+    suffix = uuid.uuid4().hex[:8]
+    accounts = {"admin": True, "patient": False}
+    tokens = {}
+    for name, is_admin in accounts.items():
+        email = f"{name}-{suffix}@example.com"
+        response = await client.post("/register", json={
+            "email": email,
+            "password": "password",
+            "full_name": name,
+            "phone_number": "0000000000",
+            "is_admin": is_admin,
+        })
+        response.raise_for_status()
+        response = await client.post("/token", data={"username": email, "password": "password"})
+        response.raise_for_status()
+        tokens[name] = response.json()["access_token"]
+
+    # 一覧取得の対象となる予約枠を数日分作成
+    admin_headers = {"Authorization": f"Bearer {tokens['admin']}"}
+    for i in range(5):
+        day = date.today() + timedelta(days=365 + i)
+        response = await client.post("/slots/", headers=admin_headers, json={
+            "date": day.isoformat(),
+            "start_time": "17:00:00",
+            "end_time": "17:30:00",
+            "capacity": 3,
+        })
+        response.raise_for_status()
+    return tokens["patient"]
+
+
+async def run_client(client: httpx.AsyncClient, headers: dict, requests: int, latencies: list, errors: list):
+    """1クライアント分のリクエストを順に送信する"""
+    paths = ("/slots/", "/reservations/", "/users/me")
+    for i in range(requests):
+        started = time.perf_counter()
+        try:
+            response = await client.get(paths[i % len(paths)], headers=headers)
+            if response.status_code != 200:
+                errors.append(response.status_code)
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+        latencies.append(time.perf_counter() - started)
+
+
+async def measure(url: str, clients: int, requests: int, timeout: float, deadline: float) -> dict:
+    """1台のサーバーに clients 個のクライアントから同時にリクエストを送る
+
+    deadline 秒を過ぎても終わらない場合（スレッドプールが詰まったときなど）は打ち切り、
+    送れなかった分も含めて未完了のリクエストをエラーとして数える。
+    """
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=timeout) as client:
+        token = await setup(client)
+        headers = {"Authorization": f"Bearer {token}"}
+
+        latencies, errors = [], []
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.gather(*[
+                run_client(client, headers, requests, latencies, errors)
+                for _ in range(clients)
+            ]), deadline)
+        except asyncio.TimeoutError:
+            errors.extend(["deadline"] * (clients * requests - len(latencies)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    total = len(latencies)
+    if not total:
+        return {"requests": 0, "elapsed": elapsed, "throughput": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "errors": len(errors)}
+    return {
+        "requests": total,
+        "elapsed": elapsed,
+        "throughput": total / elapsed,
+        "p50": statistics.median(latencies) * 1000,
+        "p95": latencies[int(total * 0.95) - 1] * 1000,
+        "p99": latencies[int(total * 0.99) - 1] * 1000,
+        "errors": len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--baseline", default=SYNC_BASELINE, help="比較対象とする同期版のgitリビジョン")
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--timeout", type=float, default=30, help="1リクエストのタイムアウト（秒）")
+    parser.add_argument("--deadline", type=float, default=120, help="1構成あたりの計測の打ち切り時間（秒）")
+    parser.add_argument("--port", type=int, default=8100)
+    args = parser.parse_args()
+
+    worktree = tempfile.mkdtemp()
+    subprocess.run(["git", "-C", ROOT, "worktree", "add", "--detach", worktree, args.baseline],
+                   check=True, capture_output=True)
+    results = {}
+    try:
+        configs = {"sync (baseline)": worktree, "async (current)": ROOT}
+        for offset, (name, app_dir) in enumerate(configs.items()):
+            port = args.port + offset
+            process = start_server(app_dir, port)
+            try:
+                results[name] = asyncio.run(measure(f"http://127.0.0.1:{port}", args.clients, args.requests, args.timeout, args.deadline))
+            finally:
+                stop_server(process)
+    finally:
+        subprocess.run(["git", "-C", ROOT, "worktree", "remove", "--force", worktree], capture_output=True)
+        shutil.rmtree(worktree, ignore_errors=True)
+
+    print(f"baseline: {args.baseline}  clients: {args.clients}  requests/client: {args.requests}")
+    print(f"{'server':<16} {'done':>8} {'elapsed':>9} {'req/s':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'errors':>7}")
+    for name, result in results.items():
+        print(
+            f"{name:<16} {result['requests']:>8} {result['elapsed']:>8.2f}s {result['throughput']:>8.1f}"
+            f" {result['p50']:>7.1f}ms {result['p95']:>7.1f}ms {result['p99']:>7.1f}ms {result['errors']:>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""1年分の予約枠について、日別サマリーをSQLのGROUP BYと空き状況インデックスで求め、所要時間と結果を比較する
+
+使い方:
+    python benchmarks/availability_index.py --duration 15 --repeat 50
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from datetime import time as dtime
+
+# 一時ディレクトリ上のDBを使うため、api をインポートする前に移動する
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(tempfile.mkdtemp())
+
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import case, func, select, update  # noqa: E402
+
+from api import models  # noqa: E402
+from api.availability import availability_index, bump_version_statement, summary_cache  # noqa: E402
+from api.availability_index import minute_of_day  # noqa: E402
+from api.database import SessionLocal  # noqa: E402
+from api.main import app  # noqa: E402
+from api.passwords import hash_password_sync  # noqa: E402
+from api.routers.auth import create_access_token  # noqa: E402
+
+
+def sql_summary(db, start: date, end: date, from_time: dtime, to_time: dtime):
+    """インデックス導入前と同じ、日ごとのGROUP BYによる集計"""
+    rows = db.execute(
+        select(
+            models.TimeSlot.date,
+            func.count(models.TimeSlot.id),
+            func.sum(models.TimeSlot.capacity),
+            func.sum(models.TimeSlot.available_spots),
+            func.min(case((models.TimeSlot.available_spots > 0, models.TimeSlot.start_time)), type_=models.MinuteOfDay)
+        )
+        .where(
+            models.TimeSlot.is_active == True,
+            models.TimeSlot.date >= start,
+            models.TimeSlot.date <= end,
+            models.TimeSlot.start_time >= from_time,
+            models.TimeSlot.start_time <= to_time
+        )
+        .group_by(models.TimeSlot.date)
+        .order_by(models.TimeSlot.date)
+    ).all()
+    return [
+        {
+            "date": row_date.isoformat(),
+            "slots": slot_count,
+            "capacity": capacity or 0,
+            "remaining": remaining or 0,
+            "first_available_time": first_available_time.isoformat() if first_available_time else None
+        }
+        for row_date, slot_count, capacity, remaining, first_available_time in rows
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=int, default=15)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    admin = models.User(email="admin@example.com", hashed_password=hash_password_sync("password"), full_name="管理者", phone_number="0", is_admin=True)
+    db.add(admin)
+    db.commit()
+    headers = {"Authorization": "Bearer " + create_access_token({"sub": admin.email})}
+
+    client = TestClient(app)
+    start = date.today() + timedelta(days=1)
+    end = start + timedelta(days=364)
+    response = client.post(
+        "/slots/bulk",
+        params={"start_date": start.isoformat(), "end_date": end.isoformat()},
+        json={"days_of_week": [0, 1, 2, 3, 4, 5], "start_hour": 9, "end_hour": 19, "slot_duration_minutes": args.duration},
+        headers=headers
+    )
+    assert response.status_code == 200, response.text
+    created = len(response.json())
+
+    # 一部の予約枠を埋めておく（残り枠にばらつきを持たせる）
+    random.seed(0)
+    slot_ids = [slot["id"] for slot in response.json()]
+    db.execute(
+        update(models.TimeSlot)
+        .where(models.TimeSlot.id.in_(random.sample(slot_ids, len(slot_ids) // 2)))
+        .values(available_spots=0)
+    )
+    db.execute(bump_version_statement())
+    db.commit()
+
+    # 「今週〜1年の各範囲で17時〜18時に空きがあるか」という問い合わせを繰り返す
+    windows = [(dtime(17, 0), dtime(18, 0)), (dtime(9, 0), dtime(12, 0)), (dtime(0, 0), dtime(23, 59))]
+    queries = [
+        (start + timedelta(days=random.randrange(0, 300)), random.choice((7, 31, 365)), window)
+        for window in windows for _ in range(args.repeat)
+    ]
+
+    started = time.perf_counter()
+    expected = [
+        sql_summary(db, query_start, min(query_start + timedelta(days=days - 1), end), from_time, to_time)
+        for query_start, days, (from_time, to_time) in queries
+    ]
+    sql_elapsed = time.perf_counter() - started
+    db.close()
+
+    # 1回目の参照でインデックスを読み込む
+    started = time.perf_counter()
+    client.get("/slots/summary", params={"start_date": start.isoformat(), "end_date": start.isoformat()}, headers=headers)
+    load_elapsed = time.perf_counter() - started
+
+    actual = []
+    started = time.perf_counter()
+    for query_start, days, (from_time, to_time) in queries:
+        summary_cache.clear()
+        response = client.get("/slots/summary", params={
+            "start_date": query_start.isoformat(),
+            "end_date": min(query_start + timedelta(days=days - 1), end).isoformat(),
+            "from_time": from_time.isoformat(),
+            "to_time": to_time.isoformat(),
+        }, headers=headers)
+        assert response.status_code == 200, response.text
+        actual.append(response.json())
+    api_elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for query_start, days, (from_time, to_time) in queries:
+        availability_index.summarize(
+            query_start, min(query_start + timedelta(days=days - 1), end), minute_of_day(from_time), minute_of_day(to_time)
+        )
+    index_elapsed = time.perf_counter() - started
+
+    print(f"slots:             {created}")
+    print(f"queries:           {len(queries)}")
+    print(f"sql group by:      {sql_elapsed * 1000 / len(queries):.2f}ms/query (DB only)")
+    print(f"index load:        {load_elapsed * 1000:.1f}ms (first request)")
+    print(f"index summarize:   {index_elapsed * 1000 / len(queries):.2f}ms/query (in memory)")
+    print(f"index via API:     {api_elapsed * 1000 / len(queries):.2f}ms/request (including HTTP)")
+
+    assert actual == expected, "index summary differs from SQL"
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
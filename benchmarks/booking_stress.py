@@ -0,0 +1,107 @@
+"""同一スロットへの同時予約を大量に発行し、定員超過が起きないことを確認する負荷テスト
+
+使い方:
+    python benchmarks/booking_stress.py --patients 300 --capacity 20 --workers 64
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, time as dtime
+
+# 一時ディレクトリ上のDBを使うため、api をインポートする前に移動する
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(tempfile.mkdtemp())
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from api import models  # noqa: E402
+from api.database import SessionLocal  # noqa: E402
+from api.main import app  # noqa: E402
+from api.passwords import hash_password_sync  # noqa: E402
+from api.routers.auth import create_access_token  # noqa: E402
+
+
+def setup(patients: int, capacity: int):
+    """患者とスロットを直接DBに作成し、各患者のトークンを返す"""
+    db = SessionLocal()
+    try:
+        hashed_password = hash_password_sync("password")
+        users = [
+            models.User(
+                email=f"patient{i}@example.com",
+                hashed_password=hashed_password,
+                full_name=f"患者{i}",
+                phone_number="0000000000",
+            )
+            for i in range(patients)
+        ]
+        db.add_all(users)
+        slot = models.TimeSlot(date=date.today(), start_time=dtime(17, 0), end_time=dtime(17, 30), capacity=capacity)
+        db.add(slot)
+        db.commit()
+        tokens = [
+            create_access_token({"sub": user.email, "user_id": user.id, "is_admin": False})
+            for user in users
+        ]
+        return slot.id, tokens
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--patients", type=int, default=300)
+    parser.add_argument("--capacity", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=64)
+    args = parser.parse_args()
+
+    slot_id, tokens = setup(args.patients, args.capacity)
+
+    # 非同期エンジンの接続プールはイベントループ単位のため、全スレッドで1つのループを共有する
+    with TestClient(app) as client:
+        def book(token):
+            response = client.post(
+                "/reservations/",
+                json={"slot_id": slot_id},
+                headers={"Authorization": f"Bearer {token}"},
+            )
+            return response.status_code
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            statuses = list(executor.map(book, tokens))
+        elapsed = time.perf_counter() - started
+
+    db = SessionLocal()
+    try:
+        slot = db.query(models.TimeSlot).filter(models.TimeSlot.id == slot_id).one()
+        reservations = db.query(models.Reservation).filter(models.Reservation.slot_id == slot_id).all()
+    finally:
+        db.close()
+
+    booked = statuses.count(200)
+    rejected = statuses.count(400)
+    errors = len(statuses) - booked - rejected
+    daily_numbers = [r.daily_number for r in reservations]
+
+    print(f"requests:      {len(statuses)}")
+    print(f"elapsed:       {elapsed:.2f}s ({len(statuses) / elapsed:.1f} req/s)")
+    print(f"booked:        {booked} / capacity {args.capacity}")
+    print(f"rejected(400): {rejected}")
+    print(f"errors:        {errors}")
+    print(f"available:     {slot.available_spots}")
+
+    assert booked == args.capacity, "all spots should be booked"
+    assert len(reservations) == args.capacity, "slot went over capacity"
+    assert slot.available_spots == 0, "available_spots drifted"
+    assert len(set(daily_numbers)) == len(daily_numbers), "duplicate daily numbers"
+    assert errors == 0, "unexpected errors under contention"
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""1年分の予約枠を一括作成し、所要時間と作成件数を確認する
+
+使い方:
+    python benchmarks/bulk_slots.py --duration 15
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+# 一時ディレクトリ上のDBを使うため、api をインポートする前に移動する
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(tempfile.mkdtemp())
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from api import models  # noqa: E402
+from api.database import SessionLocal  # noqa: E402
+from api.main import app  # noqa: E402
+from api.passwords import hash_password_sync  # noqa: E402
+from api.routers.auth import create_access_token  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=int, default=15)
+    parser.add_argument("--start-hour", type=int, default=9)
+    parser.add_argument("--end-hour", type=int, default=18)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    admin = models.User(email="admin@example.com", hashed_password=hash_password_sync("password"), full_name="管理者", phone_number="0", is_admin=True)
+    db.add(admin)
+    db.commit()
+    headers = {"Authorization": "Bearer " + create_access_token({"sub": admin.email})}
+    db.close()
+
+    client = TestClient(app)
+    params = {"start_date": "2031-01-01T00:00:00", "end_date": "2031-12-31T00:00:00"}
+    body = {
+        "days_of_week": [0, 1, 2, 3, 4],
+        "start_hour": args.start_hour,
+        "end_hour": args.end_hour,
+        "slot_duration_minutes": args.duration,
+    }
+
+    started = time.perf_counter()
+    response = client.post("/slots/bulk", params=params, json=body, headers=headers)
+    elapsed = time.perf_counter() - started
+    assert response.status_code == 200, response.text
+    created = len(response.json())
+
+    # 同じ範囲を再実行しても重複して作成されないこと
+    started = time.perf_counter()
+    response = client.post("/slots/bulk", params=params, json=body, headers=headers)
+    rerun_elapsed = time.perf_counter() - started
+    assert response.status_code == 200, response.text
+
+    slots_per_day = (args.end_hour - args.start_hour) * 60 // args.duration
+    print(f"created:       {created} slots ({slots_per_day} per weekday)")
+    print(f"elapsed:       {elapsed:.2f}s")
+    print(f"rerun created: {len(response.json())} ({rerun_elapsed:.2f}s)")
+
+    assert created == 261 * slots_per_day, "unexpected number of slots"
+    assert response.json() == [], "duplicate slots were created"
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
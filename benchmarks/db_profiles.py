@@ -0,0 +1,142 @@
+"""SQLiteの既定設定（DB_PROFILE=default）と調整済みの設定（DB_PROFILE=tuned）で、予約のスループットと同時に行う一覧取得の遅延を比較する
+
+プロファイルごとに別プロセス・別の一時DBで実行する。
+
+使い方:
+    python benchmarks/db_profiles.py --patients 400 --concurrency 32 --readers 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, time as dtime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROFILES = ("default", "tuned")
+
+
+def percentile(values, ratio):
+    values = sorted(values)
+    return values[max(int(len(values) * ratio) - 1, 0)] if values else 0.0
+
+
+def run_child(args):
+    """1つのプロファイルで計測し、結果をJSONで出力する"""
+    # 一時ディレクトリ上のDBを使うため、api をインポートする前に移動する
+    sys.path.insert(0, ROOT)
+    os.chdir(tempfile.mkdtemp())
+
+    import httpx
+
+    from api import models
+    from api.database import SessionLocal, async_engine
+    from api.main import app
+    from api.passwords import hash_password_sync
+    from api.routers.auth import create_access_token
+
+    # 1日1件までのため、患者ごとに別の日の予約枠を予約する
+    db = SessionLocal()
+    hashed_password = hash_password_sync("password")
+    users = [
+        models.User(email=f"patient{i}@example.com", hashed_password=hashed_password, full_name=f"患者{i}", phone_number="0")
+        for i in range(args.patients)
+    ]
+    slots = [
+        models.TimeSlot(date=date.today() + timedelta(days=1 + i), start_time=dtime(17, 0), end_time=dtime(17, 30), capacity=1)
+        for i in range(args.patients)
+    ]
+    db.add_all(users + slots)
+    db.commit()
+    bookings = [
+        ({"Authorization": "Bearer " + create_access_token({"sub": user.email, "user_id": user.id})}, slot.id)
+        for user, slot in zip(users, slots)
+    ]
+    db.close()
+
+    async def main():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=120) as client:
+            queue = asyncio.Queue()
+            for booking in bookings:
+                queue.put_nowait(booking)
+            book_latencies, read_latencies, errors = [], [], []
+            done = asyncio.Event()
+
+            async def book():
+                while not queue.empty():
+                    headers, slot_id = queue.get_nowait()
+                    started = time.perf_counter()
+                    response = await client.post("/reservations/", json={"slot_id": slot_id}, headers=headers)
+                    book_latencies.append(time.perf_counter() - started)
+                    if response.status_code != 200:
+                        errors.append(response.status_code)
+
+            async def read(headers):
+                while not done.is_set():
+                    started = time.perf_counter()
+                    response = await client.get("/reservations/", headers=headers)
+                    read_latencies.append(time.perf_counter() - started)
+                    if response.status_code != 200:
+                        errors.append(response.status_code)
+
+            readers = [asyncio.create_task(read(bookings[i][0])) for i in range(args.readers)]
+            started = time.perf_counter()
+            await asyncio.gather(*(book() for _ in range(args.concurrency)))
+            elapsed = time.perf_counter() - started
+            done.set()
+            await asyncio.gather(*readers)
+        await async_engine.dispose()
+        return book_latencies, read_latencies, errors, elapsed
+
+    book_latencies, read_latencies, errors, elapsed = asyncio.run(main())
+    print(json.dumps({
+        "bookings_per_second": len(book_latencies) / elapsed,
+        "book_p50_ms": statistics.median(book_latencies) * 1000,
+        "book_p95_ms": percentile(book_latencies, 0.95) * 1000,
+        "reads": len(read_latencies),
+        "read_p95_ms": percentile(read_latencies, 0.95) * 1000,
+        "errors": len(errors),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--patients", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--profile", choices=PROFILES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.profile:
+        run_child(args)
+        return
+
+    results = {}
+    for profile in PROFILES:
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--profile", profile,
+             "--patients", str(args.patients), "--concurrency", str(args.concurrency), "--readers", str(args.readers)],
+            env={**os.environ, "DB_PROFILE": profile},
+            capture_output=True,
+            text=True,
+        )
+        if completed.returncode != 0:
+            sys.stderr.write(completed.stderr)
+            raise SystemExit(f"{profile} profile failed")
+        results[profile] = json.loads(completed.stdout.strip().splitlines()[-1])
+
+    print(f"{'':20}{'default':>12}{'tuned':>12}")
+    for key in ("bookings_per_second", "book_p50_ms", "book_p95_ms", "reads", "read_p95_ms", "errors"):
+        print(f"{key:20}" + "".join(f"{results[profile][key]:>12.1f}" for profile in PROFILES))
+
+    assert results["tuned"]["errors"] == 0, "errors with the tuned profile"
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
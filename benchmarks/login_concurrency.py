@@ -0,0 +1,122 @@
+"""多数のログインを同時に送り、bcryptの計算中もイベントループが応答できることと、混雑時に503で即座に断ることを確認する
+
+既定のDBプロファイル（接続プールあり）で、bcryptの待ち行列が接続プールより長くても接続が枯渇しないことも確認する。
+あわせて、パスワードでのログインとリフレッシュトークンによる更新の所要時間を比較する。
+
+使い方:
+    BCRYPT_ROUNDS=12 PASSWORD_HASH_WORKERS=4 PASSWORD_HASH_MAX_QUEUE=32 \\
+        python benchmarks/login_concurrency.py --clients 100
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+# 一時ディレクトリ上のDBを使うため、api をインポートする前に移動する
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(tempfile.mkdtemp())
+
+import httpx  # noqa: E402
+from passlib.context import CryptContext  # noqa: E402
+
+from api import models  # noqa: E402
+from api.database import SessionLocal  # noqa: E402
+from api.main import app  # noqa: E402
+from api.passwords import BCRYPT_ROUNDS, PASSWORD_HASH_MAX_QUEUE, PASSWORD_HASH_WORKERS, hash_password_sync  # noqa: E402
+
+
+def create_users():
+    """現在のコストのユーザーと、古いコストでハッシュされたユーザーを作成する"""
+    old_rounds = 4 if BCRYPT_ROUNDS != 4 else 5
+    old_context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=old_rounds)
+    db = SessionLocal()
+    db.add(models.User(email="patient@example.com", hashed_password=hash_password_sync("password"), full_name="患者", phone_number="0"))
+    db.add(models.User(email="legacy@example.com", hashed_password=old_context.hash("password"), full_name="旧患者", phone_number="0"))
+    db.commit()
+    db.close()
+    return old_rounds
+
+
+def stored_rounds(email: str):
+    db = SessionLocal()
+    hashed_password = db.query(models.User.hashed_password).filter(models.User.email == email).scalar()
+    db.close()
+    return int(hashed_password.split("$")[2])
+
+
+async def login(client: httpx.AsyncClient, email: str, statuses: list, latencies: list):
+    started = time.perf_counter()
+    response = await client.post("/token", data={"username": email, "password": "password"})
+    latencies.append(time.perf_counter() - started)
+    statuses.append(response.status_code)
+
+
+async def ping(client: httpx.AsyncClient, done: asyncio.Event, latencies: list):
+    """ログイン処理中も他のリクエストが待たされないかを計測する"""
+    while not done.is_set():
+        started = time.perf_counter()
+        await client.get("/")
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(0.01)
+
+
+async def run(clients: int):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        statuses, latencies, pings = [], [], []
+        done = asyncio.Event()
+        pinger = asyncio.create_task(ping(client, done, pings))
+        started = time.perf_counter()
+        await asyncio.gather(*(login(client, "patient@example.com", statuses, latencies) for _ in range(clients)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await pinger
+
+        rehash_status = []
+        await login(client, "legacy@example.com", rehash_status, [])
+
+        # 同じセッションでのトークン更新（ログインとリフレッシュを交互に計測）
+        login_latencies, refresh_latencies = [], []
+        for _ in range(10):
+            started = time.perf_counter()
+            response = await client.post("/token", data={"username": "patient@example.com", "password": "password"})
+            login_latencies.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            refreshed = await client.post("/token/refresh", json={"refresh_token": response.json()["refresh_token"]})
+            refresh_latencies.append(time.perf_counter() - started)
+            assert refreshed.status_code == 200, refreshed.text
+    return statuses, latencies, pings, elapsed, rehash_status[0], login_latencies, refresh_latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=100)
+    args = parser.parse_args()
+
+    old_rounds = create_users()
+    statuses, latencies, pings, elapsed, rehash_status, login_latencies, refresh_latencies = asyncio.run(run(args.clients))
+    ok = [latency for latency, code in zip(latencies, statuses) if code == 200]
+    rejected = [latency for latency, code in zip(latencies, statuses) if code == 503]
+
+    print(f"bcrypt rounds:     {BCRYPT_ROUNDS} (workers {PASSWORD_HASH_WORKERS}, queue {PASSWORD_HASH_MAX_QUEUE})")
+    print(f"logins:            {len(statuses)} in {elapsed:.2f}s ({len(ok) / elapsed:.1f} ok/s)")
+    print(f"ok:                {len(ok)}" + (f" (median {statistics.median(ok) * 1000:.0f}ms)" if ok else ""))
+    print(f"rejected (503):    {len(rejected)}" + (f" (max {max(rejected) * 1000:.1f}ms)" if rejected else ""))
+    if pings:
+        print(f"ping during load:  median {statistics.median(pings) * 1000:.1f}ms, max {max(pings) * 1000:.1f}ms")
+    print(f"rehash on login:   rounds {old_rounds} -> {stored_rounds('legacy@example.com')}")
+    print(f"renew by login:    median {statistics.median(login_latencies) * 1000:.1f}ms")
+    print(f"renew by refresh:  median {statistics.median(refresh_latencies) * 1000:.1f}ms")
+
+    assert set(statuses) <= {200, 503}, statuses
+    assert len(ok) >= min(args.clients, PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_QUEUE)
+    assert rehash_status == 200 and stored_rounds("legacy@example.com") == BCRYPT_ROUNDS
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
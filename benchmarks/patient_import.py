@@ -0,0 +1,96 @@
+"""患者の登録を /register で1件ずつ行う場合と、一括登録（/users/import）を使う場合の所要時間を比較する
+
+一括登録はAPIの上限（IMPORT_API_MAX_ROWS）ごとにファイルを分けて送り、1リクエストの最大所要時間も表示する。
+
+使い方:
+    BCRYPT_ROUNDS=12 python benchmarks/patient_import.py --patients 1000 --register 100
+"""
+import argparse
+import csv
+import io
+import os
+import sys
+import tempfile
+import time
+
+# 一時ディレクトリ上のDBを使うため、api をインポートする前に移動する
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(tempfile.mkdtemp())
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from api import models  # noqa: E402
+from api.database import SessionLocal  # noqa: E402
+from api.main import app  # noqa: E402
+from api.passwords import BCRYPT_ROUNDS, hash_password_sync  # noqa: E402
+from api.patient_import import IMPORT_API_MAX_ROWS, IMPORT_HASH_PROCESSES  # noqa: E402
+from api.routers.auth import create_access_token  # noqa: E402
+
+
+def patient(prefix: str, i: int):
+    return {"email": f"{prefix}{i}@example.com", "password": f"password{i}", "full_name": f"患者{i}", "phone_number": "0000000000"}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--register", type=int, default=100, help="/register で1件ずつ登録する件数")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    admin = models.User(email="admin@example.com", hashed_password=hash_password_sync("password"), full_name="管理者", phone_number="0", is_admin=True)
+    db.add(admin)
+    db.commit()
+    headers = {"Authorization": "Bearer " + create_access_token({"sub": admin.email, "user_id": admin.id, "is_admin": True})}
+    db.close()
+
+    with TestClient(app) as client:
+        started = time.perf_counter()
+        for i in range(args.register):
+            response = client.post("/register", json=patient("single", i))
+            assert response.status_code == 200, response.text
+        register_elapsed = time.perf_counter() - started
+
+        # 既存ユーザーと重複する行・不正な行も混ぜておく
+        rows = [patient("bulk", i) for i in range(args.patients)]
+        rows.append(patient("single", 0))
+        rows.append({"email": "not-an-email", "password": "x", "full_name": "x", "phone_number": "0"})
+
+        result = {"imported": 0, "errors": []}
+        request_elapsed = []
+        started = time.perf_counter()
+        for start in range(0, len(rows), IMPORT_API_MAX_ROWS):
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=["email", "password", "full_name", "phone_number"])
+            writer.writeheader()
+            writer.writerows(rows[start:start + IMPORT_API_MAX_ROWS])
+            request_started = time.perf_counter()
+            response = client.post(
+                "/users/import",
+                files={"file": ("patients.csv", buffer.getvalue().encode(), "text/csv")},
+                headers=headers
+            )
+            request_elapsed.append(time.perf_counter() - request_started)
+            assert response.status_code == 200, response.text
+            result["imported"] += response.json()["imported"]
+            result["errors"] += response.json()["errors"]
+        import_elapsed = time.perf_counter() - started
+
+        login = client.post("/token", data={"username": "bulk0@example.com", "password": "password0"})
+
+    print(f"bcrypt rounds:     {BCRYPT_ROUNDS} (hash processes {IMPORT_HASH_PROCESSES})")
+    print(f"/register:         {args.register} patients in {register_elapsed:.2f}s ({register_elapsed * 1000 / max(args.register, 1):.1f}ms/patient)")
+    print(f"/users/import:     {result['imported']} patients in {import_elapsed:.2f}s ({import_elapsed * 1000 / args.patients:.1f}ms/patient)")
+    print(f"requests:          {len(request_elapsed)} of up to {IMPORT_API_MAX_ROWS} rows (max {max(request_elapsed):.2f}s)")
+    print(f"row errors:        {len(result['errors'])}")
+
+    assert result["imported"] == args.patients
+    assert [error["error"] for error in result["errors"]][0] == "Email already registered"
+    assert len(result["errors"]) == 2
+    assert login.status_code == 200, login.text
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""予約一覧APIの1リクエストあたりのSQL発行数を計測し、件数に比例して増えないことを確認する
+
+あわせて、ユーザーキャッシュにより認証で省けるSQLの数を各ルーターのエンドポイントで計測する。
+
+使い方:
+    python benchmarks/query_counts.py
+"""
+import os
+import sys
+import tempfile
+from datetime import date, time as dtime, timedelta
+
+# 一時ディレクトリ上のDBを使うため、api をインポートする前に移動する
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(tempfile.mkdtemp())
+
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+from api import models  # noqa: E402
+from api.database import SessionLocal, async_engine  # noqa: E402
+from api.main import app  # noqa: E402
+from api.passwords import hash_password_sync  # noqa: E402
+from api.routers.auth import create_access_token, user_cache  # noqa: E402
+
+statements = []
+
+
+# APIは非同期エンジン経由でSQLを発行するため、その同期側エンジンで計測する
+@event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+    statements.append(statement)
+
+
+def add_reservations(db, patient, admin, count, offset):
+    """患者ごとに別の日の予約を作成する"""
+    for i in range(offset, offset + count):
+        day = date.today() + timedelta(days=i + 1)
+        slot = models.TimeSlot(date=day, start_time=dtime(17, 0), end_time=dtime(17, 30))
+        db.add(slot)
+        db.flush()
+        for user in (patient, admin):
+            db.add(models.Reservation(
+                patient_id=user.id,
+                slot_id=slot.id,
+                reservation_date=day,
+                daily_number=1 if user is patient else 2,
+                qr_code_data=f"{user.id}-{i}",
+            ))
+    db.commit()
+
+
+def count_queries(client, path, headers, params=None):
+    user_cache.clear()
+    statements.clear()
+    response = client.get(path, headers=headers, params=params)
+    assert response.status_code == 200, response.text
+    body = response.json()
+    rows = body["items"] if isinstance(body, dict) else body
+    return len(statements), len(rows)
+
+
+def count_auth_savings(client, path, headers, params=None):
+    """ユーザーキャッシュなし（初回）とあり（2回目）のSQL発行数"""
+    # 空き状況インデックスなど、認証以外のキャッシュは先に読み込んでおく
+    client.get(path, headers=headers, params=params)
+    user_cache.clear()
+    counts = []
+    for _ in range(2):
+        statements.clear()
+        response = client.get(path, headers=headers, params=params)
+        assert response.status_code == 200, response.text
+        counts.append(len(statements))
+    return counts
+
+
+def main():
+    db = SessionLocal()
+    hashed_password = hash_password_sync("password")
+    patient = models.User(email="patient@example.com", hashed_password=hashed_password, full_name="患者", phone_number="0")
+    admin = models.User(email="admin@example.com", hashed_password=hashed_password, full_name="管理者", phone_number="0", is_admin=True)
+    db.add_all([patient, admin])
+    db.commit()
+    patient_headers = {"Authorization": "Bearer " + create_access_token({"sub": patient.email, "user_id": patient.id})}
+    admin_headers = {"Authorization": "Bearer " + create_access_token({"sub": admin.email, "user_id": admin.id, "is_admin": True})}
+
+    client = TestClient(app)
+    endpoints = [
+        ("/reservations/", patient_headers, None),
+        ("/reservations/admin", admin_headers, None),
+    ]
+
+    results = {}
+    for size, offset in ((2, 0), (48, 2)):
+        add_reservations(db, patient, admin, size, offset)
+        for path, headers, params in endpoints:
+            results.setdefault(path, []).append(count_queries(client, path, headers, params))
+    db.close()
+
+    today = date.today().isoformat()
+    auth_endpoints = [
+        ("/users/me", patient_headers, None),
+        ("/reservations/", patient_headers, None),
+        ("/waitlist/", patient_headers, None),
+        ("/slots/", patient_headers, None),
+        ("/slots/summary", patient_headers, {"start_date": today, "end_date": today}),
+        ("/schedule/rules", admin_headers, None),
+    ]
+    savings = [(path, count_auth_savings(client, path, headers, params)) for path, headers, params in auth_endpoints]
+
+    failed = False
+    for path, counts in results.items():
+        summary = ", ".join(f"{rows} rows -> {queries} queries" for queries, rows in counts)
+        print(f"{path}: {summary}")
+        if len({queries for queries, _ in counts}) != 1:
+            failed = True
+    for path, (cold, warm) in savings:
+        print(f"{path}: {cold} queries -> {warm} with user cache (saves {cold - warm})")
+    assert not failed, "query count grows with result size (N+1)"
+    assert all(cold > warm for _, (cold, warm) in savings), "user cache did not avoid the user lookup"
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 import streamlit as st
 import requests
 import json
+import time
 from datetime import datetime, timedelta
 import pandas as pd
 
@@ -14,43 +15,70 @@ ADMIN_NAME = "システム管理者"
 ADMIN_PHONE = "08049829107"
 
 # 管理者アカウントが存在するか確認し、なければ作成する関数
+# ログインはせずに登録を試みて確認する（登録済みならbcryptの計算は発生しない）
+# 結果はサーバープロセスごとに保持し、失敗した場合は次のセッションで再試行する
+@st.cache_resource(show_spinner=False)
+def ensure_admin_account():
+    user_data = {
+        "email": ADMIN_EMAIL,
+        "password": ADMIN_PASSWORD,
+        "full_name": ADMIN_NAME,
+        "phone_number": ADMIN_PHONE,
+        "is_admin": True
+    }
+    response = requests.post(f"{API_URL}/register", json=user_data)
+    if response.status_code == 200:
+        return "管理者アカウントを作成しました"
+    if response.status_code == 400 and response.json().get("detail") == "Email already registered":
+        return "管理者アカウントが確認できました"
+    raise RuntimeError(f"管理者アカウントの作成に失敗しました: {response.json()}")
+
 def ensure_admin_exists():
     try:
-        # ログインを試みる
-        response = requests.post(
-            f"{API_URL}/token",
-            data={"username": ADMIN_EMAIL, "password": ADMIN_PASSWORD}
-        )
-        
-        # ログイン成功 = アカウントが既に存在する
-        if response.status_code == 200:
-            st.sidebar.success("管理者アカウントが確認できました")
-            return True
-            
-        # ログイン失敗 = アカウントが存在しない可能性
-        else:
-            # アカウント作成を試みる
-            user_data = {
-                "email": ADMIN_EMAIL,
-                "password": ADMIN_PASSWORD,
-                "full_name": ADMIN_NAME,
-                "phone_number": ADMIN_PHONE,
-                "is_admin": True
-            }
-            
-            create_response = requests.post(f"{API_URL}/register", json=user_data)
-            
-            if create_response.status_code == 200:
-                st.sidebar.success("管理者アカウントを作成しました")
-                return True
-            else:
-                st.sidebar.error(f"管理者アカウントの作成に失敗しました: {create_response.json()}")
-                return False
-                
+        st.sidebar.success(ensure_admin_account())
+        return True
     except Exception as e:
         st.sidebar.error(f"エラーが発生しました: {e}")
         return False
 
+# 一覧表示で1回に取得する件数
+PAGE_SIZE = 50
+
+# ETagを送って一覧APIを取得し、変更がなければ前回の結果を使う関数
+def get_with_etag(path, headers, params):
+    cache = st.session_state.setdefault("etag_cache", {})
+    key = (path, tuple(sorted(params.items())))
+    cached = cache.get(key)
+    request_headers = dict(headers)
+    if cached:
+        request_headers["If-None-Match"] = cached["etag"]
+    response = requests.get(f"{API_URL}{path}", headers=request_headers, params=params)
+    if response.status_code == 304 and cached:
+        return cached["body"], response
+    if response.status_code != 200:
+        return None, response
+    body = response.json()
+    if "ETag" in response.headers:
+        cache[key] = {"etag": response.headers["ETag"], "body": body}
+    return body, response
+
+# カーソルを使って一覧の次のページを取得し、表示中の結果に追加する関数
+def load_next_page(page_state, path):
+    try:
+        headers = {"Authorization": f"Bearer {st.session_state.token}"}
+        params = dict(page_state["params"])
+        if page_state["next_cursor"]:
+            params["cursor"] = page_state["next_cursor"]
+        
+        page, response = get_with_etag(path, headers, params)
+        if page is not None:
+            page_state["items"].extend(page["items"])
+            page_state["next_cursor"] = page["next_cursor"]
+        else:
+            st.error(f"データの取得に失敗しました: {response.json()}")
+    except Exception as e:
+        st.error(f"エラーが発生しました: {e}")
+
 st.set_page_config(page_title="クリニック予約システム - 管理者", layout="wide")
 st.title("クリニック予約システム - 管理者画面")
 
@@ -64,6 +92,48 @@ if 'user_data' not in st.session_state:
 if 'admin_checked' not in st.session_state:
     st.session_state.admin_checked = False
 
+# アクセストークンの期限のこの秒数前になったらリフレッシュトークンで更新する
+TOKEN_REFRESH_MARGIN_SECONDS = 300
+
+# ログイン・更新で受け取ったトークンを保存する関数
+def store_tokens(data):
+    st.session_state.token = data["access_token"]
+    st.session_state.refresh_token = data.get("refresh_token")
+    st.session_state.token_expires_at = time.time() + (data.get("expires_in") or 0)
+
+# ログアウト時にリフレッシュトークンを失効させ、トークンを破棄する関数
+def clear_tokens():
+    if st.session_state.get("refresh_token"):
+        try:
+            requests.post(f"{API_URL}/token/revoke", json={"refresh_token": st.session_state.refresh_token})
+        except Exception:
+            pass
+    st.session_state.token = None
+    st.session_state.refresh_token = None
+
+# アクセストークンの期限が近ければ更新する関数（パスワードを再送しないためbcryptの計算も発生しない）
+def refresh_token_if_needed():
+    if not st.session_state.get("refresh_token"):
+        return
+    if time.time() < st.session_state.get("token_expires_at", 0) - TOKEN_REFRESH_MARGIN_SECONDS:
+        return
+    try:
+        response = requests.post(f"{API_URL}/token/refresh", json={"refresh_token": st.session_state.refresh_token})
+    except Exception as e:
+        st.error(f"トークンの更新に失敗しました: {e}")
+        return
+    if response.status_code == 200:
+        store_tokens(response.json())
+    else:
+        # 失効・期限切れの場合は再度ログインしてもらう
+        st.session_state.token = None
+        st.session_state.refresh_token = None
+        st.session_state.is_logged_in = False
+        st.session_state.user_data = None
+        st.warning("ログインの有効期限が切れました。再度ログインしてください。")
+
+refresh_token_if_needed()
+
 # 管理者アカウントのチェック（初回のみ）
 if not st.session_state.admin_checked:
     ensure_admin_exists()
@@ -91,7 +161,7 @@ if not st.session_state.is_logged_in:
                 )
                 if response.status_code == 200:
                     data = response.json()
-                    st.session_state.token = data["access_token"]
+                    store_tokens(data)
                     
                     # ユーザー情報を取得
                     headers = {"Authorization": f"Bearer {st.session_state.token}"}
@@ -110,7 +180,7 @@ if not st.session_state.is_logged_in:
                     st.error("ログインに失敗しました。メールアドレスまたはパスワードが間違っています。")
             except Exception as e:
                 st.error(f"エラーが発生しました: {e}")
-
+    
     # 管理者アカウント作成フォーム（実際の運用では削除してください）
     with st.expander("管理者アカウント作成（開発用）"):
         with st.form("register_form"):
@@ -140,7 +210,7 @@ if not st.session_state.is_logged_in:
 else:
     # ログアウトボタン
     if st.button("ログアウト", key="logout"):
-        st.session_state.token = None
+        clear_tokens()
         st.session_state.is_logged_in = False
         st.session_state.user_data = None
         st.rerun()
@@ -192,7 +262,7 @@ else:
                     format="%d時"
                 )
                 start_hour, end_hour = time_range
-
+                
                 # 選択した時間帯を表示
                 #st.write(f"選択した診療時間: {start_hour}時 〜 {end_hour}時")
                 
@@ -236,6 +306,153 @@ else:
                     except Exception as e:
                         st.error(f"エラーが発生しました: {e}")
         
+        # 繰り返しの診療スケジュール（予約枠は日付が参照されたときに作成される）
+        with st.expander("診療スケジュール（繰り返し）"):
+            headers = {"Authorization": f"Bearer {st.session_state.token}"}
+            weekday_codes = ["MO", "TU", "WE", "TH", "FR", "SA", "SU"]
+            weekday_labels = ["月曜日", "火曜日", "水曜日", "木曜日", "金曜日", "土曜日", "日曜日"]
+            
+            with st.form("schedule_rule_form"):
+                rule_days = st.multiselect(
+                    "曜日選択",
+                    options=list(range(7)),
+                    format_func=lambda day: weekday_labels[day],
+                    default=[0, 1, 2, 3, 4]
+                )
+                col1, col2 = st.columns(2)
+                with col1:
+                    rule_start_date = st.date_input("適用開始日", value=datetime.now().date(), key="rule_start")
+                    rule_start_time = st.time_input("開始時刻", value=datetime.strptime("17:00", "%H:%M").time())
+                with col2:
+                    rule_end_date = st.date_input("適用終了日（任意）", value=None, key="rule_end")
+                    rule_end_time = st.time_input("終了時刻", value=datetime.strptime("19:00", "%H:%M").time())
+                rule_duration = st.selectbox("予約枠の時間", [15, 30, 45, 60], index=1, key="rule_duration")
+                rule_capacity = st.number_input("予約枠の人数", min_value=1, max_value=10, value=2, key="rule_capacity")
+                
+                if st.form_submit_button("スケジュールを登録"):
+                    try:
+                        rule_data = {
+                            "rrule": "FREQ=WEEKLY;BYDAY=" + ",".join(weekday_codes[day] for day in sorted(rule_days)),
+                            "start_date": rule_start_date.strftime("%Y-%m-%d"),
+                            "end_date": rule_end_date.strftime("%Y-%m-%d") if rule_end_date else None,
+                            "start_time": rule_start_time.strftime("%H:%M:%S"),
+                            "end_time": rule_end_time.strftime("%H:%M:%S"),
+                            "slot_duration_minutes": rule_duration,
+                            "capacity": rule_capacity
+                        }
+                        response = requests.post(f"{API_URL}/schedule/rules", headers=headers, json=rule_data)
+                        if response.status_code == 200:
+                            st.success("診療スケジュールを登録しました")
+                        else:
+                            st.error(f"診療スケジュールの登録に失敗しました: {response.json()}")
+                    except Exception as e:
+                        st.error(f"エラーが発生しました: {e}")
+            
+            # 登録済みのスケジュール
+            response = requests.get(f"{API_URL}/schedule/rules", headers=headers)
+            if response.status_code == 200:
+                for rule in response.json():
+                    col1, col2 = st.columns([4, 1])
+                    with col1:
+                        period = f"{rule['start_date']} 〜 {rule['end_date'] or ''}"
+                        st.write(f"{rule['rrule']} / {rule['start_time'][:5]}〜{rule['end_time'][:5]} / "
+                                 f"{rule['slot_duration_minutes']}分 / {rule['capacity']}名 / {period}")
+                    with col2:
+                        if st.button("削除", key=f"delete_rule_{rule['id']}"):
+                            requests.delete(f"{API_URL}/schedule/rules/{rule['id']}", headers=headers)
+                            st.rerun()
+            
+            # 休診日
+            st.write("休診日")
+            col1, col2, col3 = st.columns([2, 3, 1])
+            with col1:
+                closure_date = st.date_input("日付", value=datetime.now().date(), key="closure_date")
+            with col2:
+                closure_note = st.text_input("メモ", key="closure_note")
+            with col3:
+                if st.button("休診日に設定", key="add_closure"):
+                    response = requests.put(
+                        f"{API_URL}/schedule/closures/{closure_date.strftime('%Y-%m-%d')}",
+                        headers=headers,
+                        json={"note": closure_note or None}
+                    )
+                    if response.status_code != 200:
+                        st.error(f"休診日の設定に失敗しました: {response.json()}")
+            
+            response = requests.get(f"{API_URL}/schedule/closures", headers=headers)
+            if response.status_code == 200:
+                for closure in response.json():
+                    col1, col2 = st.columns([4, 1])
+                    with col1:
+                        st.write(f"{closure['day']} {closure['note'] or ''}")
+                    with col2:
+                        if st.button("取消", key=f"delete_closure_{closure['day']}"):
+                            requests.delete(f"{API_URL}/schedule/closures/{closure['day']}", headers=headers)
+                            st.rerun()
+        
+        # 期間内の予約枠をまとめて無効化・再開・移動・削除する（休診・医師の不在など）
+        with st.expander("期間の予約枠を一括操作"):
+            operations = {
+                "無効化": "deactivate",
+                "再開": "reopen",
+                "時間を移動": "shift",
+                "削除（予約のない枠のみ）": "delete"
+            }
+            with st.form("slot_range_form"):
+                col1, col2 = st.columns(2)
+                with col1:
+                    range_start_date = st.date_input("開始日", value=datetime.now().date(), key="range_start")
+                    range_from_time = st.time_input("開始時刻（この時刻以降の枠）", value=None, key="range_from")
+                with col2:
+                    range_end_date = st.date_input("終了日", value=datetime.now().date(), key="range_end")
+                    range_to_time = st.time_input("開始時刻（この時刻以前の枠）", value=None, key="range_to")
+                operation = st.radio("操作", list(operations), horizontal=True)
+                col1, col2 = st.columns(2)
+                with col1:
+                    shift_days = st.number_input("移動する日数", value=0, step=1)
+                with col2:
+                    shift_minutes = st.number_input("移動する分数", value=0, step=15)
+                
+                if st.form_submit_button("実行"):
+                    try:
+                        headers = {"Authorization": f"Bearer {st.session_state.token}"}
+                        range_data = {
+                            "start_date": range_start_date.strftime("%Y-%m-%d"),
+                            "end_date": range_end_date.strftime("%Y-%m-%d"),
+                            "from_time": range_from_time.strftime("%H:%M:%S") if range_from_time else None,
+                            "to_time": range_to_time.strftime("%H:%M:%S") if range_to_time else None
+                        }
+                        if operations[operation] == "shift":
+                            range_data.update({"days": int(shift_days), "minutes": int(shift_minutes)})
+                        
+                        response = requests.post(
+                            f"{API_URL}/slots/range/{operations[operation]}",
+                            headers=headers,
+                            json=range_data
+                        )
+                        
+                        if response.status_code == 200:
+                            result = response.json()
+                            st.success(f"{operation}が完了しました（{result['affected']}個の予約枠）")
+                            # 予約が入っている枠は患者への連絡が必要
+                            if result["reserved_slots"]:
+                                st.warning(f"予約が入っている枠が{len(result['reserved_slots'])}個あります")
+                                st.dataframe(pd.DataFrame([
+                                    {
+                                        "ID": slot["id"],
+                                        "日付": slot["date"],
+                                        "開始時間": slot["start_time"][:5],
+                                        "終了時間": slot["end_time"][:5],
+                                        "予約数": slot["capacity"] - slot["available_spots"],
+                                        "有効": slot["is_active"]
+                                    }
+                                    for slot in result["reserved_slots"]
+                                ]), use_container_width=True)
+                        else:
+                            st.error(f"一括操作に失敗しました: {response.json()}")
+                    except Exception as e:
+                        st.error(f"エラーが発生しました: {e}")
+        
         # 予約枠一覧表示
         st.subheader("予約枠一覧")
         col1, col2 = st.columns(2)
@@ -244,46 +461,49 @@ else:
         with col2:
             view_end_date = st.date_input("表示終了日", value=(datetime.now() + timedelta(days=14)).date(), key="view_end")
         
+        # 1ページ目を取得して表示をリセット
         if st.button("予約枠を表示", key="show_slots"):
-            try:
-                headers = {"Authorization": f"Bearer {st.session_state.token}"}
-                response = requests.get(
-                    f"{API_URL}/slots/",
-                    headers=headers,
-                    params={
-                        "start_date": view_start_date.strftime("%Y-%m-%d"),
-                        "end_date": view_end_date.strftime("%Y-%m-%d")
-                    }
-                )
+            st.session_state.slots_page = {
+                "params": {
+                    "start_date": view_start_date.strftime("%Y-%m-%d"),
+                    "end_date": view_end_date.strftime("%Y-%m-%d"),
+                    "limit": PAGE_SIZE
+                },
+                "items": [],
+                "next_cursor": None
+            }
+            load_next_page(st.session_state.slots_page, "/slots/")
+        
+        slots_page = st.session_state.get("slots_page")
+        if slots_page is not None:
+            slots = slots_page["items"]
+            if slots:
+                # データフレームに変換
+                slots_data = []
+                for slot in slots:
+                    slot_date = datetime.fromisoformat(slot["date"]).strftime("%Y-%m-%d")
+                    start_time = datetime.strptime(slot["start_time"], "%H:%M:%S").strftime("%H:%M")
+                    end_time = datetime.strptime(slot["end_time"], "%H:%M:%S").strftime("%H:%M")
+                    
+                    slots_data.append({
+                        "ID": slot["id"],
+                        "日付": slot_date,
+                        "開始時間": start_time,
+                        "終了時間": end_time,
+                        "定員": slot["capacity"],
+                        "残り枠": slot["available_spots"],
+                        "予約数": slot["capacity"] - slot["available_spots"]
+                    })
                 
-                if response.status_code == 200:
-                    slots = response.json()
-                    if slots:
-                        # データフレームに変換
-                        slots_data = []
-                        for slot in slots:
-                            slot_date = datetime.fromisoformat(slot["date"]).strftime("%Y-%m-%d")
-                            start_time = datetime.strptime(slot["start_time"], "%H:%M:%S").strftime("%H:%M")
-                            end_time = datetime.strptime(slot["end_time"], "%H:%M:%S").strftime("%H:%M")
-                            
-                            slots_data.append({
-                                "ID": slot["id"],
-                                "日付": slot_date,
-                                "開始時間": start_time,
-                                "終了時間": end_time,
-                                "定員": slot["capacity"],
-                                "残り枠": slot["available_spots"],
-                                "予約数": slot["capacity"] - slot["available_spots"]
-                            })
-                        
-                        df = pd.DataFrame(slots_data)
-                        st.dataframe(df, use_container_width=True)
-                    else:
-                        st.info("表示する予約枠がありません")
-                else:
-                    st.error(f"予約枠の取得に失敗しました: {response.json()}")
-            except Exception as e:
-                st.error(f"エラーが発生しました: {e}")
+                df = pd.DataFrame(slots_data)
+                st.dataframe(df, use_container_width=True)
+            else:
+                st.info("表示する予約枠がありません")
+            
+            # 次のページがあれば追加で読み込む
+            if slots_page["next_cursor"] and st.button("さらに読み込む", key="more_slots"):
+                load_next_page(slots_page, "/slots/")
+                st.rerun()
     
     # 予約一覧タブ
     with tab2:
@@ -291,44 +511,51 @@ else:
         
         # 日付選択
         selected_date = st.date_input("表示する日付", value=datetime.now().date())
+        include_archived = st.checkbox("アーカイブ済みの予約も表示", value=False, key="include_archived")
         
+        # 1ページ目を取得して表示をリセット
         if st.button("予約を表示", key="show_reservations"):
-            try:
-                headers = {"Authorization": f"Bearer {st.session_state.token}"}
-                response = requests.get(
-                    f"{API_URL}/reservations/admin",
-                    headers=headers,
-                    params={"date": selected_date.strftime("%Y-%m-%d")}
-                )
+            st.session_state.reservations_page = {
+                "params": {
+                    "date": selected_date.strftime("%Y-%m-%d"),
+                    "include_archived": include_archived,
+                    "limit": PAGE_SIZE
+                },
+                "items": [],
+                "next_cursor": None
+            }
+            load_next_page(st.session_state.reservations_page, "/reservations/admin")
+        
+        reservations_page = st.session_state.get("reservations_page")
+        if reservations_page is not None:
+            reservations = reservations_page["items"]
+            if reservations:
+                # データフレームに変換
+                reservations_data = []
+                for res in reservations:
+                    slot_date = datetime.fromisoformat(res["time_slot"]["date"]).strftime("%Y-%m-%d")
+                    start_time = datetime.strptime(res["time_slot"]["start_time"], "%H:%M:%S").strftime("%H:%M")
+                    
+                    reservations_data.append({
+                        "予約ID": res["id"],
+                        "予約番号": res["daily_number"],
+                        "患者名": res["patient"]["full_name"],
+                        "電話番号": res["patient"]["phone_number"],
+                        "日付": slot_date,
+                        "時間": start_time,
+                        "確認済み": "✓" if res["is_confirmed"] else "✗",
+                        "QRコード": res["qr_code_data"]
+                    })
                 
-                if response.status_code == 200:
-                    reservations = response.json()
-                    if reservations:
-                        # データフレームに変換
-                        reservations_data = []
-                        for res in reservations:
-                            slot_date = datetime.fromisoformat(res["time_slot"]["date"]).strftime("%Y-%m-%d")
-                            start_time = datetime.strptime(res["time_slot"]["start_time"], "%H:%M:%S").strftime("%H:%M")
-                            
-                            reservations_data.append({
-                                "予約ID": res["id"],
-                                "予約番号": res["daily_number"],
-                                "患者名": res["patient"]["full_name"],
-                                "電話番号": res["patient"]["phone_number"],
-                                "日付": slot_date,
-                                "時間": start_time,
-                                "確認済み": "✓" if res["is_confirmed"] else "✗",
-                                "QRコード": res["qr_code_data"]
-                            })
-                        
-                        df = pd.DataFrame(reservations_data)
-                        st.dataframe(df, use_container_width=True)
-                    else:
-                        st.info(f"{selected_date.strftime('%Y-%m-%d')}の予約はありません")
-                else:
-                    st.error(f"予約の取得に失敗しました: {response.json()}")
-            except Exception as e:
-                st.error(f"エラーが発生しました: {e}")
+                df = pd.DataFrame(reservations_data)
+                st.dataframe(df, use_container_width=True)
+            else:
+                st.info(f"{reservations_page['params']['date']}の予約はありません")
+            
+            # 次のページがあれば追加で読み込む
+            if reservations_page["next_cursor"] and st.button("さらに読み込む", key="more_reservations"):
+                load_next_page(reservations_page, "/reservations/admin")
+                st.rerun()
     
     # QRコード読取タブ
     with tab3:
@@ -1,12 +1,27 @@
 import streamlit as st
 import requests
 import json
+import time
 from datetime import datetime
 import pandas as pd
 
 # APIのベースURL
 API_URL = "http://localhost:8000"
 
+# カーソルをたどって一覧APIの全ページを取得する関数
+def fetch_all_pages(path, headers, params):
+    items = []
+    params = dict(params)
+    while True:
+        response = requests.get(f"{API_URL}{path}", headers=headers, params=params)
+        if response.status_code != 200:
+            return None, response
+        page = response.json()
+        items.extend(page["items"])
+        if not page["next_cursor"]:
+            return items, response
+        params["cursor"] = page["next_cursor"]
+
 st.set_page_config(page_title="クリニック予約確認システム", layout="wide")
 st.title("クリニック予約確認システム")
 
@@ -17,6 +32,58 @@ if 'is_logged_in' not in st.session_state:
     st.session_state.is_logged_in = False
 if 'user_data' not in st.session_state:
     st.session_state.user_data = None
+if 'qr_queue' not in st.session_state:
+    st.session_state.qr_queue = []
+
+# アクセストークンの期限のこの秒数前になったらリフレッシュトークンで更新する
+TOKEN_REFRESH_MARGIN_SECONDS = 300
+
+# ログイン・更新で受け取ったトークンを保存する関数
+def store_tokens(data):
+    st.session_state.token = data["access_token"]
+    st.session_state.refresh_token = data.get("refresh_token")
+    st.session_state.token_expires_at = time.time() + (data.get("expires_in") or 0)
+
+# ログアウト時にリフレッシュトークンを失効させ、トークンを破棄する関数
+def clear_tokens():
+    if st.session_state.get("refresh_token"):
+        try:
+            requests.post(f"{API_URL}/token/revoke", json={"refresh_token": st.session_state.refresh_token})
+        except Exception:
+            pass
+    st.session_state.token = None
+    st.session_state.refresh_token = None
+
+# アクセストークンの期限が近ければ更新する関数（パスワードを再送しないためbcryptの計算も発生しない）
+def refresh_token_if_needed():
+    if not st.session_state.get("refresh_token"):
+        return
+    if time.time() < st.session_state.get("token_expires_at", 0) - TOKEN_REFRESH_MARGIN_SECONDS:
+        return
+    try:
+        response = requests.post(f"{API_URL}/token/refresh", json={"refresh_token": st.session_state.refresh_token})
+    except Exception as e:
+        st.error(f"トークンの更新に失敗しました: {e}")
+        return
+    if response.status_code == 200:
+        store_tokens(response.json())
+    else:
+        # 失効・期限切れの場合は再度ログインしてもらう
+        st.session_state.token = None
+        st.session_state.refresh_token = None
+        st.session_state.is_logged_in = False
+        st.session_state.user_data = None
+        st.warning("ログインの有効期限が切れました。再度ログインしてください。")
+
+refresh_token_if_needed()
+
+# まとめて受付モードでQRコードをキューに追加する関数
+def add_to_queue(qr_code):
+    if qr_code in st.session_state.qr_queue:
+        st.info("このQRコードは既にキューに追加されています")
+    else:
+        st.session_state.qr_queue.append(qr_code)
+        st.success(f"キューに追加しました（{len(st.session_state.qr_queue)}件）")
 
 # ログイン状態に応じて表示を切り替え
 if not st.session_state.is_logged_in:
@@ -35,7 +102,7 @@ if not st.session_state.is_logged_in:
                 )
                 if response.status_code == 200:
                     data = response.json()
-                    st.session_state.token = data["access_token"]
+                    store_tokens(data)
                     
                     # ユーザー情報を取得
                     headers = {"Authorization": f"Bearer {st.session_state.token}"}
@@ -61,7 +128,7 @@ else:
         st.write(f"ようこそ、{st.session_state.user_data['full_name']}さん")
     with col2:
         if st.button("ログアウト", key="logout"):
-            st.session_state.token = None
+            clear_tokens()
             st.session_state.is_logged_in = False
             st.session_state.user_data = None
             st.experimental_rerun()
@@ -73,12 +140,17 @@ else:
     with tab1:
         st.header("QRコード読取")
         
+        # 団体受付や通信断からの復帰時は、読み取ったQRコードをためてまとめて確認済みにする
+        queue_mode = st.checkbox("まとめて受付モード（読み取ったQRコードをキューにためる）", key="queue_mode")
+        
         # QRコードを手動入力するフォーム
         with st.form("qr_manual_form"):
             qr_code = st.text_input("QRコードの値を入力")
             submit_qr = st.form_submit_button("予約を確認")
             
-            if submit_qr and qr_code:
+            if submit_qr and qr_code and queue_mode:
+                add_to_queue(qr_code)
+            elif submit_qr and qr_code:
                 try:
                     headers = {"Authorization": f"Bearer {st.session_state.token}"}
                     # 予約情報を取得
@@ -128,7 +200,9 @@ else:
             from streamlit_qrcode_scanner import qrcode_scanner
             
             qr_code_data = qrcode_scanner()
-            if qr_code_data:
+            if qr_code_data and queue_mode:
+                add_to_queue(qr_code_data)
+            elif qr_code_data:
                 st.write(f"QRコード: {qr_code_data}")
                 try:
                     headers = {"Authorization": f"Bearer {st.session_state.token}"}
@@ -172,6 +246,50 @@ else:
         except ImportError:
             st.warning("QRコードスキャナー機能を使用するには、以下のコマンドを実行してください：")
             st.code("pip install streamlit-qrcode-scanner")
+        
+        # まとめて受付のキュー
+        if queue_mode:
+            st.subheader("受付キュー")
+            if st.session_state.qr_queue:
+                st.dataframe(pd.DataFrame({"QRコード": st.session_state.qr_queue}), use_container_width=True)
+                
+                col1, col2 = st.columns(2)
+                with col1:
+                    submit_queue = st.button("まとめて確認済みにする", key="confirm_queue")
+                with col2:
+                    if st.button("キューをクリア", key="clear_queue"):
+                        st.session_state.qr_queue = []
+                        st.experimental_rerun()
+                
+                if submit_queue:
+                    try:
+                        headers = {"Authorization": f"Bearer {st.session_state.token}"}
+                        response = requests.put(
+                            f"{API_URL}/reservations/confirm",
+                            headers=headers,
+                            json={"qr_codes": st.session_state.qr_queue}
+                        )
+                        
+                        if response.status_code == 200:
+                            status_labels = {
+                                "confirmed": "確認済みにしました",
+                                "already_confirmed": "既に確認済み",
+                                "not_found": "予約が見つかりません"
+                            }
+                            results = [
+                                {"QRコード": result["qr_code"], "結果": status_labels.get(result["status"], result["status"])}
+                                for result in response.json()
+                            ]
+                            st.dataframe(pd.DataFrame(results), use_container_width=True)
+                            
+                            # 送信できたのでキューを空にする（失敗時は再送できるよう残す）
+                            st.session_state.qr_queue = []
+                        else:
+                            st.error(f"まとめて確認に失敗しました: {response.json()}")
+                    except Exception as e:
+                        st.error(f"エラーが発生しました（キューは保持されています）: {e}")
+            else:
+                st.info("キューは空です")
     
     # 本日の予約一覧タブ
     with tab2:
@@ -182,14 +300,13 @@ else:
         if st.button("予約を表示", key="show_today_reservations"):
             try:
                 headers = {"Authorization": f"Bearer {st.session_state.token}"}
-                response = requests.get(
-                    f"{API_URL}/reservations/admin",
-                    headers=headers,
-                    params={"date": today.strftime("%Y-%m-%d")}
+                reservations, response = fetch_all_pages(
+                    "/reservations/admin",
+                    headers,
+                    {"date": today.strftime("%Y-%m-%d")}
                 )
                 
                 if response.status_code == 200:
-                    reservations = response.json()
                     if reservations:
                         # データフレームに変換
                         reservations_data = []
@@ -225,7 +342,7 @@ else:
                                 st.dataframe(confirmed, use_container_width=True)
                             else:
                                 st.info("確認済みの予約はありません")
-                                
+                        
                         # 統計情報
                         st.subheader("統計")
                         total = len(reservations)
@@ -235,7 +352,7 @@ else:
                         st.write(f"本日の予約総数: {total}")
                         st.write(f"確認済み: {confirmed_count} ({confirmed_count/total*100:.1f}%)")
                         st.write(f"未確認: {unconfirmed_count} ({unconfirmed_count/total*100:.1f}%)")
-                        
+                    
                     else:
                         st.info(f"{today.strftime('%Y-%m-%d')}の予約はありません")
                 else:
@@ -1,7 +1,9 @@
 import streamlit as st
 import requests
 import json
-from datetime import datetime, timedelta
+import time
+import calendar
+from datetime import date, datetime, timedelta
 import pandas as pd
 import qrcode
 from PIL import Image
@@ -21,6 +23,150 @@ if 'is_logged_in' not in st.session_state:
 if 'user_data' not in st.session_state:
     st.session_state.user_data = None
 
+# アクセストークンの期限のこの秒数前になったらリフレッシュトークンで更新する
+TOKEN_REFRESH_MARGIN_SECONDS = 300
+
+# ログイン・更新で受け取ったトークンを保存する関数
+def store_tokens(data):
+    st.session_state.token = data["access_token"]
+    st.session_state.refresh_token = data.get("refresh_token")
+    st.session_state.token_expires_at = time.time() + (data.get("expires_in") or 0)
+
+# ログアウト時にリフレッシュトークンを失効させ、トークンを破棄する関数
+def clear_tokens():
+    if st.session_state.get("refresh_token"):
+        try:
+            requests.post(f"{API_URL}/token/revoke", json={"refresh_token": st.session_state.refresh_token})
+        except Exception:
+            pass
+    st.session_state.token = None
+    st.session_state.refresh_token = None
+
+# アクセストークンの期限が近ければ更新する関数（パスワードを再送しないためbcryptの計算も発生しない）
+def refresh_token_if_needed():
+    if not st.session_state.get("refresh_token"):
+        return
+    if time.time() < st.session_state.get("token_expires_at", 0) - TOKEN_REFRESH_MARGIN_SECONDS:
+        return
+    try:
+        response = requests.post(f"{API_URL}/token/refresh", json={"refresh_token": st.session_state.refresh_token})
+    except Exception as e:
+        st.error(f"トークンの更新に失敗しました: {e}")
+        return
+    if response.status_code == 200:
+        store_tokens(response.json())
+    else:
+        # 失効・期限切れの場合は再度ログインしてもらう
+        st.session_state.token = None
+        st.session_state.refresh_token = None
+        st.session_state.is_logged_in = False
+        st.session_state.user_data = None
+        st.warning("ログインの有効期限が切れました。再度ログインしてください。")
+
+refresh_token_if_needed()
+
+# ETagを送って一覧APIを取得し、変更がなければ前回の結果を使う関数
+def get_with_etag(path, headers, params):
+    cache = st.session_state.setdefault("etag_cache", {})
+    key = (path, tuple(sorted(params.items())))
+    cached = cache.get(key)
+    request_headers = dict(headers)
+    if cached:
+        request_headers["If-None-Match"] = cached["etag"]
+    response = requests.get(f"{API_URL}{path}", headers=request_headers, params=params)
+    if response.status_code == 304 and cached:
+        return cached["body"], response
+    if response.status_code != 200:
+        return None, response
+    body = response.json()
+    if "ETag" in response.headers:
+        cache[key] = {"etag": response.headers["ETag"], "body": body}
+    return body, response
+
+# カーソルをたどって一覧APIの全ページを取得する関数
+def fetch_all_pages(path, headers, params):
+    items = []
+    params = dict(params)
+    while True:
+        page, response = get_with_etag(path, headers, params)
+        if page is None:
+            return None, response
+        items.extend(page["items"])
+        if not page["next_cursor"]:
+            return items, response
+        params["cursor"] = page["next_cursor"]
+
+# 期間の予約枠の手元のコピーを差分同期して返す関数
+# 初回は一覧を全件取得し、以降は前回のバージョンからの変更分（/slots/changes）だけを反映する
+def sync_slots(headers, start_date, end_date):
+    synced = st.session_state.setdefault("synced_slots", {})
+    key = (start_date.isoformat(), end_date.isoformat())
+    copy = synced.get(key)
+    
+    if copy is not None:
+        response = requests.get(f"{API_URL}/slots/changes", headers=headers, params={"since": copy["version"]})
+        if response.status_code != 200:
+            return None, response
+        changes = response.json()
+        if not changes["reset"]:
+            for slot in changes["slots"]:
+                # 期間外へ移動した枠や無効化された枠は手元のコピーから外す
+                if slot["is_active"] and key[0] <= slot["date"] <= key[1]:
+                    copy["slots"][slot["id"]] = slot
+                else:
+                    copy["slots"].pop(slot["id"], None)
+            for slot_id in changes["deleted_ids"]:
+                copy["slots"].pop(slot_id, None)
+            copy["version"] = changes["version"]
+            return sorted(copy["slots"].values(), key=lambda slot: (slot["date"], slot["start_time"], slot["id"])), response
+    
+    # 手元にコピーがない、または差分を取得できない場合は一覧を取得し直す
+    slots, response = fetch_all_pages("/slots/", headers, {"start_date": key[0], "end_date": key[1]})
+    if slots is None:
+        return None, response
+    synced[key] = {
+        "version": int(response.headers["ETag"].strip('"')),
+        "slots": {slot["id"]: slot for slot in slots}
+    }
+    return slots, response
+
+# 月間カレンダーを表示する関数（日別の空き状況を1回のリクエストで取得）
+def show_month_calendar(month_start, headers):
+    last_day = calendar.monthrange(month_start.year, month_start.month)[1]
+    month_end = month_start.replace(day=last_day)
+    response = requests.get(
+        f"{API_URL}/slots/summary",
+        headers=headers,
+        params={"start_date": month_start.isoformat(), "end_date": month_end.isoformat()}
+    )
+    if response.status_code != 200:
+        st.error(f"空き状況の取得に失敗しました: {response.json()}")
+        return
+    summary = {day["date"]: day for day in response.json()}
+    
+    # 曜日の見出し
+    for column, weekday in zip(st.columns(7), ["月", "火", "水", "木", "金", "土", "日"]):
+        column.markdown(f"**{weekday}**")
+    
+    # 週ごとに1行ずつ表示し、空きのある日はクリックで日付を選択できる
+    today = datetime.now().date()
+    for week in calendar.Calendar().monthdatescalendar(month_start.year, month_start.month):
+        for column, day in zip(st.columns(7), week):
+            if day.month != month_start.month:
+                continue
+            day_summary = summary.get(day.isoformat())
+            if day_summary and day_summary["remaining"] > 0 and day >= today:
+                first_time = day_summary["first_available_time"][:5]
+                column.button(
+                    f"{day.day}日 残り{day_summary['remaining']} ({first_time}〜)",
+                    key=f"calendar_{day.isoformat()}",
+                    on_click=lambda selected=day: st.session_state.update(selected_date=selected)
+                )
+            elif day_summary:
+                column.write(f"{day.day}日 満席")
+            else:
+                column.write(f"{day.day}日 -")
+
 # QRコード生成関数
 def generate_qr_code(data):
     qr = qrcode.QRCode(
@@ -61,7 +207,7 @@ if not st.session_state.is_logged_in:
                     )
                     if response.status_code == 200:
                         data = response.json()
-                        st.session_state.token = data["access_token"]
+                        store_tokens(data)
                         
                         # ユーザー情報を取得
                         headers = {"Authorization": f"Bearer {st.session_state.token}"}
@@ -106,7 +252,7 @@ else:
     # ログアウトボタン
     st.write(f"ようこそ、{st.session_state.user_data['full_name']}さん")
     if st.button("ログアウト", key="logout"):
-        st.session_state.token = None
+        clear_tokens()
         st.session_state.is_logged_in = False
         st.session_state.user_data = None
         st.rerun()
@@ -118,26 +264,69 @@ else:
     with tab1:
         st.header("予約作成")
         
-        # 日付選択
         today = datetime.now().date()
-        selected_date = st.date_input("日付を選択", value=today, min_value=today)
+        if "selected_date" not in st.session_state:
+            st.session_state.selected_date = today
+        
+        # 月間の空き状況カレンダー
+        with st.expander("空き状況カレンダー", expanded=True):
+            month_options = [date(today.year + (today.month - 1 + i) // 12, (today.month - 1 + i) % 12 + 1, 1) for i in range(3)]
+            month_start = st.selectbox("表示する月", options=month_options, format_func=lambda month: month.strftime("%Y年%m月"))
+            show_month_calendar(month_start, {"Authorization": f"Bearer {st.session_state.token}"})
+        
+        # 曜日・時間帯を指定して最短の空き枠を検索
+        with st.expander("最短の空き枠を探す"):
+            weekday_labels = ["月曜日", "火曜日", "水曜日", "木曜日", "金曜日", "土曜日", "日曜日"]
+            search_days = st.multiselect("曜日（任意）", options=list(range(7)), format_func=lambda day: weekday_labels[day])
+            col1, col2 = st.columns(2)
+            with col1:
+                search_from = st.time_input("開始時刻（以降）", value=None, key="search_from")
+            with col2:
+                search_to = st.time_input("開始時刻（以前）", value=None, key="search_to")
+            
+            headers = {"Authorization": f"Bearer {st.session_state.token}"}
+            if st.button("検索", key="search_next_available"):
+                params = {"limit": 5}
+                if search_days:
+                    params["weekdays"] = search_days
+                if search_from:
+                    params["from_time"] = search_from.strftime("%H:%M:%S")
+                if search_to:
+                    params["to_time"] = search_to.strftime("%H:%M:%S")
+                response = requests.get(f"{API_URL}/slots/next-available", headers=headers, params=params)
+                if response.status_code == 200:
+                    st.session_state.next_available = response.json()
+                else:
+                    st.error(f"空き枠の検索に失敗しました: {response.json()}")
+            
+            next_available = st.session_state.get("next_available")
+            if next_available is not None:
+                if not next_available:
+                    st.info("条件に合う空き枠はありません")
+                for slot in next_available:
+                    col1, col2 = st.columns([3, 1])
+                    with col1:
+                        st.write(f"{slot['date']} {slot['start_time'][:5]} - {slot['end_time'][:5]} (残り{slot['available_spots']}枠)")
+                    with col2:
+                        if st.button("予約する", key=f"book_next_{slot['id']}"):
+                            response = requests.post(f"{API_URL}/reservations/", headers=headers, json={"slot_id": slot["id"]})
+                            if response.status_code == 200:
+                                st.success(f"予約が完了しました（予約番号: {response.json()['daily_number']}）。QRコードは「予約確認」タブで確認できます。")
+                                st.session_state.next_available = None
+                            else:
+                                st.error(f"予約に失敗しました: {response.json().get('detail', '')}")
+        
+        # 日付選択（カレンダーで選んだ日付が反映される）
+        selected_date = st.date_input("日付を選択", min_value=today, key="selected_date")
         
         # 選択した日付の予約枠を取得
         if st.button("利用可能な予約枠を表示", key="show_slots"):
             try:
                 headers = {"Authorization": f"Bearer {st.session_state.token}"}
-                response = requests.get(
-                    f"{API_URL}/slots/",
-                    headers=headers,
-                    params={
-                        "start_date": selected_date.strftime("%Y-%m-%d"),
-                        "end_date": selected_date.strftime("%Y-%m-%d"),
-                        "available_only": True
-                    }
-                )
+                slots, response = sync_slots(headers, selected_date, selected_date)
                 
-                if response.status_code == 200:
-                    slots = response.json()
+                if slots is not None:
+                    slots = [slot for slot in slots if slot["available_spots"] > 0]
                     if slots:
                         st.success(f"{len(slots)}個の予約枠が見つかりました")
                         
@@ -199,11 +388,62 @@ else:
                     st.error(f"予約枠の取得に失敗しました: {response.json()}")
             except Exception as e:
                 st.error(f"エラーが発生しました: {e}")
+        
+        # 満席の枠のキャンセル待ち登録
+        st.subheader("キャンセル待ち")
+        st.write("満席の予約枠はキャンセル待ちに登録できます。キャンセルが出ると登録順に自動で予約されます。")
+        
+        if st.button("満席の予約枠を表示", key="show_full_slots"):
+            try:
+                headers = {"Authorization": f"Bearer {st.session_state.token}"}
+                slots, response = sync_slots(headers, selected_date, selected_date)
+                
+                if slots is not None:
+                    st.session_state.full_slots = [slot for slot in slots if slot["available_spots"] == 0]
+                else:
+                    st.error(f"予約枠の取得に失敗しました: {response.json()}")
+            except Exception as e:
+                st.error(f"エラーが発生しました: {e}")
+        
+        full_slots = st.session_state.get("full_slots")
+        if full_slots is not None:
+            if full_slots:
+                with st.form("waitlist_form"):
+                    selected_full_slot = st.selectbox(
+                        "キャンセル待ちする予約枠",
+                        options=full_slots,
+                        format_func=lambda slot: f"{slot['date']} "
+                            f"{datetime.strptime(slot['start_time'], '%H:%M:%S').strftime('%H:%M')} - "
+                            f"{datetime.strptime(slot['end_time'], '%H:%M:%S').strftime('%H:%M')}"
+                    )
+                    submit_waitlist = st.form_submit_button("キャンセル待ちに登録")
+                    
+                    if submit_waitlist:
+                        try:
+                            headers = {"Authorization": f"Bearer {st.session_state.token}"}
+                            response = requests.post(
+                                f"{API_URL}/waitlist/",
+                                headers=headers,
+                                json={"slot_id": selected_full_slot["id"]}
+                            )
+                            
+                            if response.status_code == 200:
+                                st.success("キャンセル待ちに登録しました。予約が確定すると「予約確認」タブに表示されます。")
+                            else:
+                                error_msg = response.json().get("detail", "登録に失敗しました")
+                                st.error(f"キャンセル待ちの登録に失敗しました: {error_msg}")
+                        except Exception as e:
+                            st.error(f"エラーが発生しました: {e}")
+            else:
+                st.info("満席の予約枠はありません")
     
     # 予約確認タブ
     with tab2:
         st.header("予約確認")
         
+        # 過去の予約はアーカイブから読むため、必要なときだけ含める
+        include_past = st.checkbox("過去の予約も表示", value=False, key="include_past")
+        
         # 予約一覧を取得
         if st.button("予約を表示", key="show_reservations"):
             try:
@@ -211,7 +451,7 @@ else:
                 response = requests.get(
                     f"{API_URL}/reservations/",
                     headers=headers,
-                    params={"include_past": True}
+                    params={"include_past": include_past}
                 )
                 
                 if response.status_code == 200:
@@ -283,4 +523,53 @@ else:
                 else:
                     st.error(f"予約の取得に失敗しました: {response.json()}")
             except Exception as e:
-                st.error(f"エラーが発生しました: {e}")
\ No newline at end of file
+                st.error(f"エラーが発生しました: {e}")
+        
+        # キャンセル待ち一覧
+        st.subheader("キャンセル待ち一覧")
+        
+        if st.button("キャンセル待ちを表示", key="show_waitlist"):
+            try:
+                headers = {"Authorization": f"Bearer {st.session_state.token}"}
+                response = requests.get(f"{API_URL}/waitlist/", headers=headers)
+                
+                if response.status_code == 200:
+                    st.session_state.waitlist = response.json()
+                else:
+                    st.error(f"キャンセル待ちの取得に失敗しました: {response.json()}")
+            except Exception as e:
+                st.error(f"エラーが発生しました: {e}")
+        
+        waitlist = st.session_state.get("waitlist")
+        if waitlist is not None:
+            if waitlist:
+                waitlist_labels = {
+                    entry["id"]: f"{entry['time_slot']['date']} "
+                        f"{datetime.strptime(entry['time_slot']['start_time'], '%H:%M:%S').strftime('%H:%M')}"
+                    for entry in waitlist
+                }
+                st.dataframe(
+                    pd.DataFrame({"キャンセル待ちの予約枠": list(waitlist_labels.values())}),
+                    use_container_width=True
+                )
+                
+                selected_entry_id = st.selectbox(
+                    "取り消すキャンセル待ち",
+                    options=list(waitlist_labels.keys()),
+                    format_func=lambda entry_id: waitlist_labels[entry_id]
+                )
+                if st.button("キャンセル待ちを取り消す", key="leave_waitlist"):
+                    try:
+                        headers = {"Authorization": f"Bearer {st.session_state.token}"}
+                        response = requests.delete(f"{API_URL}/waitlist/{selected_entry_id}", headers=headers)
+                        
+                        if response.status_code == 204:
+                            st.session_state.waitlist = [entry for entry in waitlist if entry["id"] != selected_entry_id]
+                            st.success("キャンセル待ちを取り消しました")
+                            st.rerun()
+                        else:
+                            st.error("キャンセル待ちの取り消しに失敗しました")
+                    except Exception as e:
+                        st.error(f"エラーが発生しました: {e}")
+            else:
+                st.info("キャンセル待ちはありません")
\ No newline at end of file
@@ -0,0 +1,6 @@
+import os
+import tempfile
+
+# api をインポートする前に、テスト用の一時DBと計算の軽いbcryptのコストを設定する
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/clinic_reservation.db")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
@@ -0,0 +1,31 @@
+import sqlite3
+
+from sqlalchemy.exc import DBAPIError, OperationalError
+
+from api.routers.reservations import is_lock_error
+
+
+class PostgresError(Exception):
+    """SQLSTATEを持つドライバのエラー（asyncpg は sqlstate、psycopg2 は pgcode）"""
+
+    def __init__(self, message, sqlstate=None, pgcode=None):
+        super().__init__(message)
+        self.sqlstate = sqlstate
+        self.pgcode = pgcode
+
+
+def wrap(orig, error_class=DBAPIError):
+    return error_class("UPDATE time_slots SET available_spots = ?", {}, orig)
+
+
+def test_sqlite_lock_messages_are_retried():
+    assert is_lock_error(wrap(sqlite3.OperationalError("database is locked"), OperationalError))
+    assert is_lock_error(wrap(sqlite3.OperationalError("database table is locked"), OperationalError))
+    assert not is_lock_error(wrap(sqlite3.OperationalError("no such table: time_slots"), OperationalError))
+
+
+def test_postgres_serialization_and_deadlock_are_retried():
+    # asyncpg の直列化失敗は OperationalError ではなく DBAPIError として送出される
+    assert is_lock_error(wrap(PostgresError("could not serialize access", sqlstate="40001")))
+    assert is_lock_error(wrap(PostgresError("deadlock detected", pgcode="40P01"), OperationalError))
+    assert not is_lock_error(wrap(PostgresError("relation does not exist", sqlstate="42P01")))
@@ -0,0 +1,72 @@
+from sqlalchemy import inspect, text
+
+from api import models
+from api.database import create_db_engine
+from api.migrations import run_migrations
+
+# 予約日カラムが追加される前の旧バージョンのテーブル
+LEGACY_SCHEMA = [
+    """
+    CREATE TABLE users (
+        id INTEGER NOT NULL, email VARCHAR, hashed_password VARCHAR, full_name VARCHAR,
+        phone_number VARCHAR, is_admin BOOLEAN, is_active BOOLEAN, PRIMARY KEY (id)
+    )
+    """,
+    """
+    CREATE TABLE time_slots (
+        id INTEGER NOT NULL, date DATETIME, start_time TIME, end_time TIME, capacity INTEGER,
+        available_spots INTEGER, is_active BOOLEAN, created_at DATETIME, PRIMARY KEY (id)
+    )
+    """,
+    """
+    CREATE TABLE reservations (
+        id INTEGER NOT NULL, patient_id INTEGER, slot_id INTEGER, daily_number INTEGER,
+        qr_code_data VARCHAR, is_confirmed BOOLEAN, created_at DATETIME, PRIMARY KEY (id),
+        FOREIGN KEY(patient_id) REFERENCES users (id), FOREIGN KEY(slot_id) REFERENCES time_slots (id)
+    )
+    """,
+]
+
+
+def legacy_engine(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path}/legacy.db", profile="default")
+    with engine.begin() as conn:
+        for statement in LEGACY_SCHEMA:
+            conn.execute(text(statement))
+        conn.execute(text(
+            "INSERT INTO users VALUES (1, 'a@example.com', 'x', 'A', '0', 0, 1), (2, 'b@example.com', 'x', 'B', '0', 0, 1)"
+        ))
+        conn.execute(text(
+            """
+            INSERT INTO time_slots VALUES
+            (1, '2025-04-17 00:00:00.000000', '09:00:00.000000', '09:30:00.000000', 2, 0, 1, '2025-04-16 13:00:00.000000'),
+            (2, '2025-04-17 00:00:00.000000', '10:00:00.000000', '10:30:00.000000', 2, 1, 1, '2025-04-16 13:00:00.000000')
+            """
+        ))
+        # 患者1は同じ日に2件（旧バージョンでは重複を防げなかった）
+        conn.execute(text(
+            """
+            INSERT INTO reservations VALUES
+            (1, 1, 1, 1, 'qr-1', 0, '2025-04-16 14:00:00.000000'),
+            (2, 2, 1, 2, 'qr-2', 0, '2025-04-16 14:01:00.000000'),
+            (3, 1, 2, 3, 'qr-3', 0, '2025-04-16 14:02:00.000000')
+            """
+        ))
+    return engine
+
+
+def test_same_day_duplicates_are_cancelled_before_unique_index(tmp_path):
+    engine = legacy_engine(tmp_path)
+
+    models.Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+
+    with engine.connect() as conn:
+        reservations = conn.execute(text("SELECT id, patient_id FROM reservations ORDER BY id")).all()
+        available = dict(conn.execute(text("SELECT id, available_spots FROM time_slots")).all())
+        indexes = {index["name"]: index["unique"] for index in inspect(conn).get_indexes("reservations")}
+
+    # 最初の予約を残し、後の予約はキャンセルして枠を空きに戻す
+    assert reservations == [(1, 1), (2, 2)]
+    assert available == {1: 0, 2: 2}
+    assert indexes["ix_reservations_patient_date"]
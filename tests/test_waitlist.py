@@ -0,0 +1,57 @@
+from datetime import date, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+from api.main import app
+
+
+@pytest.fixture
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+def login(client, email, is_admin=False):
+    response = client.post("/register", json={
+        "email": email, "password": "password", "full_name": email, "phone_number": "0", "is_admin": is_admin
+    })
+    assert response.status_code == 200, response.text
+    response = client.post("/token", data={"username": email, "password": "password"})
+    return {"Authorization": "Bearer " + response.json()["access_token"]}
+
+
+def create_slot(client, headers, day, start_time, end_time):
+    response = client.post("/slots/", json={
+        "date": day.isoformat(), "start_time": start_time, "end_time": end_time, "capacity": 1
+    }, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def test_ineligible_patient_at_head_does_not_block_promotion(client):
+    admin = login(client, "waitlist-admin@example.com", is_admin=True)
+    first, head, second = (login(client, f"waitlist-{name}@example.com") for name in ("first", "head", "second"))
+    day = date.today() + timedelta(days=10)
+    slot_id = create_slot(client, admin, day, "09:00:00", "09:30:00")
+    other_slot_id = create_slot(client, admin, day + timedelta(days=1), "15:00:00", "15:30:00")
+
+    reservation = client.post("/reservations/", json={"slot_id": slot_id}, headers=first).json()
+    assert client.post("/reservations/", json={"slot_id": other_slot_id}, headers=head).status_code == 200
+    assert client.post("/waitlist/", json={"slot_id": slot_id}, headers=head).status_code == 200
+    assert client.post("/waitlist/", json={"slot_id": slot_id}, headers=second).status_code == 200
+
+    # 先頭の患者の別の予約が同じ日に移動され、この枠は予約できなくなる
+    response = client.put(f"/slots/{other_slot_id}", json={
+        "date": day.isoformat(), "start_time": "15:00:00", "end_time": "15:30:00", "capacity": 1
+    }, headers=admin)
+    assert response.status_code == 200, response.text
+
+    assert client.delete(f"/reservations/{reservation['id']}", headers=first).status_code == 204
+
+    # 先頭の患者は飛ばされ、次の患者が予約される
+    second_reservations = client.get("/reservations/", headers=second).json()
+    assert [item["slot_id"] for item in second_reservations] == [slot_id]
+    head_reservations = client.get("/reservations/", headers=head).json()
+    assert [item["slot_id"] for item in head_reservations] == [other_slot_id]
+    assert client.get("/waitlist/", headers=head).json() == []